@@ -1,18 +1,56 @@
+import time
+# Taken before the heavy imports so --profile-startup can account for them.
+STARTUP_BEGAN = time.perf_counter()
 import sys
 import os
+import html
 import json
+import math
+import multiprocessing
 import random
+import re
+import sqlite3
+import itertools
+from itertools import accumulate
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
-    QPushButton, QTextEdit, QScrollArea, QLineEdit, QComboBox, QSpinBox,
+    QPushButton, QTextEdit, QLineEdit, QComboBox, QSpinBox,
     QSlider, QCheckBox, QTabWidget, QGroupBox, QFontComboBox, QGridLayout,
-    QFrame, QSizePolicy
+    QFrame, QListView, QAbstractItemView, QAbstractScrollArea, QStyledItemDelegate, QStyle, QAction,
+    QGraphicsScene, QGraphicsPixmapItem, QGraphicsBlurEffect, qDrawBorderPixmap,
+    QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog, QMenu
 )
-from PyQt5.QtGui import QFont, QColor, QPalette, QTextOption
-from PyQt5.QtCore import Qt, pyqtSignal, QThread, pyqtSlot, QEvent, QTimer
-from PyQt5.QtWidgets import QGraphicsDropShadowEffect
-import google.generativeai as genai
+from PyQt5.QtGui import (
+    QFont, QColor, QPalette, QTextOption, QTextLayout, QPainter, QPen, QKeySequence,
+    QTextDocument, QAbstractTextDocumentLayout, QFontMetrics, QCursor, QPixmap, QPixmapCache, QImage, QRegion
+)
+from PyQt5.QtCore import (
+    Qt, pyqtSignal, QObject, QThread, pyqtSlot, QEvent, QTimer, QAbstractListModel, QModelIndex,
+    QPoint, QPointF, QRect, QRectF, QSize, QSortFilterProxyModel, QFileSystemWatcher, QMargins,
+    QItemSelection
+)
+from aui_core import (
+    CONFIG_FILE, KEY_FILE, CHAT_DIR, SESSION_EXT, CONTEXT_TOKEN_BUDGET, DEFAULT_RETRIES, REQUEST_TIMEOUT,
+    MODEL_NAME, WARM_IDLE_SECONDS, MAX_IN_FLIGHT,
+    RESPONSE_CACHE_FILE, RESPONSE_CACHE_MB, RESPONSE_CACHE_TTL_HOURS, BLOB_DIR, BlobStore,
+    ARCHIVE_AFTER_DAYS, SessionArchive, pick_codec, export_sessions, import_sessions, CancelToken,
+    session_files, delete_session_files, SessionStore, empty_meta, read_session_meta,
+    migrate_legacy_sessions, ResponseCache, AIRequest, RequestExecutor, RateLimiter, write_atomic, KeyStore, read_config,
+    warm_up, Metrics, process_rss, main as run_command
+)
+
+try:
+    import pygments
+    import pygments.formatters
+    import pygments.lexers
+    import pygments.util
+except ImportError:
+    pygments = None
 
 # Bennett Foddy quotes for response generation
 BENNETT_QUOTES = [
@@ -43,12 +81,37 @@ BENNETT_QUOTES = [
     "Keep going—you might surprise yourself someday.",
 ]
 
-CONFIG_FILE = "config.json"
-CHAT_DIR = "chat_sessions"
+# Settings changes are written once they have stopped changing for this long.
+CONFIG_SAVE_DEBOUNCE_MS = 500
+# Session files are fsynced once the app has been idle this long after a write.
+SYNC_IDLE_MS = 2000
+# Opening a session renders only the last PAGE_SIZE messages; older pages load while scrolling up.
+PAGE_SIZE = 200
+# Streamed chunks are coalesced and painted at most once per interval.
+STREAM_REPAINT_MS = 50
+# Opening more chat tabs than this closes the least recently used idle one.
+MAX_OPEN_CHATS = 8
+# --profile-startup flags a start whose first paint of the Chat tab takes longer than this.
+STARTUP_BUDGET_MS = 400
 
-if not os.path.exists(CHAT_DIR):
-    os.makedirs(CHAT_DIR)
+SEARCH_INDEX_FILE = "search_index.sqlite3"
+# History search waits for typing to pause this long before querying.
+SEARCH_DEBOUNCE_MS = 250
+# Directory change notifications are coalesced for this long before the History list is diffed.
+WATCH_DEBOUNCE_MS = 100
+# The event loop is probed this often; a probe running more than STALL_THRESHOLD_MS late counts as a stall.
+STALL_PROBE_MS = 50
+STALL_THRESHOLD_MS = 16
+# The Diagnostics tab refreshes this often while it is open; exports are written this often.
+METRICS_REFRESH_MS = 1000
+METRICS_EXPORT_MS = 10000
+METRICS_FILES = {"jsonl": "aui_metrics.jsonl", "prometheus": "aui_metrics.prom"}
+# The archive job first runs a minute after start-up, then every six hours.
+ARCHIVE_FIRST_RUN_MS = 60 * 1000
+ARCHIVE_INTERVAL_MS = 6 * 60 * 60 * 1000
 
+def format_size(size):
+    return f"{size / 1024:.1f} KB" if size < 1024 * 1024 else f"{size / 1024 / 1024:.1f} MB"
 # Gruvbox Theme Definitions
 class GruvboxTheme:
     DARK_SOFT = {
@@ -62,7 +125,10 @@ class GruvboxTheme:
         "accent": "#8ec07c",
         "delete": "#fb4934",
         "markdown": "#fe8019",
-        "code_bg": "#282828"
+        "code_bg": "#282828",
+        "input_bg": "#1d2021",
+        "border": "#665c54",
+        "accent_hover": "#a9d18e"
     }
     LIGHT_SOFT = {
         "name": "Gruvbox Light Soft",
@@ -75,161 +141,1829 @@ class GruvboxTheme:
         "accent": "#427b58",
         "delete": "#9d0006",
         "markdown": "#d75f00",
-        "code_bg": "#f2e5bc"
+        "code_bg": "#f2e5bc",
+        "input_bg": "#fbf1c7",
+        "border": "#bdae93",
+        "accent_hover": "#689d6a"
     }
 
-# ChatBubble: A bubble that fits the text size.
-class ChatBubble(QFrame):
-    def __init__(self, text, is_user, theme):
-        super().__init__()
-        self.is_user = is_user
-        self.theme = theme
-        self.text = text
-        self.init_ui()
-        self.apply_style()
+def theme_colors(theme):
+    return GruvboxTheme.DARK_SOFT if "Dark" in theme else GruvboxTheme.LIGHT_SOFT
 
-    def init_ui(self):
-        self.setFrameShape(QFrame.NoFrame)
-        self.layout = QVBoxLayout(self)
-        self.layout.setContentsMargins(12, 8, 12, 8)
-        self.label = QLabel(self.text)
-        self.label.setWordWrap(True)
-        self.label.setTextInteractionFlags(Qt.TextSelectableByMouse)
-        self.layout.addWidget(self.label)
-        self.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Preferred)
-        shadow = QGraphicsDropShadowEffect(self)
-        shadow.setBlurRadius(15)
-        shadow.setOffset(2, 2)
-        shadow.setColor(QColor(0, 0, 0, 120))
-        self.setGraphicsEffect(shadow)
-
-    def apply_style(self):
-        colors = GruvboxTheme.DARK_SOFT if "Dark" in self.theme else GruvboxTheme.LIGHT_SOFT
-        bg_color = colors["user_bubble"] if self.is_user else colors["ai_bubble"]
-        self.setStyleSheet(f"""
-            QFrame {{
-                background-color: {bg_color};
-                border-radius: 12px;
+# ThemeEngine: Compiles one application-wide stylesheet per theme. Widgets that need their own
+# look are matched by object name or dynamic property, so a theme change is a single cached
+# string swap. Fonts and bubble radius are not in the sheet: fonts go through setFont and the
+# delegates, and radius is a BubbleDelegate paint parameter, so neither repolishes the app.
+class ThemeEngine:
+    def __init__(self):
+        self.applied = None
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def compile(theme):
+        colors = theme_colors(theme)
+        return f"""
+            QMainWindow {{ background-color: {colors['window_bg']}; }}
+            QWidget {{ background-color: {colors['window_bg']}; color: {colors['text']}; }}
+            QPushButton {{
+                background-color: {colors['button_bg']};
+                color: {colors['text']};
+                border-radius: 8px;
+                padding: 8px;
             }}
-            QLabel {{
+            QPushButton:hover {{ background-color: {colors['button_hover']}; }}
+            QPushButton[flash="true"] {{ background-color: {colors['accent_hover']}; }}
+            QLineEdit, QComboBox, QSpinBox {{
+                background-color: {colors['button_bg']};
                 color: {colors['text']};
-                font-size: 14px;
+                border-radius: 5px;
+                padding: 6px;
             }}
-        """)
-
-# AIWorker: Handles API requests asynchronously.
-class AIWorker(QThread):
-    response_stream = pyqtSignal(str)
-    
-    def __init__(self, prompt, api_key):
-        super().__init__()
-        self.prompt = prompt
-        self.api_key = api_key
-        self.model_name = "gemini-2.5-pro-exp-03-25"
-
-    def run(self):
-        try:
-            genai.configure(api_key=self.api_key)
-            model = genai.GenerativeModel(self.model_name)
-            response = model.generate_content(self.prompt)
-            self.response_stream.emit(response.text)
-        except Exception as e:
-            self.response_stream.emit(f"API Error: {str(e)}")
-
-# HistoryItem: Represents a chat session in history.
-class HistoryItem(QWidget):
-    deleteClicked = pyqtSignal(str)
-    
-    def __init__(self, filename, theme):
-        super().__init__()
-        self.filename = filename
-        self.theme = theme
-        self.setObjectName("historyItem")
-        colors = GruvboxTheme.DARK_SOFT if "Dark" in theme else GruvboxTheme.LIGHT_SOFT
-        border_color = colors.get("border", "#665c54")
-        text_color = colors["text"]
-
-        layout = QHBoxLayout()
-        layout.setContentsMargins(15, 10, 15, 10)
-        layout.setSpacing(12)
-        
-        text_layout = QVBoxLayout()
-        self.title = QLabel(filename.split('.')[0])
-        self.title.setStyleSheet(f"font-size: 15px; font-weight: bold; color: {text_color};")
-        self.preview = QLabel("Last message preview...")
-        self.preview.setStyleSheet(f"font-size: 12px; color: {text_color};")
-        self.preview.setWordWrap(True)
-        self.preview.setMaximumHeight(40)
-        text_layout.addWidget(self.title)
-        text_layout.addWidget(self.preview)
-        
-        delete_btn = QPushButton("🗑")
-        delete_btn.setFixedSize(30, 30)
-        delete_btn.setCursor(Qt.PointingHandCursor)
-        delete_btn.setStyleSheet(f"""
-            QPushButton {{
+            QTabBar::tab {{
+                background: {colors['button_bg']};
+                color: {colors['accent']};
+                padding: 15px;
+            }}
+            QTabBar::tab:selected {{
+                background: {colors['button_hover']};
+                border-left: 3px solid {colors['accent']};
+            }}
+            QTabWidget#chatTabs QTabBar::tab {{
+                padding: 6px 12px;
+            }}
+            QTabWidget#chatTabs QTabBar::tab:selected {{
+                border-left: none;
+                border-bottom: 2px solid {colors['accent']};
+            }}
+            QAbstractScrollArea, QAbstractScrollArea > QWidget {{
+                background-color: {colors['window_bg']};
+                color: {colors['text']};
+            }}
+            QHeaderView::section {{
+                background-color: {colors['button_bg']};
+                color: {colors['accent']};
                 border: none;
-                background-color: transparent;
-                color: {colors.get("delete", "#fb4934")};
-                font-size: 16px;
+                padding: 6px;
             }}
-            QPushButton:hover {{
-                background-color: {border_color};
-                border-radius: 5px;
+            QScrollBar:vertical {{
+                background: {colors['button_bg']};
+                width: 12px;
+                margin: 0px;
             }}
-        """)
-        delete_btn.clicked.connect(lambda: self.deleteClicked.emit(self.filename))
-        
-        layout.addLayout(text_layout)
-        layout.addStretch()
-        layout.addWidget(delete_btn)
-        self.setLayout(layout)
-        self.setStyleSheet(f"""
-            QWidget#historyItem {{
-                background-color: {colors.get("window_bg", "#282828")};
-                border: 1px solid {border_color};
-                border-radius: 12px;
+            QScrollBar::handle:vertical {{
+                background: {colors['button_hover']};
+                min-height: 20px;
+            }}
+            QTextEdit#chatInput {{
+                background-color: {colors['input_bg']};
+                color: {colors['text']};
+                border: 2px solid {colors['border']};
+                border-radius: 8px;
+                padding: 8px;
             }}
-            QWidget#historyItem:hover {{
-                background-color: {colors.get("alt_background", "#3c3836")};
+            QPushButton#sendButton {{
+                background-color: {colors['accent']};
+                color: {colors['window_bg']};
+                border-radius: 8px;
+                padding: 10px;
             }}
-        """)
+            QPushButton#sendButton:hover, QPushButton#sendButton[flash="true"] {{
+                background-color: {colors['accent_hover']};
+            }}
+            QPushButton#stopButton {{
+                background-color: {colors['delete']};
+                color: {colors['window_bg']};
+                border-radius: 8px;
+                padding: 10px;
+            }}
+            QPushButton#stopButton:disabled {{
+                background-color: {colors['border']};
+            }}
+        """
+
+    # apply swaps the application stylesheet only when the compiled sheet actually changed.
+    def apply(self, theme):
+        sheet = self.compile(theme)
+        if sheet is not self.applied:
+            QApplication.instance().setStyleSheet(sheet)
+            self.applied = sheet
+        return sheet
+
+    @staticmethod
+    def palette(theme):
+        colors = theme_colors(theme)
+        palette = QPalette()
+        palette.setColor(QPalette.Window, QColor(colors['window_bg']))
+        palette.setColor(QPalette.WindowText, QColor(colors['text']))
+        palette.setColor(QPalette.Base, QColor(colors['button_bg']))
+        palette.setColor(QPalette.Text, QColor(colors['text']))
+        palette.setColor(QPalette.Button, QColor(colors['button_bg']))
+        palette.setColor(QPalette.ButtonText, QColor(colors['text']))
+        return palette
+
+# Shadow painting: a blurred rounded rect rendered once and stretched as a nine-patch, so
+# scrolling never blurs anything. BLUR plus the vertical offset stays inside half of
+# BubbleDelegate.SPACING, so a shadow never reaches into a neighbouring row.
+SHADOW_BLUR = 4
+SHADOW_OFFSET = 2
+SHADOW_LIMIT = 2000
+# Corner sizes are bucketed to this step so tiny bubbles share a handful of pixmaps.
+SHADOW_BUCKET = 4
+
+# shadow_pixmap: Returns the nine-patch source for (radius, theme, corner bucket) from QPixmapCache.
+def shadow_pixmap(radius, theme_name, corner):
+    key = f"aui-shadow:{radius}:{theme_name}:{corner}"
+    pixmap = QPixmapCache.find(key)
+    if pixmap is not None and not pixmap.isNull():
+        return pixmap
+    # The source is just big enough to hold four corners around a one-pixel stretchable centre.
+    side = 2 * corner + 1
+    shape = QPixmap(side - 2 * SHADOW_BLUR, side - 2 * SHADOW_BLUR)
+    shape.fill(Qt.transparent)
+    painter = QPainter(shape)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(QColor(0, 0, 0, 110 if "Dark" in theme_name else 60))
+    inner = min(radius, (side - 2 * SHADOW_BLUR) // 2)
+    painter.drawRoundedRect(QRectF(shape.rect()), inner, inner)
+    painter.end()
+    scene = QGraphicsScene()
+    item = QGraphicsPixmapItem(shape)
+    item.setOffset(SHADOW_BLUR, SHADOW_BLUR)
+    blur = QGraphicsBlurEffect()
+    blur.setBlurRadius(SHADOW_BLUR * 2)
+    item.setGraphicsEffect(blur)
+    scene.addItem(item)
+    image = QImage(side, side, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    scene.render(painter, QRectF(0, 0, side, side), QRectF(0, 0, side, side))
+    painter.end()
+    pixmap = QPixmap.fromImage(image)
+    QPixmapCache.insert(key, pixmap)
+    return pixmap
+
+# Markdown: a small block/inline renderer for chat replies. Text is split into blocks
+# (fenced code, headings, lists, quotes, paragraphs) and each block becomes an HTML fragment
+# for QTextDocument; single newlines stay line breaks, as they were in the plain bubbles.
+MD_FENCE = re.compile(r"^\s*(```|~~~)\s*([\w+#.-]*)")
+MD_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+MD_LIST = re.compile(r"^\s*([-*+]|\d{1,3}[.)])\s+(.*)$")
+MD_QUOTE = re.compile(r"^\s*>\s?(.*)$")
+MD_INLINE = re.compile(
+    r"`([^`\n]+)`|\*\*(.+?)\*\*|__(.+?)__|(?<![\w*])\*(?!\s)([^*\n]+?)\*(?![\w*])|\[([^\]\n]+)\]\(([^)\s]+)\)"
+)
+# Messages without any of these go through the plain QTextLayout path.
+MD_HINT = re.compile(r"`|\*\*|__|\*\S|\]\(|^\s*(?:#{1,6}\s|[-*+]\s|\d{1,3}[.)]\s|>)", re.M)
+MARKDOWN_CACHE_SIZE = 2048
+
+def looks_like_markdown(text):
+    return MD_HINT.search(text) is not None
+
+def md_inline(text, colors):
+    def replace(match):
+        code, bold, bold_alt, italic, link_text, link_url = match.groups()
+        if code is not None:
+            return (f'<span style="font-family: monospace; color: {colors["markdown"]}; '
+                    f'background-color: {colors["code_bg"]};">{code}</span>')
+        if bold is not None or bold_alt is not None:
+            return f"<b>{md_inline(bold if bold is not None else bold_alt, colors)}</b>"
+        if italic is not None:
+            return f"<i>{md_inline(italic, colors)}</i>"
+        return f'<a href="{link_url}" style="color: {colors["accent"]};">{md_inline(link_text, colors)}</a>'
+    return MD_INLINE.sub(replace, text)
+
+# highlight_code: Syntax-highlights one code block with Pygments when it is installed, otherwise
+# escapes it. Cached, so re-rendering a message for another theme only re-colours new blocks.
+@lru_cache(maxsize=1024)
+def highlight_code(code, language, theme_name):
+    if pygments is not None and code:
+        try:
+            lexer = pygments.lexers.get_lexer_by_name(language) if language else pygments.lexers.TextLexer()
+        except pygments.util.ClassNotFound:
+            lexer = pygments.lexers.TextLexer()
+        style = "gruvbox-dark" if "Dark" in theme_name else "gruvbox-light"
+        try:
+            formatter = pygments.formatters.HtmlFormatter(nowrap=True, noclasses=True, style=style)
+        except pygments.util.ClassNotFound:
+            formatter = pygments.formatters.HtmlFormatter(nowrap=True, noclasses=True)
+        return pygments.highlight(code, lexer, formatter).rstrip("\n")
+    return html.escape(code)
+
+# parse_markdown: Renders text[start:] into [(end_offset, html), ...], one entry per block.
+def parse_markdown(text, start, colors):
+    blocks = []
+    lines = []
+    pos = start
+    while pos < len(text):
+        end = text.find("\n", pos)
+        end = len(text) if end < 0 else end + 1
+        lines.append((text[pos:end].rstrip("\n"), end))
+        pos = end
+    i = 0
+    while i < len(lines):
+        line, end = lines[i]
+        first = not blocks and start == 0
+        margin = "margin-top: 0px;" if first else "margin-top: 6px;"
+        if not line.strip():
+            i += 1
+            continue
+        fence = MD_FENCE.match(line)
+        if fence:
+            body = []
+            i += 1
+            while i < len(lines) and not lines[i][0].strip().startswith(fence.group(1)):
+                body.append(lines[i][0])
+                i += 1
+            if i < len(lines):
+                end = lines[i][1]
+                i += 1
+            elif body:
+                end = lines[-1][1]
+            code = highlight_code("\n".join(body), fence.group(2).lower(), colors["name"])
+            blocks.append((end, (
+                f'<table width="100%" cellspacing="0" cellpadding="8" bgcolor="{colors["code_bg"]}" '
+                f'style="{margin}"><tr><td><pre style="margin: 0px; font-family: monospace;">{code}</pre>'
+                f'</td></tr></table>'
+            )))
+            continue
+        heading = MD_HEADING.match(line)
+        if heading:
+            size = {1: "x-large", 2: "large"}.get(len(heading.group(1)), "medium")
+            blocks.append((end, (
+                f'<p style="{margin} margin-bottom: 0px; font-size: {size}; font-weight: 600; '
+                f'color: {colors["markdown"]};">{md_inline(html.escape(heading.group(2)), colors)}</p>'
+            )))
+            i += 1
+            continue
+        if MD_LIST.match(line):
+            ordered = line.strip()[0].isdigit()
+            items = []
+            while i < len(lines):
+                item = MD_LIST.match(lines[i][0])
+                if item and item.group(1)[0].isdigit() != ordered:
+                    break
+                if item:
+                    items.append(md_inline(html.escape(item.group(2)), colors))
+                elif lines[i][0].startswith((" ", "\t")) and lines[i][0].strip() and items:
+                    items[-1] += "<br>" + md_inline(html.escape(lines[i][0].strip()), colors)
+                else:
+                    break
+                end = lines[i][1]
+                i += 1
+            tag = "ol" if ordered else "ul"
+            body = "".join(f"<li>{item}</li>" for item in items)
+            blocks.append((end, f'<{tag} style="{margin} margin-bottom: 0px;">{body}</{tag}>'))
+            continue
+        if MD_QUOTE.match(line):
+            quoted = []
+            while i < len(lines) and MD_QUOTE.match(lines[i][0]):
+                quoted.append(md_inline(html.escape(MD_QUOTE.match(lines[i][0]).group(1)), colors))
+                end = lines[i][1]
+                i += 1
+            blocks.append((end, (
+                f'<p style="{margin} margin-bottom: 0px; margin-left: 12px; font-style: italic; '
+                f'color: {colors["accent"]};">{"<br>".join(quoted)}</p>'
+            )))
+            continue
+        paragraph = []
+        while i < len(lines):
+            line = lines[i][0]
+            if not line.strip() or MD_FENCE.match(line) or MD_HEADING.match(line) or MD_LIST.match(line) or MD_QUOTE.match(line):
+                break
+            paragraph.append(md_inline(html.escape(line), colors))
+            end = lines[i][1]
+            i += 1
+        blocks.append((end, f'<p style="{margin} margin-bottom: 0px;">{"<br>".join(paragraph)}</p>'))
+    return blocks
+
+# MarkdownRenderer: Caches rendered blocks per (message id, theme). When a streamed reply grows,
+# blocks whose following line was already complete are final and kept; parsing restarts there.
+class MarkdownRenderer:
+    def __init__(self, max_entries=MARKDOWN_CACHE_SIZE):
+        self.max_entries = max_entries
+        # (msg_id, theme name) -> (text, blocks, html)
+        self.cache = OrderedDict()
+
+    def render(self, msg_id, text, colors):
+        key = (msg_id, colors["name"])
+        cached = self.cache.get(key)
+        if cached and cached[0] == text:
+            self.cache.move_to_end(key)
+            return cached[2]
+        blocks = []
+        if cached and text.startswith(cached[0]):
+            # A block ends at the line that cannot continue it; once that line is complete
+            # (a newline follows it) later text cannot change how the block was parsed.
+            last_newline = cached[0].rfind("\n")
+            blocks = [block for block in cached[1] if block[0] <= last_newline]
+        start = blocks[-1][0] if blocks else 0
+        blocks = blocks + parse_markdown(text, start, colors)
+        rendered = "".join(fragment for _, fragment in blocks)
+        self.cache[key] = (text, blocks, rendered)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return rendered
+
+# Item data roles exposed by TranscriptModel.
+MessageIdRole = Qt.UserRole + 1
+IsUserRole = Qt.UserRole + 2
+IsErrorRole = Qt.UserRole + 3
+
+# TranscriptModel: Holds chat messages as [id, sender, text] rows; no widgets are created per message.
+# Failed requests are rows too, marked in errors so they can be drawn differently; they live only
+# in the view and are never written to the session.
+class TranscriptModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages = []
+        self.errors = set()
+        # msg_id -> (prompt text, attachment records) of a "You" row, for Ask Again
+        self.prompts = {}
+        self.next_id = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        msg_id, sender, text = self.messages[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == MessageIdRole:
+            return msg_id
+        if role == IsUserRole:
+            return sender == "You"
+        if role == IsErrorRole:
+            return msg_id in self.errors
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable if index.isValid() else Qt.NoItemFlags
+
+    def new_row(self, sender, text, prompt=None, attachments=None):
+        self.next_id += 1
+        if sender == "You" and prompt is not None:
+            self.prompts[self.next_id] = (prompt, attachments or ())
+        return [self.next_id, sender, text]
+
+    def append(self, sender, text, prompt=None, attachments=None):
+        row = len(self.messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        message = self.new_row(sender, text, prompt, attachments)
+        self.messages.append(message)
+        self.endInsertRows()
+        return message[0]
+
+    # extend inserts a whole batch of (sender, text[, prompt, attachments]) with a single rowsInserted notification.
+    def extend(self, pairs):
+        rows = [self.new_row(*pair) for pair in pairs]
+        if not rows:
+            return
+        start = len(self.messages)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self.messages.extend(rows)
+        self.endInsertRows()
+
+    # prepend inserts an older page above the current rows.
+    def prepend(self, pairs):
+        rows = [self.new_row(*pair) for pair in pairs]
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self.messages[:0] = rows
+        self.endInsertRows()
+
+    def find_row(self, msg_id):
+        # Messages being updated (streamed replies) sit at the end, so search backwards.
+        for row in range(len(self.messages) - 1, -1, -1):
+            if self.messages[row][0] == msg_id:
+                return row
+        return -1
+
+    def set_text(self, msg_id, text):
+        row = self.find_row(msg_id)
+        if row < 0:
+            return
+        self.messages[row][2] = text
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def set_error(self, msg_id, text):
+        self.errors.add(msg_id)
+        self.set_text(msg_id, text)
+
+    def clear(self):
+        self.beginResetModel()
+        self.messages = []
+        self.errors = set()
+        self.prompts = {}
+        self.endResetModel()
+
+# BubbleDelegate: Paints chat bubbles directly and caches their text layouts.
+class BubbleDelegate(QStyledItemDelegate):
+    PADDING_H = 12
+    PADDING_V = 8
+    MARGIN_H = 10
+    SPACING = 12
+    MAX_WIDTH_RATIO = 0.75
+    LAYOUT_CACHE_SIZE = 512
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.colors = GruvboxTheme.DARK_SOFT
+        self.font = QFont()
+        self.radius = 12
+        self.shadows = True
+        self.shadow_limit = SHADOW_LIMIT
+        # msg_id -> (width, text, size); cheap enough to keep for every row.
+        self.size_cache = {}
+        # msg_id -> (width, text, QTextLayout or QTextDocument); bounded, only visible rows need one.
+        self.layout_cache = OrderedDict()
+        self.markdown = MarkdownRenderer()
+        self.metrics = QFontMetrics(self.font)
+
+    def set_theme(self, theme):
+        self.colors = theme_colors(theme)
+        # Markdown documents carry theme colours; sizes do not change, so only drop the layouts.
+        self.layout_cache.clear()
+
+    def set_font(self, font):
+        self.font = QFont(font)
+        self.metrics = QFontMetrics(self.font)
+        self.clear_cache()
+
+    def set_radius(self, radius):
+        self.radius = radius
+
+    # set_shadows: Shadows are skipped for transcripts longer than limit (0 means no limit).
+    def set_shadows(self, enabled, limit=SHADOW_LIMIT):
+        self.shadows = enabled
+        self.shadow_limit = limit
+
+    def draw_shadow(self, painter, rect, count):
+        if not self.shadows or (self.shadow_limit and count > self.shadow_limit):
+            return
+        target = rect.translated(0, SHADOW_OFFSET).adjusted(-SHADOW_BLUR, -SHADOW_BLUR, SHADOW_BLUR, SHADOW_BLUR)
+        corner = min(self.radius + 2 * SHADOW_BLUR, target.width() // 2, target.height() // 2)
+        corner = max(SHADOW_BUCKET, corner - corner % SHADOW_BUCKET)
+        pixmap = shadow_pixmap(self.radius, self.colors["name"], corner)
+        qDrawBorderPixmap(painter, target, QMargins(corner, corner, corner, corner), pixmap)
+
+    def clear_cache(self):
+        self.size_cache.clear()
+        self.layout_cache.clear()
+
+    def text_width(self, view_width):
+        return max(40, int(view_width * self.MAX_WIDTH_RATIO) - 2 * self.PADDING_H)
+
+    def build_layout(self, msg_id, text, width):
+        if looks_like_markdown(text):
+            return self.build_document(msg_id, text, width)
+        layout = QTextLayout(text.replace("\n", "\u2028"), self.font)
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapAtWordBoundaryOrAnywhere)
+        layout.setTextOption(option)
+        layout.setCacheEnabled(True)
+        height = 0.0
+        natural = 0.0
+        layout.beginLayout()
+        while True:
+            line = layout.createLine()
+            if not line.isValid():
+                break
+            line.setLineWidth(width)
+            line.setPosition(QPointF(0, height))
+            height += line.height()
+            natural = max(natural, line.naturalTextWidth())
+        layout.endLayout()
+        return layout, QSize(int(math.ceil(natural)), int(math.ceil(height)))
+
+    def build_document(self, msg_id, text, width):
+        document = QTextDocument()
+        document.setDocumentMargin(0)
+        document.setDefaultFont(self.font)
+        document.setHtml(self.markdown.render(msg_id, text, self.colors))
+        document.setTextWidth(width)
+        natural = min(width, document.idealWidth())
+        return document, QSize(int(math.ceil(natural)), int(math.ceil(document.size().height())))
+
+    def text_size(self, msg_id, text, width):
+        cached = self.size_cache.get(msg_id)
+        if cached and cached[0] == width and cached[1] is text:
+            return cached[2]
+        layout, size = self.build_layout(msg_id, text, width)
+        self.size_cache[msg_id] = (width, text, size)
+        self.remember_layout(msg_id, width, text, layout)
+        return size
+
+    def text_layout(self, msg_id, text, width):
+        cached = self.layout_cache.get(msg_id)
+        if cached and cached[0] == width and cached[1] is text:
+            self.layout_cache.move_to_end(msg_id)
+            return cached[2]
+        layout, size = self.build_layout(msg_id, text, width)
+        self.size_cache[msg_id] = (width, text, size)
+        self.remember_layout(msg_id, width, text, layout)
+        return layout
+
+    def remember_layout(self, msg_id, width, text, layout):
+        self.layout_cache[msg_id] = (width, text, layout)
+        self.layout_cache.move_to_end(msg_id)
+        while len(self.layout_cache) > self.LAYOUT_CACHE_SIZE:
+            self.layout_cache.popitem(last=False)
+
+    def view_width(self, option):
+        view = self.parent()
+        return view.viewport().width() if view is not None else option.rect.width()
+
+    def sizeHint(self, option, index):
+        view_width = self.view_width(option)
+        msg_id, sender, text = index.model().messages[index.row()]
+        return QSize(view_width, self.row_height(msg_id, text, view_width))
+
+    def row_height(self, msg_id, text, view_width):
+        return self.text_size(msg_id, text, self.text_width(view_width)).height() + 2 * self.PADDING_V + self.SPACING
+
+    # estimate_height returns (height, exact): the cached size when there is one for this width and
+    # text, otherwise a guess from the text's length and line breaks that builds no layout.
+    def estimate_height(self, msg_id, text, view_width):
+        width = self.text_width(view_width)
+        cached = self.size_cache.get(msg_id)
+        if cached and cached[0] == width and cached[1] is text:
+            return cached[2].height() + 2 * self.PADDING_V + self.SPACING, True
+        per_line = max(1, width // max(1, self.metrics.averageCharWidth()))
+        lines = text.count("\n") + 1 + len(text) // per_line
+        return lines * self.metrics.lineSpacing() + 2 * self.PADDING_V + self.SPACING, False
+
+    def paint(self, painter, option, index):
+        msg_id, sender, text = index.model().messages[index.row()]
+        is_user = sender == "You"
+        layout = self.text_layout(msg_id, text, self.text_width(self.view_width(option)))
+        size = self.size_cache[msg_id][2]
+        w = size.width() + 2 * self.PADDING_H
+        h = size.height() + 2 * self.PADDING_V
+        top = option.rect.top() + self.SPACING // 2
+        if is_user:
+            rect = QRect(option.rect.right() - self.MARGIN_H - w, top, w, h)
+        else:
+            rect = QRect(option.rect.left() + self.MARGIN_H, top, w, h)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        self.draw_shadow(painter, rect, len(index.model().messages))
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(self.colors["user_bubble"] if is_user else self.colors["ai_bubble"]))
+        if msg_id in index.model().errors:
+            painter.setPen(QPen(QColor(self.colors["delete"]), 2))
+        elif option.state & QStyle.State_Selected:
+            painter.setPen(QPen(QColor(self.colors["accent"]), 2))
+        painter.drawRoundedRect(QRectF(rect), self.radius, self.radius)
+        painter.setPen(QColor(self.colors["text"]))
+        origin = QPointF(rect.left() + self.PADDING_H, rect.top() + self.PADDING_V)
+        if isinstance(layout, QTextDocument):
+            painter.translate(origin)
+            context = QAbstractTextDocumentLayout.PaintContext()
+            context.palette.setColor(QPalette.Text, QColor(self.colors["text"]))
+            layout.documentLayout().draw(painter, context)
+        else:
+            layout.draw(painter, origin)
+        painter.restore()
+
+# TranscriptView: Virtualized list of chat bubbles that keeps its own geometry: one height per
+# row and their running totals (tops), so painting, hit-testing and scrolling find rows by
+# bisection. New rows get the delegate's estimate and are measured only when they come into
+# view; an edited row (a streamed reply) is re-measured on its own, never the whole list.
+class TranscriptView(QAbstractItemView):
+    near_top = pyqtSignal()
+    ask_again_requested = pyqtSignal(int)
+    NEAR_TOP_PX = 200
+    SCROLL_STEP = 20
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.heights = []
+        # exact[row] is False while heights[row] is still an estimate.
+        self.exact = []
+        # tops[row] is where row starts; tops[-1] is the height of the whole transcript.
+        self.tops = [0]
+        self.layout_width = 0
+        self.holding = False
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.verticalScrollBar().setSingleStep(self.SCROLL_STEP)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setFrameShape(QFrame.NoFrame)
+        self.setContextMenuPolicy(Qt.ActionsContextMenu)
+        copy_action = QAction("Copy", self)
+        copy_action.setShortcut(QKeySequence.Copy)
+        copy_action.setShortcutContext(Qt.WidgetShortcut)
+        copy_action.triggered.connect(self.copy_selection)
+        self.addAction(copy_action)
+        ask_again_action = QAction("Ask Again Without Cache", self)
+        ask_again_action.triggered.connect(
+            lambda: self.currentIndex().isValid() and self.ask_again_requested.emit(self.currentIndex().row())
+        )
+        self.addAction(ask_again_action)
+        self.verticalScrollBar().valueChanged.connect(self.check_near_top)
+        self.geometry_timer = QTimer(self)
+        self.geometry_timer.setSingleShot(True)
+        self.geometry_timer.timeout.connect(self.updateGeometries)
+
+    def check_near_top(self, value):
+        if value <= self.NEAR_TOP_PX:
+            self.near_top.emit()
+
+    def messages(self):
+        model = self.model()
+        return model.messages if model is not None else []
+
+    def retop(self, start):
+        self.tops[start + 1:] = list(accumulate(self.heights[start:], initial=self.tops[start]))[1:]
+
+    # estimate: (height, exact) for each row in [start, stop) at the current width.
+    def estimate(self, start, stop):
+        delegate = self.itemDelegate()
+        width = self.viewport().width()
+        return [delegate.estimate_height(msg_id, text, width) for msg_id, sender, text in self.messages()[start:stop]]
+
+    def rebuild_geometry(self):
+        estimates = self.estimate(0, len(self.messages()))
+        self.heights = [height for height, exact in estimates]
+        self.exact = [exact for height, exact in estimates]
+        self.tops = [0]
+        self.retop(0)
+        self.layout_width = self.viewport().width()
+
+    # measure replaces the estimates in [first, last] with real heights; returns True if any moved.
+    def measure(self, first, last):
+        messages = self.messages()
+        delegate = self.itemDelegate()
+        width = self.viewport().width()
+        changed = None
+        for row in range(max(0, first), min(last, len(self.heights) - 1) + 1):
+            if self.exact[row]:
+                continue
+            msg_id, sender, text = messages[row]
+            height = delegate.row_height(msg_id, text, width)
+            self.exact[row] = True
+            if height != self.heights[row]:
+                self.heights[row] = height
+                changed = row if changed is None else changed
+        if changed is not None:
+            self.retop(changed)
+        return changed is not None
+
+    def row_at(self, y):
+        return min(max(0, bisect_right(self.tops, y) - 1), len(self.heights) - 1)
+
+    # measure_visible measures the rows on screen. Only rows from the first visible one down
+    # change, so the content does not move; shrinking rows can pull more in, hence the loop.
+    def measure_visible(self):
+        if not self.heights:
+            return False
+        offset = self.verticalOffset()
+        changed = False
+        while self.measure(self.row_at(offset), self.row_at(offset + self.viewport().height())):
+            changed = True
+        return changed
+
+    def refresh(self):
+        if self.holding:
+            return
+        self.measure_visible()
+        self.updateGeometries()
+        self.viewport().update()
+
+    # reflow re-estimates every row after a width or font change, keeping the first visible row
+    # in place, or the bottom in view if that is where the transcript was.
+    def reflow(self):
+        follow = self.is_at_bottom()
+        anchor = self.row_at(self.verticalOffset()) if self.heights else 0
+        within = self.verticalOffset() - self.tops[anchor] if self.heights else 0
+        self.rebuild_geometry()
+        if follow:
+            self.scrollToBottom()
+            return
+        self.measure(anchor, anchor)
+        self.updateGeometries()
+        if self.heights:
+            self.verticalScrollBar().setValue(self.tops[anchor] + min(within, self.heights[anchor] - 1))
+        self.refresh()
+
+    def relayout(self):
+        self.reflow()
+
+    # keep_position runs insert() (which adds rows above the viewport) without moving the content.
+    def keep_position(self, insert):
+        bar = self.verticalScrollBar()
+        total = self.tops[-1]
+        value = bar.value()
+        self.holding = True
+        try:
+            insert()
+        finally:
+            self.holding = False
+        self.updateGeometries()
+        bar.setValue(value + self.tops[-1] - total)
+        self.refresh()
+
+    def rowsInserted(self, parent, start, end):
+        super().rowsInserted(parent, start, end)
+        estimates = self.estimate(start, end + 1)
+        self.heights[start:start] = [height for height, exact in estimates]
+        self.exact[start:start] = [exact for height, exact in estimates]
+        self.tops[start + 1:start + 1] = [0] * len(estimates)
+        self.retop(start)
+        self.refresh()
+
+    def rowsAboutToBeRemoved(self, parent, start, end):
+        super().rowsAboutToBeRemoved(parent, start, end)
+        del self.heights[start:end + 1]
+        del self.exact[start:end + 1]
+        del self.tops[start + 1:end + 2]
+        self.retop(start)
+        self.geometry_timer.start()
+
+    def reset(self):
+        super().reset()
+        self.rebuild_geometry()
+        self.refresh()
+
+    # An edited row is measured again right away if it is on screen, otherwise it gets a new estimate.
+    def dataChanged(self, top_left, bottom_right, roles=()):
+        first, last = top_left.row(), bottom_right.row()
+        for row, (height, exact) in enumerate(self.estimate(first, last + 1), first):
+            self.heights[row] = height
+            self.exact[row] = exact
+        self.retop(first)
+        offset = self.verticalOffset()
+        self.measure(max(first, self.row_at(offset)), min(last, self.row_at(offset + self.viewport().height())))
+        self.refresh()
+
+    def doItemsLayout(self):
+        if len(self.heights) != len(self.messages()) or self.layout_width != self.viewport().width():
+            self.rebuild_geometry()
+        super().doItemsLayout()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.viewport().width() != self.layout_width:
+            self.reflow()
+        else:
+            self.refresh()
+
+    def updateGeometries(self):
+        bar = self.verticalScrollBar()
+        height = self.viewport().height()
+        bar.setSingleStep(self.SCROLL_STEP)
+        bar.setPageStep(height)
+        bar.setRange(0, max(0, self.tops[-1] - height))
+        super().updateGeometries()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        if self.measure_visible():
+            self.geometry_timer.start()
+            self.viewport().update()
+
+    # scrollToBottom measures the rows that end up on screen before jumping, so the end of the
+    # range is exact.
+    def scrollToBottom(self):
+        row = len(self.heights) - 1
+        covered = 0
+        while row >= 0 and covered < self.viewport().height():
+            self.measure(row, row)
+            covered += self.heights[row]
+            row -= 1
+        self.updateGeometries()
+        self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
+        self.viewport().update()
+
+    def scrollTo(self, index, hint=QAbstractItemView.EnsureVisible):
+        if not index.isValid() or index.row() >= len(self.heights):
+            return
+        row = index.row()
+        self.measure(row, row)
+        self.updateGeometries()
+        top, bottom = self.tops[row], self.tops[row + 1]
+        value = self.verticalOffset()
+        height = self.viewport().height()
+        if hint == QAbstractItemView.PositionAtTop or (hint == QAbstractItemView.EnsureVisible and top < value):
+            value = top
+        elif hint == QAbstractItemView.PositionAtBottom or (
+            hint == QAbstractItemView.EnsureVisible and bottom > value + height
+        ):
+            value = bottom - height
+        elif hint == QAbstractItemView.PositionAtCenter:
+            value = top - (height - (bottom - top)) // 2
+        self.verticalScrollBar().setValue(value)
+
+    def visualRect(self, index):
+        if not index.isValid() or index.row() >= len(self.heights):
+            return QRect()
+        row = index.row()
+        return QRect(0, self.tops[row] - self.verticalOffset(), self.viewport().width(), self.heights[row])
+
+    def indexAt(self, point):
+        y = point.y() + self.verticalOffset()
+        if not self.heights or y < 0 or y >= self.tops[-1]:
+            return QModelIndex()
+        return self.model().index(self.row_at(y), 0)
+
+    def horizontalOffset(self):
+        return 0
+
+    def verticalOffset(self):
+        return self.verticalScrollBar().value()
+
+    def isIndexHidden(self, index):
+        return False
+
+    def moveCursor(self, action, modifiers):
+        if not self.heights:
+            return QModelIndex()
+        row = max(0, self.currentIndex().row())
+        page = self.viewport().height()
+        target = {
+            QAbstractItemView.MoveUp: row - 1,
+            QAbstractItemView.MoveDown: row + 1,
+            QAbstractItemView.MovePageUp: self.row_at(self.tops[row] - page),
+            QAbstractItemView.MovePageDown: self.row_at(self.tops[row] + page),
+            QAbstractItemView.MoveHome: 0,
+            QAbstractItemView.MoveEnd: len(self.heights) - 1,
+        }.get(action, row)
+        return self.model().index(min(max(0, target), len(self.heights) - 1), 0)
+
+    def setSelection(self, rect, command):
+        if not self.heights:
+            return
+        offset = self.verticalOffset()
+        rect = rect.normalized()
+        first, last = self.row_at(rect.top() + offset), self.row_at(rect.bottom() + offset)
+        model = self.model()
+        self.selectionModel().select(QItemSelection(model.index(first, 0), model.index(last, 0)), command)
+
+    def visualRegionForSelection(self, selection):
+        region = QRegion()
+        offset = self.verticalOffset()
+        width = self.viewport().width()
+        for selected in selection:
+            top, bottom = selected.top(), min(selected.bottom(), len(self.heights) - 1)
+            if top <= bottom:
+                region += QRect(0, self.tops[top] - offset, width, self.tops[bottom + 1] - self.tops[top])
+        return region
+
+    # paintEvent paints only the rows that meet the dirty rectangle.
+    def paintEvent(self, event):
+        if not self.heights:
+            return
+        offset = self.verticalOffset()
+        area = event.rect()
+        if self.measure(self.row_at(offset + area.top()), self.row_at(offset + area.bottom())):
+            self.geometry_timer.start()
+        painter = QPainter(self.viewport())
+        option = self.viewOptions()
+        state = option.state
+        width = self.viewport().width()
+        model = self.model()
+        selection = self.selectionModel()
+        delegate = self.itemDelegate()
+        for row in range(self.row_at(offset + area.top()), self.row_at(offset + area.bottom()) + 1):
+            index = model.index(row, 0)
+            option.rect = QRect(0, self.tops[row] - offset, width, self.heights[row])
+            option.state = state | QStyle.State_Selected if selection.isSelected(index) else state
+            delegate.paint(painter, option, index)
+
+    def copy_selection(self):
+        rows = sorted(index.row() for index in self.selectionModel().selectedIndexes())
+        model = self.model()
+        text = "\n\n".join(model.index(row).data(Qt.DisplayRole) for row in rows)
+        if text:
+            QApplication.clipboard().setText(text)
+
+    # Bubble sizes come from the delegate's font, not the widget style, so a stylesheet swap
+    # only needs a repaint; QAbstractItemView would otherwise re-measure every row.
+    def event(self, event):
+        if event.type() == QEvent.StyleChange:
+            result = QAbstractScrollArea.event(self, event)
+            self.viewport().update()
+            return result
+        return super().event(event)
+
+    def is_at_bottom(self):
+        bar = self.verticalScrollBar()
+        return bar.value() >= bar.maximum() - 4
+
+# RequestSignals: Carries RequestExecutor callbacks from the worker threads to the GUI thread;
+# the signals are queued, so the connected slots always run on the GUI thread.
+class RequestSignals(QObject):
+    response_stream = pyqtSignal(int, str)
+    response_done = pyqtSignal(int, str)
+    response_error = pyqtSignal(int, str)
+    retrying = pyqtSignal(int, int, float, str)
+    first_token = pyqtSignal(int, float)
+
+# AttachmentSignals: Reports files copied into the blob store by the attachment threads.
+class AttachmentSignals(QObject):
+    imported = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+# ArchiveSignals: Reports the end of a run of the archive job, and of restoring an archived chat.
+class ArchiveSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    restored = pyqtSignal(str)
+    restore_failed = pyqtSignal(str, str)
+
+# TransferSignals: Progress and the outcome of an export or import run by the transfer thread.
+class TransferSignals(QObject):
+    progress = pyqtSignal(str, int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+# SearchIndex: SQLite FTS5 index over message bodies. Every session remembers how many of
+# its records are indexed, so catching up after a restart only reads the new records.
+class SearchIndex:
+    BATCH = 1000
+    HIT, END = "\x02", "\x03"
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+            "text, session UNINDEXED, msg_id UNINDEXED, prefix='2 3')"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (name TEXT PRIMARY KEY, records INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def indexed(self, session):
+        row = self.conn.execute("SELECT records FROM sessions WHERE name = ?", (session,)).fetchone()
+        return row[0] if row else 0
+
+    def insert(self, session, records, count):
+        self.conn.executemany(
+            "INSERT INTO messages (text, session, msg_id) VALUES (?, ?, ?)",
+            [(record["text"], session, record["id"]) for record in records],
+        )
+        self.conn.execute(
+            "INSERT INTO sessions (name, records) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET records = excluded.records",
+            (session, count),
+        )
+
+    # add is called from the append path with the record's position in its session.
+    def add(self, chat_dir, session, position, record):
+        indexed = self.indexed(session)
+        if indexed > position:
+            return
+        if indexed < position:
+            self.catch_up(chat_dir, session, position)
+        self.insert(session, [record], position + 1)
+        self.conn.commit()
+
+    def catch_up(self, chat_dir, session, stop=None):
+        store = SessionStore(os.path.join(chat_dir, session))
+        total = len(store) if stop is None else stop
+        indexed = self.indexed(session)
+        if indexed > total:
+            # The file was replaced or truncated; start over.
+            self.remove(session)
+            indexed = 0
+        for start in range(indexed, total, self.BATCH):
+            end = min(total, start + self.BATCH)
+            self.insert(session, store.read_range(start, end), end)
+        self.conn.commit()
+
+    def remove(self, session):
+        self.conn.execute("DELETE FROM messages WHERE session = ?", (session,))
+        self.conn.execute("DELETE FROM sessions WHERE name = ?", (session,))
+        self.conn.commit()
+
+    # sync keeps archived sessions indexed; they are only read back if they were archived
+    # before the index had caught up with them.
+    def sync(self, chat_dir, archive=None):
+        live = set(session_files(chat_dir))
+        archived = set(archive.names()) - live if archive is not None else set()
+        for (name,) in self.conn.execute("SELECT name FROM sessions").fetchall():
+            if name not in live and name not in archived:
+                self.remove(name)
+        for name in sorted(live):
+            self.catch_up(chat_dir, name)
+        for name in sorted(archived):
+            if self.indexed(name) < archive.records_count(name):
+                self.catch_up_archived(archive, name)
+
+    def catch_up_archived(self, archive, session):
+        indexed = self.indexed(session)
+        batch = []
+        for position, record in enumerate(archive.records(session)):
+            if position < indexed:
+                continue
+            batch.append(record)
+            if len(batch) == self.BATCH:
+                self.insert(session, batch, position + 1)
+                batch = []
+        if batch:
+            self.insert(session, batch, position + 1)
+        self.conn.commit()
+
+    # search returns [(session, hits, snippet_html)] with the best-ranked session first.
+    def search(self, query, limit=100):
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        match = " ".join('"%s"*' % word for word in words)
+        rows = self.conn.execute(
+            "SELECT session, snippet(messages, 0, ?, ?, '…', 12) FROM messages "
+            "WHERE messages MATCH ? ORDER BY bm25(messages) LIMIT ?",
+            (self.HIT, self.END, match, limit * 20),
+        ).fetchall()
+        results = OrderedDict()
+        for session, snippet in rows:
+            if session in results:
+                results[session][1] += 1
+                continue
+            snippet = html.escape(snippet.replace("\n", " ")).replace(self.HIT, "<b>").replace(self.END, "</b>")
+            results[session] = [session, 1, snippet]
+        return [tuple(result) for result in list(results.values())[:limit]]
+
+    def close(self):
+        self.conn.close()
+
+# SearchWorker: Owns the SearchIndex on the search thread; all slots run there.
+class SearchWorker(QObject):
+    results_ready = pyqtSignal(int, list)
+
+    def __init__(self, chat_dir, archive=None):
+        super().__init__()
+        self.chat_dir = chat_dir
+        self.archive = archive
+        self.index = None
+
+    def ensure_index(self):
+        if self.index is None:
+            self.index = SearchIndex(os.path.join(self.chat_dir, SEARCH_INDEX_FILE))
+        return self.index
+
+    @pyqtSlot()
+    def sync(self):
+        self.ensure_index().sync(self.chat_dir, self.archive)
+
+    @pyqtSlot(str, int, object)
+    def add(self, session, position, record):
+        self.ensure_index().add(self.chat_dir, session, position, record)
+
+    @pyqtSlot(str)
+    def remove(self, session):
+        self.ensure_index().remove(session)
+
+    @pyqtSlot(int, str)
+    def search(self, token, query):
+        self.results_ready.emit(token, self.ensure_index().search(query))
+
+    @pyqtSlot()
+    def close(self):
+        if self.index:
+            self.index.close()
+            self.index = None
+
+# SearchService: GUI-side handle for the search thread; calls are queued, results come back by signal.
+class SearchService(QObject):
+    results_ready = pyqtSignal(int, list)
+    sync_requested = pyqtSignal()
+    add_requested = pyqtSignal(str, int, object)
+    remove_requested = pyqtSignal(str)
+    search_requested = pyqtSignal(int, str)
+    close_requested = pyqtSignal()
+
+    def __init__(self, chat_dir, archive=None, parent=None):
+        super().__init__(parent)
+        self.thread = QThread()
+        self.worker = SearchWorker(chat_dir, archive)
+        self.worker.moveToThread(self.thread)
+        self.sync_requested.connect(self.worker.sync)
+        self.add_requested.connect(self.worker.add)
+        self.remove_requested.connect(self.worker.remove)
+        self.search_requested.connect(self.worker.search)
+        self.close_requested.connect(self.worker.close)
+        self.worker.results_ready.connect(self.results_ready)
+        self.thread.start()
+        self.tokens = itertools.count(1)
+
+    def sync(self):
+        self.sync_requested.emit()
+
+    def add(self, session_file, position, record):
+        self.add_requested.emit(os.path.basename(session_file), position, record)
+
+    def remove(self, filename):
+        self.remove_requested.emit(filename)
+
+    def search(self, query):
+        token = next(self.tokens)
+        self.search_requested.emit(token, query)
+        return token
+
+    def shutdown(self):
+        self.close_requested.emit()
+        self.thread.quit()
+        self.thread.wait()
+
+DEFAULT_CONFIG = {
+    "theme": "Gruvbox Dark Soft",
+    "font_family": "JetBrains Mono",
+    "font_size": 14,
+    "bubble_radius": 12,
+    "bubble_shadows": True,
+    "shadow_limit": SHADOW_LIMIT,
+    "show_timestamps": False,
+    "stream_responses": True,
+    "warm_connection": False,
+    "max_in_flight": 2,
+    "max_open_chats": MAX_OPEN_CHATS,
+    "max_retries": DEFAULT_RETRIES,
+    "request_timeout": REQUEST_TIMEOUT,
+    "metrics_export": "off",
+    "metrics_file": "",
+    "requests_per_minute": 0,
+    "tokens_per_minute": 0,
+    "context_tokens": CONTEXT_TOKEN_BUDGET,
+    "response_cache": False,
+    "archive_after_days": ARCHIVE_AFTER_DAYS,
+    "archive_compression": "auto",
+    "separate_api_key": True,
+}
+
+# Settings limited to the values their combo boxes offer.
+METRICS_EXPORTS = ["off", "jsonl", "prometheus"]
+CONFIG_CHOICES = {
+    "theme": [GruvboxTheme.DARK_SOFT["name"], GruvboxTheme.LIGHT_SOFT["name"]],
+    "metrics_export": METRICS_EXPORTS,
+    "archive_compression": ["auto", "zstd", "gzip"],
+}
+
+# Numeric settings and the (minimum, maximum) their settings widgets allow.
+CONFIG_RANGES = {
+    "font_size": (8, 24),
+    "bubble_radius": (4, 24),
+    "shadow_limit": (0, 1000000),
+    "max_in_flight": (1, MAX_IN_FLIGHT),
+    "max_open_chats": (1, 32),
+    "max_retries": (0, 10),
+    "request_timeout": (0, 3600),
+    "requests_per_minute": (0, 10000),
+    "tokens_per_minute": (0, 10000000),
+    "context_tokens": (0, 1000000),
+    "archive_after_days": (0, 3650),
+}
+
+# clean_config: Fills in missing settings and replaces the ones with a wrong type, a number
+# outside CONFIG_RANGES or a value outside CONFIG_CHOICES with their defaults, so a hand-edited
+# config.json can never break the settings widgets. Unknown keys are kept as they are.
+def clean_config(data):
+    clean = dict(data) if isinstance(data, dict) else {}
+    for key, default in DEFAULT_CONFIG.items():
+        value = clean.get(key, default)
+        valid = type(value) is type(default)
+        if valid and key in CONFIG_RANGES:
+            low, high = CONFIG_RANGES[key]
+            valid = low <= value <= high
+        if valid and key in CONFIG_CHOICES:
+            valid = value in CONFIG_CHOICES[key]
+        clean[key] = value if valid else default
+    if not isinstance(clean.get("api_key", ""), str):
+        del clean["api_key"]
+    return clean
+
+# ConfigStore: config.json behind a dict-like API. Changes are debounced and written atomically
+# on a background thread; edits made to the file by something else are picked up and reported.
+class ConfigStore(QObject):
+    changed_externally = pyqtSignal(dict)
+
+    def __init__(self, path, key_path, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.keys = KeyStore(key_path)
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aui-config")
+        self.last_written = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(CONFIG_SAVE_DEBOUNCE_MS)
+        self.timer.timeout.connect(self.flush)
+        self.data = clean_config(self.read())
+        self.api_key = self.data.pop("api_key", "")
+        if self.data["separate_api_key"]:
+            stored = self.keys.get()
+            if self.api_key and self.api_key != stored:
+                # Move a key found in config.json into the key store.
+                self.keys.set(self.api_key)
+                self.flush()
+            else:
+                self.api_key = stored
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.reload)
+        self.watch()
+
+    def watch(self):
+        # An atomic rename replaces the inode, which drops the path from the watcher.
+        if os.path.exists(self.path) and self.path not in self.watcher.files():
+            self.watcher.addPath(self.path)
+
+    def read(self):
+        return read_config(self.path)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        changed = False
+        for key, value in values.items():
+            if self.data.get(key) != value:
+                self.data[key] = value
+                changed = True
+        if changed:
+            self.timer.start()
+
+    def set_api_key(self, key):
+        if key == self.api_key:
+            return
+        self.api_key = key
+        if self.data["separate_api_key"]:
+            self.writer.submit(self.keys.set, key)
+        else:
+            self.timer.start()
+
+    def serialize(self):
+        data = dict(self.data)
+        if not data["separate_api_key"]:
+            data["api_key"] = self.api_key
+        return json.dumps(data, indent=2)
+
+    # flush snapshots the config on the GUI thread and hands the write to the writer thread.
+    def flush(self):
+        self.timer.stop()
+        text = self.serialize()
+        if text == self.last_written:
+            return
+        self.last_written = text
+        self.writer.submit(self.write, text)
+
+    def write(self, text):
+        write_atomic(self.path, text)
+
+    def reload(self, path):
+        self.watch()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                text = f.read()
+            data = json.loads(text)
+        except (OSError, ValueError):
+            return
+        if text == self.last_written or not isinstance(data, dict):
+            return
+        self.last_written = text
+        self.data = clean_config(data)
+        api_key = self.data.pop("api_key", None)
+        if api_key is not None:
+            self.api_key = api_key
+            if self.data["separate_api_key"]:
+                # Move the key into the key store and out of config.json, as at startup.
+                self.writer.submit(self.keys.set, api_key)
+                self.flush()
+        self.changed_externally.emit(dict(self.data))
+
+    def close(self):
+        self.flush()
+        self.writer.shutdown(wait=True)
+
+# Item data roles exposed by SessionListModel and HistoryFilterProxy.
+FilenameRole = Qt.UserRole + 10
+SnippetRole = Qt.UserRole + 11
+MetaRole = Qt.UserRole + 12
+
+# SessionListModel: Session filenames, newest first. set_files diffs a directory listing and
+# only inserts or removes the rows that changed.
+# Metadata is read from the sidecars lazily, so only painted (or sorted) rows touch the disk.
+class SessionListModel(QAbstractListModel):
+    def __init__(self, chat_dir, archive=None, parent=None):
+        super().__init__(parent)
+        self.chat_dir = chat_dir
+        self.archive = archive
+        self.files = []
+        self.meta = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.files)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self.files[index.row()]
+        if role == Qt.DisplayRole:
+            return os.path.splitext(name)[0]
+        if role == FilenameRole:
+            return name
+        if role == MetaRole:
+            return self.session_meta(name)
+        if role == Qt.ToolTipRole:
+            meta = self.session_meta(name)
+            if meta and meta["count"]:
+                return f"{meta['count']} messages\nStarted {meta['first_ts']}\nLast message {meta['last_ts']}"
+        return None
+
+    def session_meta(self, name):
+        meta = self.meta.get(name)
+        if meta is None:
+            meta = read_session_meta(os.path.join(self.chat_dir, name))
+            if meta is None and self.archive is not None:
+                meta = self.archive.meta(name)
+                if meta is not None:
+                    meta["archived"] = True
+            meta = meta or empty_meta()
+            self.meta[name] = meta
+        return meta
+
+    # update_meta is fed from the append path so the open session's row stays current.
+    def update_meta(self, name, meta):
+        self.meta[name] = dict(meta)
+        if name in self.files:
+            index = self.index(self.files.index(name))
+            self.dataChanged.emit(index, index)
+
+    # forget_meta drops cached metadata, e.g. after sessions moved into or out of the archive.
+    def forget_meta(self):
+        self.meta.clear()
+        if self.files:
+            self.dataChanged.emit(self.index(0), self.index(len(self.files) - 1))
+
+    def set_files(self, names):
+        wanted = set(names)
+        # Remove stale rows bottom-up in contiguous runs.
+        row = len(self.files) - 1
+        while row >= 0:
+            if self.files[row] in wanted:
+                row -= 1
+                continue
+            end = row
+            while row >= 0 and self.files[row] not in wanted:
+                row -= 1
+            self.beginRemoveRows(QModelIndex(), row + 1, end)
+            for name in self.files[row + 1:end + 1]:
+                self.meta.pop(name, None)
+            del self.files[row + 1:end + 1]
+            self.endRemoveRows()
+        present = set(self.files)
+        for name in sorted(wanted - present, reverse=True):
+            self.insert_file(name)
+
+    def insert_file(self, name):
+        # files is sorted descending; bisect on the negated order.
+        low, high = 0, len(self.files)
+        while low < high:
+            middle = (low + high) // 2
+            if self.files[middle] > name:
+                low = middle + 1
+            else:
+                high = middle
+        self.beginInsertRows(QModelIndex(), low, low)
+        self.files.insert(low, name)
+        self.endInsertRows()
+
+    def remove_file(self, name):
+        if name in self.files:
+            row = self.files.index(name)
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.files[row]
+            self.meta.pop(name, None)
+            self.endRemoveRows()
+
+# HistoryFilterProxy: Applies History search results; ranked sessions first, hidden otherwise.
+class HistoryFilterProxy(QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.results = None
+        self.by_activity = False
+        self.sort(0, Qt.AscendingOrder)
+
+    def set_sort_by_activity(self, enabled):
+        self.by_activity = enabled
+        self.invalidate()
+
+    # results maps filename -> (rank, snippet_html); None shows every session.
+    def set_results(self, results):
+        self.results = results
+        self.invalidate()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.results is None:
+            return True
+        name = self.sourceModel().files[source_row]
+        return name in self.results
+
+    def lessThan(self, left, right):
+        if self.results is None:
+            if self.by_activity:
+                left_ts = left.data(MetaRole)["last_ts"] or ""
+                right_ts = right.data(MetaRole)["last_ts"] or ""
+                if left_ts != right_ts:
+                    return left_ts > right_ts
+            return left.row() < right.row()
+        left_rank = self.results[self.sourceModel().files[left.row()]][0]
+        right_rank = self.results[self.sourceModel().files[right.row()]][0]
+        return left_rank < right_rank
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == SnippetRole:
+            if self.results is None:
+                return None
+            return self.results.get(index.data(FilenameRole), (0, None))[1]
+        return super().data(index, role)
+
+# HistoryDelegate: Paints every history card from one set of theme colours; no per-item stylesheet.
+class HistoryDelegate(QStyledItemDelegate):
+    open_requested = pyqtSignal(str)
+    delete_requested = pyqtSignal(str)
+    HEIGHT = 68
+    MARGIN = 4
+    DELETE_SIZE = 30
+    SNIPPET_CACHE_SIZE = 128
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.colors = GruvboxTheme.DARK_SOFT
+        self.snippets = OrderedDict()
+
+    def set_theme(self, theme):
+        self.colors = theme_colors(theme)
+        self.snippets.clear()
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.HEIGHT)
+
+    def card_rect(self, option):
+        return option.rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+
+    def delete_rect(self, option):
+        card = self.card_rect(option)
+        return QRect(
+            card.right() - 15 - self.DELETE_SIZE, card.center().y() - self.DELETE_SIZE // 2,
+            self.DELETE_SIZE, self.DELETE_SIZE
+        )
+
+    def snippet_document(self, snippet, width):
+        key = (snippet, width)
+        document = self.snippets.get(key)
+        if document is None:
+            document = QTextDocument()
+            document.setDocumentMargin(0)
+            document.setDefaultStyleSheet(f"body {{ color: {self.colors['text']}; font-size: 12px; }}")
+            document.setHtml(f"<body>{snippet}</body>")
+            document.setTextWidth(width)
+            self.snippets[key] = document
+            while len(self.snippets) > self.SNIPPET_CACHE_SIZE:
+                self.snippets.popitem(last=False)
+        return document
+
+    def preview_text(self, index):
+        meta = index.data(MetaRole)
+        if not meta or not meta["count"]:
+            return "No messages yet"
+        return f"{meta['last_sender']}: {meta['last_text']}"
+
+    def stats_text(self, index):
+        meta = index.data(MetaRole)
+        if not meta or not meta["count"]:
+            return ""
+        size_text = format_size(meta["size"])
+        last = meta["last_ts"].replace("T", " ")[:16] if meta["last_ts"] else ""
+        archived = " · archived" if meta.get("archived") else ""
+        return f"{meta['count']} msgs · {size_text} · {last}{archived}"
+
+    def paint(self, painter, option, index):
+        card = self.card_rect(option)
+        hovered = option.state & QStyle.State_MouseOver
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(QColor(self.colors["border"]), 1))
+        painter.setBrush(QColor(self.colors["button_bg"] if hovered else self.colors["window_bg"]))
+        painter.drawRoundedRect(QRectF(card).adjusted(0.5, 0.5, -0.5, -0.5), 12, 12)
+        text_left = card.left() + 15
+        text_width = self.delete_rect(option).left() - 12 - text_left
+        title_font = QFont(option.font)
+        title_font.setPixelSize(15)
+        title_font.setBold(True)
+        painter.setFont(title_font)
+        painter.setPen(QColor(self.colors["text"]))
+        title_rect = QRect(text_left, card.top() + 8, text_width, 22)
+        painter.drawText(title_rect, Qt.AlignLeft | Qt.AlignVCenter, index.data(Qt.DisplayRole))
+        stats_font = QFont(option.font)
+        stats_font.setPixelSize(11)
+        painter.setFont(stats_font)
+        painter.setPen(QColor(self.colors["accent"]))
+        painter.drawText(title_rect, Qt.AlignRight | Qt.AlignVCenter, self.stats_text(index))
+        painter.setPen(QColor(self.colors["text"]))
+        snippet = index.data(SnippetRole)
+        preview_top = title_rect.bottom() + 4
+        if snippet:
+            document = self.snippet_document(snippet, text_width)
+            painter.translate(text_left, preview_top)
+            document.drawContents(painter, QRectF(0, 0, text_width, card.bottom() - preview_top - 4))
+            painter.translate(-text_left, -preview_top)
+        else:
+            preview_font = QFont(option.font)
+            preview_font.setPixelSize(12)
+            painter.setFont(preview_font)
+            metrics = QFontMetrics(preview_font)
+            preview = metrics.elidedText(self.preview_text(index), Qt.ElideRight, text_width)
+            painter.drawText(QRect(text_left, preview_top, text_width, 18), Qt.AlignLeft | Qt.AlignVCenter, preview)
+        delete = self.delete_rect(option)
+        if hovered and delete.contains(option.widget.mapFromGlobal(QCursor.pos()) if option.widget else QPoint()):
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QColor(self.colors["border"]))
+            painter.drawRoundedRect(QRectF(delete), 5, 5)
+        icon_font = QFont(option.font)
+        icon_font.setPixelSize(16)
+        painter.setFont(icon_font)
+        painter.setPen(QColor(self.colors["delete"]))
+        painter.drawText(delete, Qt.AlignCenter, "🗑")
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            name = index.data(FilenameRole)
+            if self.delete_rect(option).contains(event.pos()):
+                self.delete_requested.emit(name)
+            else:
+                self.open_requested.emit(name)
+            return True
+        return super().editorEvent(event, model, option, index)
+
+# StartupProfile: Per-phase wall-clock timings printed by --profile-startup; marks are cheap
+# enough to leave in place when profiling is off.
+class StartupProfile:
+    def __init__(self, enabled=False, began=STARTUP_BEGAN):
+        self.enabled = enabled
+        self.began = self.last = began
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self, out=sys.stderr):
+        if not self.enabled:
+            return
+        for phase, seconds in self.phases:
+            print(f"{phase:<20}{seconds * 1000:8.1f} ms", file=out)
+        total = (self.last - self.began) * 1000
+        note = f"  (over the {STARTUP_BUDGET_MS} ms budget)" if total > STARTUP_BUDGET_MS else ""
+        print(f"{'total':<20}{total:8.1f} ms{note}", file=out)
+
+# StallMonitor: Measures event-loop stalls as how late a short repeating timer fires; anything a
+# frame or more late is recorded, so the numbers cover every kind of GUI-thread work.
+class StallMonitor(QObject):
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.last = 0.0
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(STALL_PROBE_MS)
+        self.timer.timeout.connect(self.probe)
+
+    def start(self):
+        self.last = time.perf_counter()
+        self.timer.start()
+
+    def probe(self):
+        now = time.perf_counter()
+        late = now - self.last - STALL_PROBE_MS / 1000
+        self.last = now
+        if late * 1000 >= STALL_THRESHOLD_MS:
+            self.metrics.observe("ui_stall_seconds", late)
+
+# LazyTab: Tab page whose contents are built by builder() the first time the tab is shown.
+class LazyTab(QWidget):
+    def __init__(self, builder, parent=None):
+        super().__init__(parent)
+        self.builder = builder
+        self.built = False
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+    def ensure(self):
+        if not self.built:
+            self.built = True
+            self.layout().addWidget(self.builder())
+
+    def showEvent(self, event):
+        self.ensure()
+        super().showEvent(event)
+
+# ChatPage: One open session in the Chat tab: its store, transcript and request queue. Prompts
+# are sent one at a time per session, so each reply sees the previous one as context, while
+# pages send side by side up to the executor's in-flight limit.
+class ChatPage(QWidget):
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.session = SessionStore(path)
+        self.model = TranscriptModel(self)
+        self.view = TranscriptView()
+        self.delegate = BubbleDelegate(self.view)
+        self.view.setItemDelegate(self.delegate)
+        self.view.setModel(self.model)
+        self.loaded_from = 0
+        # (text, use_cache, row, attachments) waiting for the request in flight to finish
+        self.queue = deque()
+        self.active = None
+        self.last_used = time.monotonic()
+        # Files picked for this page's next prompt: {"id", "name", "record", "chip"}; record is
+        # None until the file has been copied into the blob store.
+        self.attachments = []
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.view, 1)
+        # One removable chip per pending attachment
+        self.attachment_bar = QWidget()
+        self.attachment_layout = QHBoxLayout(self.attachment_bar)
+        self.attachment_layout.setContentsMargins(10, 0, 10, 0)
+        self.attachment_layout.addStretch(1)
+        self.attachment_bar.hide()
+        layout.addWidget(self.attachment_bar, 0)
+
+    def busy(self):
+        return self.active is not None or bool(self.queue)
+
+    # untouched pages (a fresh New Chat) are replaced rather than kept when a session is opened.
+    def untouched(self):
+        return not self.busy() and not self.attachments and len(self.session) == 0
+
+    def title(self):
+        first = self.session.read_range(0, 1) if len(self.session) else []
+        text = " ".join(first[0]["text"].split()) if first else ""
+        if first and not text and first[0].get("attachments"):
+            text = first[0]["attachments"][0]["name"]
+        return (text[:24] + "\u2026" if len(text) > 25 else text) or "New Chat"
 
 # ChatClient: Main window with a sticky input box and message bubbles aligned by sender.
 class ChatClient(QMainWindow):
-    def __init__(self):
+    def __init__(self, profile=None):
         super().__init__()
+        self.profile = profile or StartupProfile()
+        self.started = False
         self.setWindowTitle("AUI")
         self.setGeometry(100, 100, 1200, 800)
         os.makedirs(CHAT_DIR, exist_ok=True)
         
+        # path -> ChatPage for every open session; page is the one on screen, and transcript,
+        # transcript_model, bubble_delegate, session and current_session_file are its parts.
+        self.pages = {}
+        self.page = None
         self.current_session_file = None
-        self.pending_response = None
-        self.config = self.load_config()
+        self.session = None
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.setInterval(SYNC_IDLE_MS)
+        self.sync_timer.timeout.connect(self.sync_session)
+        # request id -> {"session", "row", "text", "chunks", "stale"} for replies still in flight
+        self.pending = {}
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setSingleShot(True)
+        self.stream_timer.setInterval(STREAM_REPAINT_MS)
+        self.stream_timer.timeout.connect(self.flush_stream)
+        self.config = ConfigStore(CONFIG_FILE, KEY_FILE, self)
+        self.profile.mark("config")
+        self.theme_engine = ThemeEngine()
+        self.config.changed_externally.connect(self.apply_external_config)
         self.theme = self.config.get("theme", "Gruvbox Dark Soft")
         self.font_family = self.config.get("font_family", "JetBrains Mono")
         self.font_size = self.config.get("font_size", 14)
         self.bubble_radius = self.config.get("bubble_radius", 12)
+        self.bubble_shadows = self.config.get("bubble_shadows", True)
+        self.shadow_limit = self.config.get("shadow_limit", SHADOW_LIMIT)
         self.show_timestamps = self.config.get("show_timestamps", False)
+        self.stream_responses = self.config.get("stream_responses", True)
+        self.warm_connection = self.config.get("warm_connection", False)
+        self.max_in_flight = self.config.get("max_in_flight", 2)
+        self.max_open_chats = self.config.get("max_open_chats", MAX_OPEN_CHATS)
+        self.max_retries = self.config.get("max_retries", DEFAULT_RETRIES)
+        self.request_timeout = self.config.get("request_timeout", REQUEST_TIMEOUT)
+        self.requests_per_minute = self.config.get("requests_per_minute", 0)
+        self.tokens_per_minute = self.config.get("tokens_per_minute", 0)
+        self.cache_responses = self.config.get("response_cache", False)
+        self.response_cache = None
+        self.context_budget = self.config.get("context_tokens", CONTEXT_TOKEN_BUDGET)
+        self.metrics = Metrics()
+        self.stall_monitor = StallMonitor(self.metrics, self)
+        self.metrics_export = self.config.get("metrics_export", "off")
+        self.metrics_file = self.config.get("metrics_file", "")
+        self.export_timer = QTimer(self)
+        self.export_timer.setInterval(METRICS_EXPORT_MS)
+        self.export_timer.timeout.connect(self.export_metrics)
+        self.request_signals = RequestSignals(self)
+        self.request_signals.response_stream.connect(self.handle_chunk)
+        self.request_signals.response_done.connect(self.handle_response)
+        self.request_signals.response_error.connect(self.handle_error)
+        self.request_signals.retrying.connect(self.report_retry)
+        self.request_signals.first_token.connect(self.report_first_token)
+        self.executor = RequestExecutor(
+            self.max_in_flight,
+            on_chunk=self.request_signals.response_stream.emit,
+            on_done=self.request_signals.response_done.emit,
+            on_first_token=self.request_signals.first_token.emit,
+            on_error=self.request_signals.response_error.emit,
+            on_retry=self.request_signals.retrying.emit,
+            retries=self.max_retries,
+            rate_limiter=RateLimiter(self.requests_per_minute, self.tokens_per_minute),
+            metrics=self.metrics,
+        )
+        self.blob_store = BlobStore(os.path.join(CHAT_DIR, BLOB_DIR))
+        self.executor.blob_store = self.blob_store
+        self.attachment_ids = itertools.count(1)
+        self.attach_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="aui-attach")
+        self.attachment_signals = AttachmentSignals(self)
+        self.attachment_signals.imported.connect(self.attachment_imported)
+        self.attachment_signals.failed.connect(self.attachment_failed)
+        # Opt-in: typing a prompt builds the model and opens its connection on warm_pool, and
+        # warm_timer closes it again once nothing has used it for WARM_IDLE_SECONDS.
+        self.warm_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aui-warm")
+        self.warm_job = None
+        self.warm_timer = QTimer(self)
+        self.warm_timer.setSingleShot(True)
+        self.warm_timer.setInterval(WARM_IDLE_SECONDS * 1000)
+        self.warm_timer.timeout.connect(self.close_connection)
+        self.profile.mark("request executor")
         
+        migrate_legacy_sessions(CHAT_DIR)
+        self.archive = SessionArchive(CHAT_DIR, self.config.get("archive_compression", "auto"))
+        self.archive_after_days = self.config.get("archive_after_days", ARCHIVE_AFTER_DAYS)
+        self.archive_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aui-archive")
+        self.archive_job = None
+        self.archive_signals = ArchiveSignals(self)
+        self.archive_signals.finished.connect(self.archive_finished)
+        self.archive_signals.failed.connect(self.archive_failed)
+        self.archive_signals.restored.connect(self.archive_restored)
+        self.archive_signals.restore_failed.connect(self.archive_restore_failed)
+        # Archived chats being restored on the archive thread; they open once restored.
+        self.restoring = set()
+        self.archive_timer = QTimer(self)
+        self.archive_timer.setInterval(ARCHIVE_INTERVAL_MS)
+        self.archive_timer.timeout.connect(self.run_archive_job)
+        # Exports and imports are driven from transfer_pool; the sessions themselves are converted
+        # by the worker processes of aui_core.run_transfers.
+        self.transfer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aui-transfer")
+        self.transfer_job = None
+        self.transfer_token = None
+        self.transfer_signals = TransferSignals(self)
+        self.transfer_signals.progress.connect(self.transfer_progress)
+        self.transfer_signals.finished.connect(self.transfer_finished)
+        self.transfer_signals.failed.connect(self.transfer_failed)
+        self.search = SearchService(CHAT_DIR, self.archive, self)
+        self.search.sync()
+        self.profile.mark("sessions and search")
         # Start a new chat session if none exists
         self.init_ui()
-        self.apply_theme()
-        if not self.current_session_file:
-            self.new_chat()
-            
+        self.set_response_cache(self.cache_responses)
+        self.profile.mark("chat tab")
+        self.apply_theme(self.theme)
+        self.profile.mark("theme")
+
 
     def init_ui(self):
         self.tabs = QTabWidget()
         self.tabs.setTabPosition(QTabWidget.West)
         self.setCentralWidget(self.tabs)
         self.init_chat_tab()
-        self.init_history_tab()
-        self.init_settings_tab()
-        self.init_info_tab()  # New Info tab
-        self.refresh_sessions()
+        # Only the Chat tab is built before the first paint; the others on first open.
+        self.history_page = LazyTab(self.init_history_tab)
+        self.settings_page = LazyTab(self.init_settings_tab)
+        self.diagnostics_page = LazyTab(self.init_diagnostics_tab)
+        self.info_page = LazyTab(self.init_info_tab)
+        self.tabs.addTab(self.history_page, "History")
+        self.tabs.addTab(self.settings_page, "Settings")
+        self.tabs.addTab(self.diagnostics_page, "Diagnostics")
+        self.tabs.addTab(self.info_page, "Info")
         # Install event filter on input field for Ctrl+Enter
         self.input_field.installEventFilter(self)
+        self.input_field.textChanged.connect(self.warm_up_connection)
+        self.new_chat()
+        # The transcript's first paint ends the startup profile.
+        self.transcript.viewport().installEventFilter(self)
 
     # Chat Tab with a sticky input box.
     def init_chat_tab(self):
@@ -238,15 +1972,19 @@ class ChatClient(QMainWindow):
         main_layout.setContentsMargins(10, 10, 10, 10)
         main_layout.setSpacing(10)
         
-        # Scrollable chat area (expands to fill space)
-        self.scroll = QScrollArea()
-        self.scroll.setWidgetResizable(True)
-        self.chat_area = QWidget()
-        self.chat_area_layout = QVBoxLayout(self.chat_area)
-        self.chat_area_layout.setSpacing(12)
-        self.chat_area_layout.addStretch(1)
-        self.scroll.setWidget(self.chat_area)
-        main_layout.addWidget(self.scroll, 1)
+        # One tab per open session, each with its own virtualized transcript (expands to fill space)
+        self.chat_tabs = QTabWidget()
+        self.chat_tabs.setObjectName("chatTabs")
+        self.chat_tabs.setDocumentMode(True)
+        self.chat_tabs.setTabsClosable(True)
+        self.chat_tabs.setMovable(True)
+        new_tab_btn = QPushButton("+")
+        new_tab_btn.setToolTip("New chat")
+        new_tab_btn.clicked.connect(self.new_chat)
+        self.chat_tabs.setCornerWidget(new_tab_btn, Qt.TopRightCorner)
+        self.chat_tabs.currentChanged.connect(self.activate_page)
+        self.chat_tabs.tabCloseRequested.connect(lambda index: self.close_page(self.chat_tabs.widget(index)))
+        main_layout.addWidget(self.chat_tabs, 1)
         
         # Input container: fixed at bottom
         self.input_container = QWidget()
@@ -257,33 +1995,29 @@ class ChatClient(QMainWindow):
         self.input_field = QTextEdit()
         self.input_field.setPlaceholderText("Type your message here...")
         self.input_field.setFixedHeight(60)
-        self.input_field.setStyleSheet("""
-            QTextEdit {
-                background-color: #1d2021;
-                color: #ebdbb2;
-                border: 2px solid #665c54;
-                border-radius: 8px;
-                padding: 8px;
-            }
-        """)
+        self.input_field.setObjectName("chatInput")
+        self.input_field.setFont(QFont(self.font_family, self.font_size))
+        self.input_field.viewport().installEventFilter(self)
         
+        attach_btn = QPushButton("Attach")
+        attach_btn.setFixedWidth(100)
+        attach_btn.setToolTip("Attach files to the next message (or drop them on the input box)")
+        attach_btn.clicked.connect(self.choose_attachments)
         send_btn = QPushButton("Send")
+        send_btn.setObjectName("sendButton")
         send_btn.setFixedWidth(100)
-        send_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #8ec07c;
-                color: #282828;
-                border-radius: 8px;
-                padding: 10px;
-            }
-            QPushButton:hover {
-                background-color: #a9d18e;
-            }
-        """)
         send_btn.clicked.connect(lambda: self.button_feedback(send_btn, self.send_message))
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setObjectName("stopButton")
+        self.stop_button.setFixedWidth(100)
+        self.stop_button.setToolTip("Stop the replies being generated for this chat (Esc)")
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.stop_requests)
         
         input_layout.addWidget(self.input_field)
+        input_layout.addWidget(attach_btn)
         input_layout.addWidget(send_btn)
+        input_layout.addWidget(self.stop_button)
         main_layout.addWidget(self.input_container, 0)
         self.tabs.addTab(self.chat_widget, "Chat")
 
@@ -293,22 +2027,67 @@ class ChatClient(QMainWindow):
         
         self.search_bar = QLineEdit()
         self.search_bar.setPlaceholderText("Search chats...")
-        self.search_bar.textChanged.connect(self.filter_sessions)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.filter_sessions)
+        self.search_bar.textChanged.connect(self.search_timer.start)
+        self.search_token = 0
+        self.search.results_ready.connect(self.show_search_results)
         
-        self.history_scroll = QScrollArea()
-        self.history_scroll.setWidgetResizable(True)
-        self.history_container = QWidget()
-        self.history_layout = QVBoxLayout(self.history_container)
-        self.history_scroll.setWidget(self.history_container)
+        self.session_model = SessionListModel(CHAT_DIR, self.archive, self)
+        self.history_proxy = HistoryFilterProxy(self)
+        self.history_proxy.setSourceModel(self.session_model)
+        self.history_view = QListView()
+        self.history_view.setUniformItemSizes(True)
+        self.history_view.setMouseTracking(True)
+        self.history_view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.history_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.history_view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.history_view.setFrameShape(QFrame.NoFrame)
+        self.history_delegate = HistoryDelegate(self.history_view)
+        self.history_delegate.set_theme(self.theme)
+        self.history_delegate.open_requested.connect(self.load_session, Qt.QueuedConnection)
+        self.history_delegate.delete_requested.connect(self.delete_session, Qt.QueuedConnection)
+        self.history_view.setItemDelegate(self.history_delegate)
+        self.history_view.setModel(self.history_proxy)
+
+        # The watcher catches sessions created, deleted or copied in from outside the app.
+        self.session_watcher = QFileSystemWatcher([CHAT_DIR], self)
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(WATCH_DEBOUNCE_MS)
+        self.watch_timer.timeout.connect(self.refresh_sessions)
+        self.session_watcher.directoryChanged.connect(self.watch_timer.start)
         
         new_chat_btn = QPushButton("➕ New Chat")
         new_chat_btn.clicked.connect(lambda: self.button_feedback(new_chat_btn, self.new_chat))
         
+        self.history_sort_combo = QComboBox()
+        self.history_sort_combo.addItems(["Newest sessions first", "Most recent activity first"])
+        self.history_sort_combo.currentIndexChanged.connect(
+            lambda index: self.history_proxy.set_sort_by_activity(index == 1)
+        )
+        
+        # Export writes the chats listed (all of them, or a search's matches) one file each.
+        self.export_button = QPushButton("Export...")
+        export_menu = QMenu(self.export_button)
+        for label, fmt in (("JSONL", "jsonl"), ("Markdown", "markdown"), ("HTML", "html")):
+            export_menu.addAction(label, lambda fmt=fmt, label=label: self.export_listed_sessions(fmt, label))
+        self.export_button.setMenu(export_menu)
+        self.import_button = QPushButton("Import...")
+        self.import_button.clicked.connect(self.import_session_files)
+        transfer_layout = QHBoxLayout()
+        transfer_layout.addWidget(self.export_button)
+        transfer_layout.addWidget(self.import_button)
+        
         layout.addWidget(self.search_bar)
-        layout.addWidget(self.history_scroll)
+        layout.addWidget(self.history_sort_combo)
+        layout.addWidget(self.history_view)
+        layout.addLayout(transfer_layout)
         layout.addWidget(new_chat_btn)
-        self.tabs.addTab(history_tab, "History")
-        self.history_items = []
+        self.refresh_sessions()
+        return history_tab
 
     def init_settings_tab(self):
         settings_tab = QWidget()
@@ -330,7 +2109,7 @@ class ChatClient(QMainWindow):
         self.font_family_combo = QFontComboBox()
         self.font_family_combo.setCurrentFont(QFont(self.font_family))
         self.font_size_input = QSpinBox()
-        self.font_size_input.setRange(8, 24)
+        self.font_size_input.setRange(*CONFIG_RANGES["font_size"])
         self.font_size_input.setValue(self.font_size)
         font_layout.addWidget(QLabel("Font Family"), 0, 0)
         font_layout.addWidget(self.font_family_combo, 0, 1)
@@ -338,40 +2117,260 @@ class ChatClient(QMainWindow):
         font_layout.addWidget(self.font_size_input, 1, 1)
         font_group.setLayout(font_layout)
         self.font_size_input.valueChanged.connect(self.update_font)
+        self.font_family_combo.currentFontChanged.connect(self.update_font)
         
         # Bubble settings
         bubble_group = QGroupBox("Chat Appearance")
         bubble_layout = QVBoxLayout()
         self.radius_slider = QSlider(Qt.Horizontal)
-        self.radius_slider.setRange(4, 24)
+        self.radius_slider.setRange(*CONFIG_RANGES["bubble_radius"])
         self.radius_slider.setValue(self.bubble_radius)
         self.radius_slider.valueChanged.connect(self.update_bubble_radius)
+        self.shadow_check = QCheckBox("Bubble Shadows")
+        self.shadow_check.setChecked(self.bubble_shadows)
+        self.shadow_check.stateChanged.connect(self.update_shadows)
+        self.shadow_limit_input = QSpinBox()
+        self.shadow_limit_input.setRange(*CONFIG_RANGES["shadow_limit"])
+        self.shadow_limit_input.setSingleStep(500)
+        self.shadow_limit_input.setSpecialValueText("Never")
+        self.shadow_limit_input.setValue(self.shadow_limit)
+        self.shadow_limit_input.valueChanged.connect(self.update_shadows)
         self.timestamp_check = QCheckBox("Show Timestamps")
         self.timestamp_check.setChecked(self.show_timestamps)
         self.timestamp_check.stateChanged.connect(self.toggle_timestamps)
+        self.stream_check = QCheckBox("Stream Responses")
+        self.stream_check.setChecked(self.stream_responses)
+        self.stream_check.stateChanged.connect(self.toggle_streaming)
+        self.warm_check = QCheckBox("Connect While Typing")
+        self.warm_check.setToolTip(
+            f"Open the connection to Gemini when you start typing, so sending skips the setup. "
+            f"It is closed after {WARM_IDLE_SECONDS} s without use."
+        )
+        self.warm_check.setChecked(self.warm_connection)
+        self.warm_check.stateChanged.connect(self.toggle_warm_connection)
         bubble_layout.addWidget(QLabel("Bubble Radius"))
         bubble_layout.addWidget(self.radius_slider)
+        bubble_layout.addWidget(self.shadow_check)
+        bubble_layout.addWidget(QLabel("Turn Shadows Off Above (messages)"))
+        bubble_layout.addWidget(self.shadow_limit_input)
         bubble_layout.addWidget(self.timestamp_check)
+        bubble_layout.addWidget(self.stream_check)
+        bubble_layout.addWidget(self.warm_check)
+        self.in_flight_input = QSpinBox()
+        self.in_flight_input.setRange(*CONFIG_RANGES["max_in_flight"])
+        self.in_flight_input.setValue(self.max_in_flight)
+        self.in_flight_input.valueChanged.connect(self.update_max_in_flight)
+        bubble_layout.addWidget(QLabel("Concurrent Requests"))
+        bubble_layout.addWidget(self.in_flight_input)
+        self.open_chats_input = QSpinBox()
+        self.open_chats_input.setRange(*CONFIG_RANGES["max_open_chats"])
+        self.open_chats_input.setValue(self.max_open_chats)
+        self.open_chats_input.valueChanged.connect(self.update_max_open_chats)
+        bubble_layout.addWidget(QLabel("Open Chat Tabs"))
+        bubble_layout.addWidget(self.open_chats_input)
+        self.retries_input = QSpinBox()
+        self.retries_input.setRange(*CONFIG_RANGES["max_retries"])
+        self.retries_input.setValue(self.max_retries)
+        self.retries_input.valueChanged.connect(self.update_retries)
+        bubble_layout.addWidget(QLabel("Retries After Rate Limits and Server Errors"))
+        bubble_layout.addWidget(self.retries_input)
+        self.timeout_input = QSpinBox()
+        self.timeout_input.setRange(*CONFIG_RANGES["request_timeout"])
+        self.timeout_input.setSpecialValueText("No limit")
+        self.timeout_input.setValue(self.request_timeout)
+        self.timeout_input.valueChanged.connect(self.update_request_timeout)
+        bubble_layout.addWidget(QLabel("Request Timeout (seconds)"))
+        bubble_layout.addWidget(self.timeout_input)
+        self.rpm_input = QSpinBox()
+        self.rpm_input.setRange(*CONFIG_RANGES["requests_per_minute"])
+        self.rpm_input.setSpecialValueText("No limit")
+        self.rpm_input.setValue(self.requests_per_minute)
+        self.rpm_input.valueChanged.connect(self.update_rate_limits)
+        bubble_layout.addWidget(QLabel("Requests per Minute"))
+        bubble_layout.addWidget(self.rpm_input)
+        self.tpm_input = QSpinBox()
+        self.tpm_input.setRange(*CONFIG_RANGES["tokens_per_minute"])
+        self.tpm_input.setSingleStep(10000)
+        self.tpm_input.setSpecialValueText("No limit")
+        self.tpm_input.setValue(self.tokens_per_minute)
+        self.tpm_input.valueChanged.connect(self.update_rate_limits)
+        bubble_layout.addWidget(QLabel("Prompt Tokens per Minute"))
+        bubble_layout.addWidget(self.tpm_input)
+        self.context_input = QSpinBox()
+        self.context_input.setRange(*CONFIG_RANGES["context_tokens"])
+        self.context_input.setSingleStep(1000)
+        self.context_input.setSpecialValueText("Latest message only")
+        self.context_input.setValue(self.context_budget)
+        self.context_input.valueChanged.connect(self.update_context_budget)
+        bubble_layout.addWidget(QLabel("Conversation Context (tokens)"))
+        bubble_layout.addWidget(self.context_input)
         bubble_group.setLayout(bubble_layout)
         
         # API settings
         api_group = QGroupBox("API Configuration")
         api_layout = QVBoxLayout()
         self.key_input = QLineEdit()
-        self.key_input.setText(self.config.get("api_key", ""))
+        self.key_input.setText(self.config.api_key)
+        self.key_input.editingFinished.connect(lambda: self.config.set_api_key(self.key_input.text()))
         save_btn = QPushButton("Save Settings")
         save_btn.clicked.connect(lambda: self.button_feedback(save_btn, self.save_config))
         api_layout.addWidget(QLabel("API Key"))
         api_layout.addWidget(self.key_input)
         api_layout.addWidget(save_btn)
         api_group.setLayout(api_layout)
+
+        # Response cache settings
+        cache_group = QGroupBox("Response Cache")
+        cache_layout = QVBoxLayout()
+        self.cache_check = QCheckBox("Reuse cached answers for repeated prompts")
+        self.cache_check.setChecked(self.cache_responses)
+        self.cache_check.stateChanged.connect(lambda state: self.set_response_cache(bool(state)))
+        self.cache_stats_label = QLabel()
+        clear_cache_btn = QPushButton("Clear Cache")
+        clear_cache_btn.clicked.connect(lambda: self.button_feedback(clear_cache_btn, self.clear_response_cache))
+        cache_layout.addWidget(self.cache_check)
+        cache_layout.addWidget(self.cache_stats_label)
+        cache_layout.addWidget(clear_cache_btn)
+        cache_group.setLayout(cache_layout)
+        self.update_cache_stats()
+
+        # Archive settings
+        archive_group = QGroupBox("Archive")
+        archive_layout = QVBoxLayout()
+        self.archive_days_input = QSpinBox()
+        self.archive_days_input.setRange(*CONFIG_RANGES["archive_after_days"])
+        self.archive_days_input.setSpecialValueText("Never")
+        self.archive_days_input.setValue(self.archive_after_days)
+        self.archive_days_input.valueChanged.connect(self.update_archive_days)
+        self.archive_codec_combo = QComboBox()
+        self.archive_codec_combo.addItems(CONFIG_CHOICES["archive_compression"])
+        self.archive_codec_combo.setToolTip("auto uses zstd when the zstandard package is installed, gzip otherwise")
+        self.archive_codec_combo.setCurrentText(self.config.get("archive_compression", "auto"))
+        self.archive_codec_combo.currentTextChanged.connect(self.update_archive_codec)
+        self.archive_stats_label = QLabel()
+        self.archive_button = QPushButton("Archive Now")
+        self.archive_button.clicked.connect(lambda: self.button_feedback(self.archive_button, self.run_archive_job))
+        archive_layout.addWidget(QLabel("Archive Chats Untouched for (days)"))
+        archive_layout.addWidget(self.archive_days_input)
+        archive_layout.addWidget(QLabel("Compression"))
+        archive_layout.addWidget(self.archive_codec_combo)
+        archive_layout.addWidget(self.archive_stats_label)
+        archive_layout.addWidget(self.archive_button)
+        archive_group.setLayout(archive_layout)
+        self.update_archive_stats()
         
         layout.addWidget(theme_group)
         layout.addWidget(font_group)
         layout.addWidget(bubble_group)
         layout.addWidget(api_group)
+        layout.addWidget(cache_group)
+        layout.addWidget(archive_group)
         layout.addStretch()
-        self.tabs.addTab(settings_tab, "Settings")
+        return settings_tab
+
+    # Diagnostics tab: live request, UI and memory metrics, plus the optional file export.
+    def init_diagnostics_tab(self):
+        diagnostics_tab = QWidget()
+        layout = QVBoxLayout(diagnostics_tab)
+        self.gauges_label = QLabel()
+        self.gauges_label.setWordWrap(True)
+        layout.addWidget(self.gauges_label)
+        self.metrics_table = QTableWidget(0, 7)
+        self.metrics_table.setHorizontalHeaderLabels(["Metric", "Count", "Last", "Mean", "p50", "p95", "Max"])
+        self.metrics_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.metrics_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.metrics_table.verticalHeader().setVisible(False)
+        self.metrics_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.metrics_table, 1)
+        export_group = QGroupBox("Export")
+        export_layout = QHBoxLayout()
+        self.export_combo = QComboBox()
+        self.export_combo.addItems(["Off", "JSONL", "Prometheus"])
+        self.export_combo.setCurrentIndex(METRICS_EXPORTS.index(self.metrics_export))
+        self.export_combo.currentIndexChanged.connect(self.update_metrics_export)
+        self.export_path_input = QLineEdit(self.metrics_file)
+        self.export_path_input.setPlaceholderText(METRICS_FILES["jsonl"])
+        self.export_path_input.editingFinished.connect(self.update_metrics_export)
+        export_btn = QPushButton("Write Now")
+        export_btn.clicked.connect(lambda: self.button_feedback(export_btn, self.export_metrics))
+        export_layout.addWidget(QLabel("Format"))
+        export_layout.addWidget(self.export_combo)
+        export_layout.addWidget(QLabel("File"))
+        export_layout.addWidget(self.export_path_input, 1)
+        export_layout.addWidget(export_btn)
+        export_group.setLayout(export_layout)
+        layout.addWidget(export_group)
+        self.diagnostics_timer = QTimer(self)
+        self.diagnostics_timer.setInterval(METRICS_REFRESH_MS)
+        self.diagnostics_timer.timeout.connect(self.refresh_diagnostics)
+        self.tabs.currentChanged.connect(self.diagnostics_visibility)
+        self.diagnostics_visibility()
+        return diagnostics_tab
+
+    # The table only refreshes while the Diagnostics tab is on screen.
+    def diagnostics_visibility(self):
+        if self.tabs.currentWidget() is self.diagnostics_page:
+            self.refresh_diagnostics()
+            self.diagnostics_timer.start()
+        else:
+            self.diagnostics_timer.stop()
+
+    def sample_gauges(self):
+        self.metrics.set_gauge("process_rss_bytes", process_rss())
+        self.metrics.set_gauge("widgets", len(QApplication.allWidgets()))
+        self.metrics.set_gauge("requests_in_flight", len(self.pending))
+        self.metrics.set_gauge("open_chats", len(self.pages))
+        self.metrics.set_gauge("transcript_rows", sum(page.model.rowCount() for page in self.pages.values()))
+        self.metrics.set_gauge("layout_cache_entries", sum(len(page.delegate.layout_cache) for page in self.pages.values()))
+
+    def refresh_diagnostics(self):
+        self.sample_gauges()
+        snapshot = self.metrics.snapshot()
+        gauges = snapshot["gauges"]
+        rss = gauges.get("process_rss_bytes")
+        counters = ", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in sorted(snapshot["counters"].items()))
+        self.gauges_label.setText(
+            (f"Memory (RSS): {rss / 2 ** 20:.1f} MB · " if rss is not None else "")
+            + f"Widgets: {gauges['widgets']} · Requests in flight: {gauges['requests_in_flight']} · "
+            f"Transcript rows: {gauges['transcript_rows']} · Cached layouts: {gauges['layout_cache_entries']}"
+            + (f"\n{counters}" if counters else "")
+        )
+        self.metrics_table.setRowCount(len(snapshot["series"]))
+        for row, (name, values) in enumerate(sorted(snapshot["series"].items())):
+            # Timings are shown in milliseconds; rates as they are.
+            scale, label = (1000, name[:-len("_seconds")] + " (ms)") if name.endswith("_seconds") else (1, name)
+            cells = [label.replace("_", " "), str(values["count"])] + [
+                f"{values[key] * scale:.1f}" for key in ("last", "mean", "p50", "p95", "max")
+            ]
+            for column, text in enumerate(cells):
+                item = self.metrics_table.item(row, column)
+                if item is None:
+                    self.metrics_table.setItem(row, column, QTableWidgetItem(text))
+                else:
+                    item.setText(text)
+
+    def update_metrics_export(self):
+        self.metrics_export = METRICS_EXPORTS[self.export_combo.currentIndex()]
+        self.metrics_file = self.export_path_input.text().strip()
+        self.export_path_input.setPlaceholderText(METRICS_FILES.get(self.metrics_export, METRICS_FILES["jsonl"]))
+        self.config["metrics_export"] = self.metrics_export
+        self.config["metrics_file"] = self.metrics_file
+        self.schedule_export()
+
+    def schedule_export(self):
+        if self.metrics_export == "off":
+            self.export_timer.stop()
+        elif not self.export_timer.isActive():
+            self.export_timer.start()
+
+    def export_metrics(self):
+        fmt = self.metrics_export if self.metrics_export != "off" else "jsonl"
+        path = self.metrics_file or METRICS_FILES[fmt]
+        self.sample_gauges()
+        try:
+            self.metrics.export(path, fmt)
+        except OSError as e:
+            self.statusBar().showMessage(f"Could not write metrics to {path}: {e}")
 
     def init_info_tab(self):
         info_tab = QWidget()
@@ -384,9 +2383,14 @@ class ChatClient(QMainWindow):
             "<ul>"
             "<li>Type your message in the input box at the bottom.</li>"
             "<li>Press the <b>Send</b> button or use <b>Ctrl+Enter</b> to send your message.</li>"
+            "<li>Press <b>Stop</b> or <b>Esc</b> to stop a reply that is still being generated.</li>"
+            "<li>Use <b>Attach</b>, or drop files on the input box, to send logs, PDFs or images with your next message.</li>"
+            "<li>Sessions opened from History get their own tab; <b>+</b> starts a new chat in another tab.</li>"
             "<li>Your messages will appear as bubbles on the right; responses from Gemini will appear on the left.</li>"
             "<li>Use the <b>History</b> tab to review past chat sessions.</li>"
+            "<li>Chats left alone for a while are compressed into an archive (see <b>Settings</b>); they stay in History and open as usual.</li>"
             "<li>In the <b>Settings</b> tab, you can customize the theme, font, and other appearance settings.</li>"
+            "<li>The <b>Diagnostics</b> tab shows request latency, UI stalls and memory use, and can write them to a file.</li>"
             "</ul>"
             "<p>Enjoy your chat experience!</p>"
         )
@@ -395,62 +2399,19 @@ class ChatClient(QMainWindow):
         label.setAlignment(Qt.AlignTop)
         layout.addWidget(label)
         layout.addStretch()
-        self.tabs.addTab(info_tab, "Info")
+        return info_tab
 
-    def apply_theme(self):
-        self.theme = self.theme_combo.currentText()
-        colors = GruvboxTheme.DARK_SOFT if "Dark" in self.theme else GruvboxTheme.LIGHT_SOFT
-        style = f"""
-            QMainWindow {{ background-color: {colors['window_bg']}; }}
-            QWidget {{ background-color: {colors['window_bg']}; color: {colors['text']}; }}
-            QPushButton {{ 
-                background-color: {colors['button_bg']}; 
-                color: {colors['text']}; 
-                border-radius: 8px; 
-                padding: 8px;
-            }}
-            QPushButton:hover {{ background-color: {colors['button_hover']}; }}
-            QLineEdit, QComboBox, QSpinBox {{ 
-                background-color: {colors['button_bg']}; 
-                color: {colors['text']}; 
-                border-radius: 5px; 
-                padding: 6px;
-            }}
-            QTabBar::tab {{ 
-                background: {colors['button_bg']}; 
-                color: {colors['accent']}; 
-                padding: 15px;
-            }}
-            QTabBar::tab:selected {{ 
-                background: {colors['button_hover']}; 
-                border-left: 3px solid {colors['accent']};
-            }}
-            QScrollArea, QScrollArea > QWidget {{
-                background-color: {colors['window_bg']}; 
-                color: {colors['text']};
-            }}
-            QScrollBar:vertical {{
-                background: {colors['button_bg']};
-                width: 12px;
-                margin: 0px;
-            }}
-            QScrollBar::handle:vertical {{
-                background: {colors['button_hover']};
-                min-height: 20px;
-            }}
-        """
-        self.setStyleSheet(style)
-        palette = QPalette()
-        palette.setColor(QPalette.Window, QColor(colors['window_bg']))
-        palette.setColor(QPalette.WindowText, QColor(colors['text']))
-        palette.setColor(QPalette.Base, QColor(colors['button_bg']))
-        palette.setColor(QPalette.Text, QColor(colors['text']))
-        palette.setColor(QPalette.Button, QColor(colors['button_bg']))
-        palette.setColor(QPalette.ButtonText, QColor(colors['text']))
-        self.setPalette(palette)
-        self.refresh_sessions()
-        self.update_font()
-        self.update_bubble_radius(self.radius_slider.value())
+    def apply_theme(self, theme):
+        self.theme = theme
+        self.config["theme"] = self.theme
+        self.theme_engine.apply(self.theme)
+        self.setPalette(ThemeEngine.palette(self.theme))
+        for page in self.pages.values():
+            page.delegate.set_theme(self.theme)
+        self.transcript.viewport().update()
+        if self.history_page.built:
+            self.history_delegate.set_theme(self.theme)
+            self.history_view.viewport().update()
 
     def update_font(self):
         self.font_family = self.font_family_combo.currentFont().family()
@@ -460,171 +2421,888 @@ class ChatClient(QMainWindow):
             "font_size": self.font_size
         })
         self.input_field.setFont(QFont(self.font_family, self.font_size))
-        for i in range(self.chat_area_layout.count()):
-            container = self.chat_area_layout.itemAt(i).widget()
-            if container:
-                bubble = container.findChild(ChatBubble)
-                if bubble:
-                    bubble.label.setFont(QFont(self.font_family, self.font_size))
-                    bubble.apply_style()
+        for page in self.pages.values():
+            page.delegate.set_font(QFont(self.font_family, self.font_size))
+            page.view.relayout()
 
     def update_bubble_radius(self, value):
         self.bubble_radius = value
         self.config["bubble_radius"] = value
-        for i in range(self.chat_area_layout.count()):
-            container = self.chat_area_layout.itemAt(i).widget()
-            if container:
-                bubble = container.findChild(ChatBubble)
-                if bubble:
-                    bubble.setStyleSheet(bubble.styleSheet() + f"border-radius: {value}px;")
+        for page in self.pages.values():
+            page.delegate.set_radius(value)
+        self.transcript.viewport().update()
+
+    def update_shadows(self):
+        self.bubble_shadows = self.shadow_check.isChecked()
+        self.shadow_limit = self.shadow_limit_input.value()
+        self.config.update({
+            "bubble_shadows": self.bubble_shadows,
+            "shadow_limit": self.shadow_limit
+        })
+        for page in self.pages.values():
+            page.delegate.set_shadows(self.bubble_shadows, self.shadow_limit)
+        self.transcript.viewport().update()
 
     def toggle_timestamps(self, state):
         self.show_timestamps = bool(state)
         self.config["show_timestamps"] = self.show_timestamps
 
+    def toggle_streaming(self, state):
+        self.stream_responses = bool(state)
+        self.config["stream_responses"] = self.stream_responses
+
+    def toggle_warm_connection(self, state):
+        self.warm_connection = bool(state)
+        self.config["warm_connection"] = self.warm_connection
+        if self.warm_connection:
+            self.warm_up_connection()
+        else:
+            self.close_connection()
+
+    # warm_up_connection runs on every edit of the input box, so it only restarts the idle timer
+    # unless the connection is closed and no warm-up is running yet.
+    def warm_up_connection(self):
+        if not self.warm_connection or not self.config.api_key or not self.input_field.toPlainText():
+            return
+        self.warm_timer.start()
+        if self.warm_job is not None and not self.warm_job.done():
+            return
+        if self.executor.model_cache.is_warm(self.config.api_key, MODEL_NAME):
+            return
+        self.warm_job = self.warm_pool.submit(self.executor.model_cache.warm, self.config.api_key, MODEL_NAME)
+        self.warm_job.add_done_callback(self.record_warm_up)
+
+    # record_warm_up runs on the warm-up thread; Metrics takes its own lock.
+    def record_warm_up(self, job):
+        if not job.cancelled() and job.result() is not None:
+            self.metrics.count("connection_warm_ups")
+            self.metrics.observe("connection_warm_up_seconds", job.result())
+
+    # close_connection waits for replies in flight, which still use the connection.
+    def close_connection(self):
+        if self.pending:
+            self.warm_timer.start()
+            return
+        self.warm_timer.stop()
+        self.warm_pool.submit(self.executor.model_cache.close)
+
+    def set_response_cache(self, enabled):
+        self.cache_responses = enabled
+        self.config["response_cache"] = enabled
+        if enabled and self.response_cache is None:
+            self.response_cache = ResponseCache(
+                os.path.join(CHAT_DIR, RESPONSE_CACHE_FILE),
+                max_bytes=self.config.get("response_cache_mb", RESPONSE_CACHE_MB) * 1024 * 1024,
+                ttl=self.config.get("response_cache_ttl_hours", RESPONSE_CACHE_TTL_HOURS) * 3600,
+            )
+        self.executor.response_cache = self.response_cache if enabled else None
+        if self.settings_page.built:
+            self.update_cache_stats()
+
+    def clear_response_cache(self):
+        if self.response_cache:
+            self.response_cache.clear()
+        self.update_cache_stats()
+
+    def update_cache_stats(self):
+        if not self.response_cache:
+            self.cache_stats_label.setText("Cache is off")
+            return
+        stats = self.response_cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        rate = f" ({stats['hits'] * 100 // lookups}% hit rate)" if lookups else ""
+        self.cache_stats_label.setText(
+            f"{stats['hits']} hits, {stats['misses']} misses{rate}\n"
+            f"{stats['entries']} entries, {stats['bytes'] / 1024:.1f} KB"
+        )
+
+    def update_archive_days(self, value):
+        self.archive_after_days = value
+        self.config["archive_after_days"] = value
+        self.archive_button.setEnabled(value > 0)
+
+    def update_archive_codec(self, value):
+        self.config["archive_compression"] = value
+        self.archive.codec = pick_codec(value)
+        self.update_archive_stats()
+
+    def update_archive_stats(self):
+        stats = self.archive.stats()
+        self.archive_button.setEnabled(self.archive_after_days > 0)
+        if not stats["sessions"]:
+            text = "No archived chats"
+        else:
+            text = (
+                f"{stats['sessions']} chats in {stats['bundles']} bundle(s): {format_size(stats['bytes'])} "
+                f"({format_size(stats['original_bytes'])} uncompressed)"
+            )
+        self.archive_stats_label.setText(f"{text}\nNew archives use {self.archive.codec}")
+
+    # run_archive_job archives idle sessions on the archive thread. Open chats are pinned in the
+    # archive, so only sessions nobody is looking at are moved.
+    def run_archive_job(self):
+        if not self.archive_after_days or (self.archive_job is not None and not self.archive_job.done()):
+            return
+        self.archive_job = self.archive_pool.submit(self.archive_sessions, self.archive_after_days)
+
+    def archive_sessions(self, days):
+        try:
+            result = self.archive.maintain(days)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            self.archive_signals.failed.emit(str(e))
+            return
+        self.archive_signals.finished.emit(result)
+
+    @pyqtSlot(object)
+    def archive_finished(self, result):
+        if result["archived"]:
+            self.statusBar().showMessage(
+                f"Archived {result['archived']} idle chat(s), {format_size(result['archived_bytes'])}"
+            )
+            if self.history_page.built:
+                self.session_model.forget_meta()
+        if self.settings_page.built:
+            self.update_archive_stats()
+
+    @pyqtSlot(str)
+    def archive_failed(self, message):
+        self.statusBar().showMessage(f"Archiving failed: {message}")
+
+    def restore_session(self, filename):
+        try:
+            self.archive.restore(filename)
+        except (OSError, ValueError, RuntimeError, KeyError, sqlite3.Error) as e:
+            self.archive_signals.restore_failed.emit(filename, str(e))
+            return
+        self.archive_signals.restored.emit(filename)
+
+    @pyqtSlot(str)
+    def archive_restored(self, filename):
+        self.restoring.discard(filename)
+        if self.history_page.built:
+            self.session_model.forget_meta()
+        self.statusBar().clearMessage()
+        self.load_session(filename)
+
+    @pyqtSlot(str, str)
+    def archive_restore_failed(self, filename, message):
+        self.restoring.discard(filename)
+        self.archive.unpin(filename)
+        self.statusBar().showMessage(f"Could not open {filename}: {message}")
+
+    def listed_sessions(self):
+        proxy = self.history_proxy
+        return [
+            self.session_model.files[proxy.mapToSource(proxy.index(row, 0)).row()] for row in range(proxy.rowCount())
+        ]
+
+    def export_listed_sessions(self, fmt, label):
+        names = self.listed_sessions()
+        if not names:
+            return
+        out_dir = QFileDialog.getExistingDirectory(self, f"Export {len(names)} chat(s) as {label}")
+        if not out_dir:
+            return
+        # Open chats may still hold appends in their write buffers.
+        for page in self.pages.values():
+            page.session.flush()
+        self.start_transfer(
+            "Exported", len(names), 1,
+            lambda token: export_sessions(CHAT_DIR, names, out_dir, fmt, token=token),
+        )
+
+    def import_session_files(self):
+        paths, _ = QFileDialog.getOpenFileNames(
+            self, "Import chats", "", "Chats (*.jsonl *.txt);;All files (*)"
+        )
+        if paths:
+            self.start_transfer("Imported", len(paths), 0, lambda token: import_sessions(paths, CHAT_DIR, token=token))
+
+    # start_transfer runs one export or import at a time; start(token) returns the results
+    # generator of aui_core.export_sessions or import_sessions, and job[name_at] names the session
+    # or file a failure belongs to.
+    def start_transfer(self, verb, total, name_at, start):
+        if self.transfer_job is not None and not self.transfer_job.done():
+            self.statusBar().showMessage("An export or import is already running")
+            return
+        self.export_button.setEnabled(False)
+        self.import_button.setEnabled(False)
+        self.transfer_token = CancelToken()
+        self.transfer_job = self.transfer_pool.submit(
+            self.run_transfer, verb, total, name_at, start, self.transfer_token
+        )
+
+    def run_transfer(self, verb, total, name_at, start, token):
+        done = 0
+        errors = []
+        shown = 0.0
+        try:
+            for job, result, error in start(token):
+                done += 1
+                if error is not None:
+                    errors.append(f"{os.path.basename(job[name_at])}: {error}")
+                now = time.monotonic()
+                if now - shown > 0.1 or done == total:
+                    shown = now
+                    self.transfer_signals.progress.emit(verb, done, total)
+        except (OSError, ValueError) as e:
+            self.transfer_signals.failed.emit(str(e))
+            return
+        self.transfer_signals.finished.emit({"verb": verb, "done": done, "total": total, "errors": errors})
+
+    @pyqtSlot(str, int, int)
+    def transfer_progress(self, verb, done, total):
+        action = "Exporting" if verb == "Exported" else "Importing"
+        self.statusBar().showMessage(f"{action} chats: {done} of {total}")
+
+    @pyqtSlot(object)
+    def transfer_finished(self, result):
+        self.export_button.setEnabled(True)
+        self.import_button.setEnabled(True)
+        errors = result["errors"]
+        message = f"{result['verb']} {result['done'] - len(errors)} of {result['total']} chat(s)"
+        if errors:
+            message += f"; {len(errors)} failed, first: {errors[0]}"
+        self.statusBar().showMessage(message)
+        if result["verb"] == "Imported":
+            self.refresh_sessions()
+            self.search.sync()
+
+    @pyqtSlot(str)
+    def transfer_failed(self, message):
+        self.export_button.setEnabled(True)
+        self.import_button.setEnabled(True)
+        self.statusBar().showMessage(f"Export or import failed: {message}")
+
+    def update_context_budget(self, value):
+        self.context_budget = value
+        self.config["context_tokens"] = value
+
+    def update_max_in_flight(self, value):
+        self.max_in_flight = value
+        self.config["max_in_flight"] = value
+        self.executor.set_max_in_flight(value)
+
+    def update_max_open_chats(self, value):
+        self.max_open_chats = value
+        self.config["max_open_chats"] = value
+        self.trim_pages()
+
+    def update_retries(self, value):
+        self.max_retries = value
+        self.config["max_retries"] = value
+        self.executor.retries = value
+
+    # The timeout applies to requests sent from now on.
+    def update_request_timeout(self, value):
+        self.request_timeout = value
+        self.config["request_timeout"] = value
+
+    def update_rate_limits(self):
+        self.requests_per_minute = self.rpm_input.value()
+        self.tokens_per_minute = self.tpm_input.value()
+        self.config["requests_per_minute"] = self.requests_per_minute
+        self.config["tokens_per_minute"] = self.tokens_per_minute
+        self.executor.rate_limiter.set_limits(self.requests_per_minute, self.tokens_per_minute)
+
+    # save_config forces an immediate (background) write; other settings save themselves.
     def save_config(self):
-        self.config.update({
-            "api_key": self.key_input.text(),
-            "theme": self.theme,
-            "font_family": self.font_family,
-            "font_size": self.font_size,
-            "bubble_radius": self.bubble_radius,
-            "show_timestamps": self.show_timestamps
-        })
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(self.config, f)
-
-    def load_config(self):
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r") as f:
-                return json.load(f)
-        return {
-            "api_key": "",
-            "theme": "Gruvbox Dark Soft",
-            "font_family": "JetBrains Mono",
-            "font_size": 14,
-            "bubble_radius": 12,
-            "show_timestamps": False
-        }
+        self.config.set_api_key(self.key_input.text())
+        self.config.flush()
+
+    def apply_external_config(self, data):
+        self.settings_page.ensure()
+        self.theme_combo.setCurrentText(data["theme"])
+        self.font_family_combo.setCurrentFont(QFont(data["font_family"]))
+        self.font_size_input.setValue(data["font_size"])
+        self.radius_slider.setValue(data["bubble_radius"])
+        self.shadow_check.setChecked(data["bubble_shadows"])
+        self.shadow_limit_input.setValue(data["shadow_limit"])
+        self.timestamp_check.setChecked(data["show_timestamps"])
+        self.stream_check.setChecked(data["stream_responses"])
+        self.warm_check.setChecked(data["warm_connection"])
+        self.in_flight_input.setValue(data["max_in_flight"])
+        self.open_chats_input.setValue(data["max_open_chats"])
+        self.retries_input.setValue(data["max_retries"])
+        self.timeout_input.setValue(data["request_timeout"])
+        self.metrics_export = data["metrics_export"]
+        self.metrics_file = data["metrics_file"]
+        if self.diagnostics_page.built:
+            self.export_path_input.setText(self.metrics_file)
+            self.export_combo.setCurrentIndex(METRICS_EXPORTS.index(self.metrics_export))
+        self.schedule_export()
+        self.rpm_input.setValue(data["requests_per_minute"])
+        self.tpm_input.setValue(data["tokens_per_minute"])
+        self.context_input.setValue(data["context_tokens"])
+        self.cache_check.setChecked(data["response_cache"])
+        self.archive_days_input.setValue(data["archive_after_days"])
+        self.archive_codec_combo.setCurrentText(data["archive_compression"])
+        self.key_input.setText(self.config.api_key)
 
     def new_chat(self):
-        filename = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        self.current_session_file = os.path.join(CHAT_DIR, filename)
-        self.clear_chat_area()
-
-    def clear_chat_area(self):
-        for i in reversed(range(self.chat_area_layout.count())):
-            widget = self.chat_area_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
-        self.pending_response = None
-
-    def load_session(self, item):
-        path = os.path.join(CHAT_DIR, item.text())
-        self.current_session_file = path
-        self.clear_chat_area()
-        with open(path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.startswith("[") and "]:" in line:
-                    sender_part, message = line.split("]:", 1)
-                    sender = sender_part.strip("[").strip()
-                    self.append_message(sender, message.strip(), save=False)
+        if self.page is not None and self.page.untouched():
+            self.chat_tabs.setCurrentWidget(self.page)
+            self.tabs.setCurrentWidget(self.chat_widget)
+            return
+        filename = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}{SESSION_EXT}"
+        path = os.path.join(CHAT_DIR, filename)
+        if path in self.pages:
+            # Another New Chat within the same second.
+            self.chat_tabs.setCurrentWidget(self.pages[path])
+            return
+        self.open_page(path)
+
+    # open_page adds a tab for path and makes it current. An untouched New Chat tab is replaced
+    # instead of kept, and past max_open_chats the least recently used idle tab is closed.
+    def open_page(self, path):
+        replace = self.page if self.page is not None and self.page.untouched() else None
+        page = ChatPage(path)
+        page.delegate.set_theme(self.theme)
+        page.delegate.set_font(QFont(self.font_family, self.font_size))
+        page.delegate.set_radius(self.bubble_radius)
+        page.delegate.set_shadows(self.bubble_shadows, self.shadow_limit)
+        page.view.near_top.connect(lambda: self.load_older_page(page))
+        page.view.ask_again_requested.connect(self.ask_again)
+        self.archive.pin(os.path.basename(path))
+        self.pages[path] = page
+        index = self.chat_tabs.addTab(page, page.title())
+        self.chat_tabs.setTabToolTip(index, os.path.basename(path))
+        self.chat_tabs.setCurrentWidget(page)
+        if replace is not None:
+            self.close_page(replace)
+        self.trim_pages()
+        return page
+
+    def trim_pages(self):
+        idle = sorted(
+            (page for page in self.pages.values()
+             if page is not self.page and not page.busy() and not page.attachments),
+            key=lambda page: page.last_used,
+        )
+        while len(self.pages) > self.max_open_chats and idle:
+            self.close_page(idle.pop(0))
+
+    # close_page closes a tab. Replies in flight for it are still saved to its session file when
+    # they arrive; prompts still waiting in its queue were never sent and are dropped.
+    def close_page(self, page):
+        if len(self.pages) == 1:
+            if page.untouched():
+                return
+            self.new_chat()
+        if page.queue:
+            self.statusBar().showMessage(f"{len(page.queue)} queued message(s) not sent")
+        for entry in self.pending.values():
+            if entry["session"] == page.path:
+                entry["row"] = None
+        del self.pages[page.path]
+        self.archive.unpin(os.path.basename(page.path))
+        self.chat_tabs.removeTab(self.chat_tabs.indexOf(page))
+        page.session.close()
+        page.deleteLater()
+
+    # activate_page points the current-session attributes at the tab now on screen and paints
+    # the replies that streamed into it while it was in the background.
+    def activate_page(self, index):
+        page = self.chat_tabs.widget(index)
+        if page is None:
+            return
+        self.page = page
+        page.last_used = time.monotonic()
+        self.current_session_file = page.path
+        self.session = page.session
+        self.transcript = page.view
+        self.transcript_model = page.model
+        self.bubble_delegate = page.delegate
+        for entry in self.pending.values():
+            if entry["session"] == page.path and entry["stale"] and entry["row"] is not None:
+                page.model.set_text(entry["row"], f"[Gemini]\n{entry['text']}")
+                entry["stale"] = False
+        self.update_stop_button()
+
+    def sync_session(self):
+        for page in self.pages.values():
+            page.session.sync()
+
+    # load_session reads only the last page through the session index, so opening
+    # a session costs the same regardless of its length. A session already open is just shown.
+    def load_session(self, filename):
+        started = time.perf_counter()
+        path = os.path.join(CHAT_DIR, filename)
+        self.tabs.setCurrentWidget(self.chat_widget)
+        if path in self.pages:
+            self.chat_tabs.setCurrentWidget(self.pages[path])
+            return
+        if not os.path.exists(path) and self.archive.contains(filename):
+            # Archived: streamed back into a normal session file on the archive thread, pinned
+            # so the archive job leaves it alone while it is open; archive_restored opens it.
+            if filename not in self.restoring:
+                self.restoring.add(filename)
+                self.archive.pin(filename)
+                self.archive_pool.submit(self.restore_session, filename)
+            self.statusBar().showMessage(f"Opening archived chat {filename}…")
+            return
+        page = self.open_page(path)
+        total = len(page.session)
+        page.loaded_from = max(0, total - PAGE_SIZE)
+        page.model.extend(
+            (record["sender"], self.format_record(record), record["text"], record.get("attachments"))
+            for record in page.session.read_range(page.loaded_from, total)
+        )
+        # Back in a session whose reply is still on its way: show it again.
+        for request_id, entry in self.pending.items():
+            if entry["session"] == path:
+                page.active = request_id
+                entry["row"] = self.show_generating(page)
+                entry["stale"] = False
+                if entry["text"]:
+                    page.model.set_text(entry["row"], f"[Gemini]\n{entry['text']}")
+        self.update_stop_button()
+        page.view.scrollToBottom()
+        # Keep loading until the viewport is filled, otherwise there is nothing to scroll.
+        while page.loaded_from > 0 and page.view.verticalScrollBar().maximum() == 0:
+            self.load_older_page(page)
+        self.metrics.observe("session_load_seconds", time.perf_counter() - started)
+
+    def load_older_page(self, page=None):
+        page = page or self.page
+        if page.loaded_from <= 0:
+            return
+        start = max(0, page.loaded_from - PAGE_SIZE)
+        records = page.session.read_range(start, page.loaded_from)
+        page.loaded_from = start
+        page.view.keep_position(lambda: page.model.prepend(
+            (record["sender"], self.format_record(record), record["text"], record.get("attachments"))
+            for record in records
+        ))
 
+    # refresh_sessions diffs the directory against the History model; unchanged rows are untouched.
+    # refresh_sessions lists live sessions plus the archive catalog's names, which are cached
+    # until the archive changes, so it costs one directory listing of recent sessions.
     def refresh_sessions(self):
-        for i in reversed(range(self.history_layout.count())):
-            widget = self.history_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
-        self.history_items.clear()
-        for file in sorted(os.listdir(CHAT_DIR), reverse=True):
-            item = HistoryItem(file, self.theme)
-            item.deleteClicked.connect(self.delete_session)
-            self.history_layout.addWidget(item)
-            self.history_items.append(item)
+        self.session_model.set_files(session_files(CHAT_DIR) + self.archive.names())
 
+    # filter_sessions queries the message index off the GUI thread; show_search_results applies it.
     def filter_sessions(self):
-        query = self.search_bar.text().lower()
-        for item in self.history_items:
-            visible = query in item.filename.lower()
-            item.setVisible(visible)
+        query = self.search_bar.text().strip()
+        if not query:
+            self.search_token = 0
+            self.history_proxy.set_results(None)
+            return
+        self.search_token = self.search.search(query)
+
+    @pyqtSlot(int, list)
+    def show_search_results(self, token, results):
+        if token != self.search_token:
+            return
+        query = self.search_bar.text().strip().lower()
+        ranked = {}
+        for rank, (session, hits, snippet) in enumerate(results):
+            label = "match" if hits == 1 else "matches"
+            ranked[session] = (rank, f"{snippet} <i>({hits} {label})</i>")
+        # Sessions whose name matches still show up, after the content matches.
+        for session in self.session_model.files:
+            if session not in ranked and query in session.lower():
+                ranked[session] = (len(ranked), None)
+        self.history_proxy.set_results(ranked)
 
     def delete_session(self, filename):
         path = os.path.join(CHAT_DIR, filename)
         if os.path.exists(path):
-            os.remove(path)
-            self.refresh_sessions()
+            for request_id, entry in list(self.pending.items()):
+                if entry["session"] == path:
+                    self.executor.cancel(request_id, "Chat deleted")
+                    del self.pending[request_id]
+            page = self.pages.get(path)
+            if page is not None:
+                page.queue.clear()
+                page.active = None
+                self.close_page(page)
+            delete_session_files(path)
+            self.search.remove(filename)
+            self.session_model.remove_file(filename)
+        elif self.archive.contains(filename):
+            self.archive.remove(filename)
+            self.search.remove(filename)
+            self.session_model.remove_file(filename)
 
-    # append_message wraps each ChatBubble in a horizontal container for alignment.
-    def append_message(self, sender, message, save=True):
-        timestamp = datetime.now().strftime("%H:%M") if self.show_timestamps else ""
-        formatted_msg = f"[{sender} at {timestamp}]\n{message}" if timestamp else f"[{sender}]\n{message}"
-        is_user = (sender == "You")
-        bubble = ChatBubble(formatted_msg, is_user, self.theme)
-        bubble.setFont(QFont(self.font_family, self.font_size))
-        container = QWidget()
-        h_layout = QHBoxLayout(container)
-        h_layout.setContentsMargins(0, 0, 0, 0)
-        if is_user:
-            h_layout.addStretch(1)
-            h_layout.addWidget(bubble)
+    # format_message lists attachments on the bubble's last line.
+    def format_message(self, sender, message, ts=None, cached=False, attachments=()):
+        label = f"{sender} · cached" if cached else sender
+        if attachments:
+            files = ", ".join(f"{item['name']} ({format_size(item['size'])})" for item in attachments)
+            message = f"{message}\nAttached: {files}"
+        if self.show_timestamps:
+            timestamp = datetime.fromisoformat(ts) if ts else datetime.now()
+            return f"[{label} at {timestamp.strftime('%H:%M')}]\n{message}"
+        return f"[{label}]\n{message}"
+
+    def format_record(self, record):
+        return self.format_message(
+            record["sender"], record["text"], record.get("ts"), record.get("cached", False),
+            record.get("attachments", ()),
+        )
+
+    def choose_attachments(self):
+        paths, _ = QFileDialog.getOpenFileNames(self, "Attach files")
+        self.attach_files(paths)
+
+    # attach_files adds files to the current page's next prompt and copies them into the blob
+    # store on the attachment threads, so hashing a large log never blocks the window; a file
+    # already in the store is only read, not copied.
+    def attach_files(self, paths):
+        page = self.page
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            item = {"id": next(self.attachment_ids), "name": os.path.basename(path), "record": None}
+            item["chip"] = chip = QPushButton(f"{item['name']} …")
+            chip.setToolTip(path)
+            chip.clicked.connect(lambda checked, item_id=item["id"]: self.remove_attachment(item_id))
+            page.attachment_layout.insertWidget(len(page.attachments), chip)
+            page.attachments.append(item)
+            self.attach_pool.submit(self.import_attachment, item["id"], path)
+        page.attachment_bar.setVisible(bool(page.attachments))
+
+    def import_attachment(self, item_id, path):
+        try:
+            record = self.blob_store.add(path)
+        except OSError as e:
+            self.attachment_signals.failed.emit(item_id, str(e))
+            return
+        self.attachment_signals.imported.emit(item_id, record)
+
+    # find_attachment returns the page a pending attachment belongs to and its item.
+    def find_attachment(self, item_id):
+        for page in self.pages.values():
+            for item in page.attachments:
+                if item["id"] == item_id:
+                    return page, item
+        return None, None
+
+    @pyqtSlot(int, object)
+    def attachment_imported(self, item_id, record):
+        page, item = self.find_attachment(item_id)
+        if item is None:
+            return
+        item["record"] = record
+        item["chip"].setText(f"{record['name']} · {format_size(record['size'])}  ×")
+
+    @pyqtSlot(int, str)
+    def attachment_failed(self, item_id, message):
+        if self.find_attachment(item_id)[1] is not None:
+            self.remove_attachment(item_id)
+            self.statusBar().showMessage(f"Could not attach file: {message}")
+
+    def remove_attachment(self, item_id):
+        page, item = self.find_attachment(item_id)
+        if item is None:
+            return
+        page.attachments.remove(item)
+        item["chip"].deleteLater()
+        page.attachment_bar.setVisible(bool(page.attachments))
+
+    def save_message(self, sender, message, session_file=None, **extra):
+        session_file = session_file or self.current_session_file
+        page = self.pages.get(session_file)
+        if page is not None:
+            store = page.session
+            record = store.append(sender, message, **extra)
+            store.flush()
+            self.sync_timer.start()
         else:
-            h_layout.addWidget(bubble)
-            h_layout.addStretch(1)
-        self.chat_area_layout.insertWidget(self.chat_area_layout.count()-1, container)
-        if save and self.current_session_file:
-            with open(self.current_session_file, "a", encoding='utf-8') as f:
-                f.write(f"{formatted_msg}\n")
-
-    def show_generating(self):
+            # A late reply for a session that is no longer open.
+            store = SessionStore(session_file)
+            record = store.append(sender, message, **extra)
+            store.close()
+        self.search.add(session_file, len(store) - 1, record)
+        if self.history_page.built:
+            self.session_model.update_meta(os.path.basename(session_file), store.stats())
+        return record
+
+    # append_message adds a row to the transcript model; the delegate aligns it by sender.
+    def append_message(self, sender, message, save=True):
+        record = self.save_message(sender, message) if save else None
+        formatted_msg = self.format_record(record) if record else self.format_message(sender, message)
+        follow = self.transcript.is_at_bottom()
+        self.transcript_model.append(sender, formatted_msg)
+        if follow:
+            self.transcript.scrollToBottom()
+
+    def show_generating(self, page=None):
+        page = page or self.page
         quote = random.choice(BENNETT_QUOTES)
-        self.pending_response = ChatBubble(
-            f"Generating response......\n\"{quote}\" ~ Bennet Foddy",
-            False,
-            self.theme
+        row = page.model.append(
+            "Gemini", f"Generating response......\n\"{quote}\" ~ Bennet Foddy"
         )
-        container = QWidget()
-        h_layout = QHBoxLayout(container)
-        h_layout.setContentsMargins(0, 0, 0, 0)
-        h_layout.addWidget(self.pending_response)
-        h_layout.addStretch(1)
-        self.chat_area_layout.insertWidget(self.chat_area_layout.count()-1, container)
+        page.view.scrollToBottom()
+        return row
 
     def send_message(self):
         text = self.input_field.toPlainText().strip()
-        if not text:
+        pending = self.page.attachments
+        if any(item["record"] is None for item in pending):
+            self.statusBar().showMessage("Still copying attachments, send again when they are ready")
+            return
+        if not text and not pending:
             return
-        self.append_message("You", text)
+        attachments = [item["record"] for item in pending]
+        for item in list(pending):
+            self.remove_attachment(item["id"])
         self.input_field.clear()
-        self.show_generating()
-        self.worker = AIWorker(text, self.key_input.text())
-        self.worker.response_stream.connect(self.handle_response)
-        self.worker.start()
+        self.send_text(text, attachments=attachments)
 
-    @pyqtSlot(str)
-    def handle_response(self, response):
-        if self.pending_response:
-            self.pending_response.parent().deleteLater()
-            self.pending_response = None
-        self.append_message("Gemini", response)
-        self.scroll.ensureVisible(0, self.chat_area.height())
-
-    # Event filter to capture Ctrl+Enter key press on input_field.
+    # send_text shows the prompt at once and queues it on the current page; it is saved and sent
+    # when the page's previous request has finished.
+    def send_text(self, text, use_cache=True, attachments=()):
+        page = self.page
+        row = page.model.append("You", self.format_message("You", text, attachments=attachments), text, attachments)
+        page.view.scrollToBottom()
+        page.queue.append((text, use_cache, row, attachments))
+        self.submit_next(page)
+        self.update_stop_button()
+
+    def submit_next(self, page):
+        if page.active is not None or not page.queue:
+            return
+        text, use_cache, row, attachments = page.queue.popleft()
+        extra = {"attachments": attachments} if attachments else {}
+        record = self.save_message("You", text, page.path, **extra)
+        page.model.set_text(row, self.format_record(record))
+        if len(page.session) == 1:
+            self.chat_tabs.setTabText(self.chat_tabs.indexOf(page), page.title())
+        request = AIRequest(
+            text, self.config.api_key, page.path, stream=self.stream_responses,
+            history_end=len(page.session) - 1, context_budget=self.context_budget, use_cache=use_cache,
+            timeout=self.request_timeout, attachments=attachments,
+        )
+        page.active = request.id
+        self.pending[request.id] = {
+            "session": page.path,
+            "row": self.show_generating(page),
+            "text": "",
+            "chunks": [],
+            "stale": False,
+        }
+        self.executor.submit(request)
+
+    # request_finished frees the page for its next queued prompt.
+    def request_finished(self, request_id, entry):
+        page = self.pages.get(entry["session"])
+        if page is not None and page.active == request_id:
+            page.active = None
+            self.submit_next(page)
+        self.update_stop_button()
+        if self.warm_connection:
+            self.warm_timer.start()
+
+    # stop_requests cancels this chat's reply and its queued prompts, and shows them as stopped
+    # straight away; the worker notices the cancellation at its next chunk or wait, and its
+    # report is ignored.
+    def stop_requests(self):
+        page = self.page
+        while page.queue:
+            text, use_cache, row, attachments = page.queue.popleft()
+            page.model.set_error(row, self.format_message("You", text, attachments=attachments) + "\n■ Not sent")
+        for request_id, entry in list(self.pending.items()):
+            if entry["session"] == page.path:
+                self.executor.cancel(request_id)
+                del self.pending[request_id]
+                self.show_failure(entry, "cancelled", 0, "Stopped")
+        page.active = None
+        self.update_stop_button()
+
+    def update_stop_button(self):
+        self.stop_button.setEnabled(self.page is not None and self.page.busy())
+
+    # ask_again re-sends the prompt at (or above) row, with its attachments, skipping the response cache.
+    def ask_again(self, row):
+        messages = self.transcript_model.messages
+        for position in range(min(row, len(messages) - 1), -1, -1):
+            prompt = self.transcript_model.prompts.get(messages[position][0])
+            if prompt is not None:
+                text, attachments = prompt
+                self.send_text(text, use_cache=False, attachments=attachments)
+                return
+
+    # Chunks are buffered and painted by flush_stream, so a fast stream relayouts once per tick.
+    @pyqtSlot(int, str)
+    def handle_chunk(self, request_id, chunk):
+        entry = self.pending.get(request_id)
+        if entry is None:
+            return
+        entry["chunks"].append(chunk)
+        if not self.stream_timer.isActive():
+            self.stream_timer.start()
+
+    # Only the tab on screen is updated; background tabs just collect the text and are painted
+    # once when they are shown (activate_page), so they cost no relayout while streaming.
+    def flush_stream(self):
+        follow = self.transcript.is_at_bottom()
+        for entry in self.pending.values():
+            if not entry["chunks"]:
+                continue
+            entry["text"] += "".join(entry["chunks"])
+            entry["chunks"] = []
+            if entry["row"] is None:
+                continue
+            if entry["session"] == self.current_session_file:
+                self.transcript_model.set_text(entry["row"], f"[Gemini]\n{entry['text']}")
+            else:
+                entry["stale"] = True
+        if follow:
+            self.transcript.scrollToBottom()
+
+    @pyqtSlot(int, float)
+    def report_first_token(self, request_id, seconds):
+        self.statusBar().showMessage(f"First token after {seconds * 1000:.0f} ms")
+
+    @pyqtSlot(int, int, float, str)
+    def report_retry(self, request_id, attempt, delay, message):
+        reason = message.splitlines()[0] if message else "request failed"
+        self.statusBar().showMessage(f"{reason[:80]}; retry {attempt} of {self.max_retries} in {delay:.1f} s")
+
+    # handle_error shows a failed request in place of its reply. Nothing is saved, so the
+    # session only keeps the prompt and Ask Again can re-send it.
+    @pyqtSlot(int, str)
+    def handle_error(self, request_id, message):
+        entry = self.pending.pop(request_id, None)
+        request = self.executor.pop(request_id)
+        if entry is None:
+            # Already stopped, or its chat was deleted.
+            return
+        self.statusBar().clearMessage()
+        if request is not None:
+            self.show_failure(entry, request.error_kind, request.attempts, message)
+        self.request_finished(request_id, entry)
+
+    def show_failure(self, entry, kind, attempts, message):
+        page = self.pages.get(entry["session"])
+        if page is None or entry["row"] is None:
+            return
+        titles = {"rate_limit": "Rate limited", "transient": "Server unavailable", "timeout": "Timed out"}
+        text = entry["text"] + "".join(entry["chunks"])
+        partial = f"{text}\n\n" if text else ""
+        if kind == "cancelled":
+            status = f"■ {message}"
+        else:
+            tries = f" after {attempts} attempts" if attempts > 1 else ""
+            status = f"⚠ {titles.get(kind, 'Request failed')}{tries}: {message}"
+        page.model.set_error(
+            entry["row"], f"[Gemini]\n{partial}{status}\nRight-click and choose Ask Again to retry."
+        )
+        page.view.scrollToBottom()
+
+    @pyqtSlot(int, str)
+    def handle_response(self, request_id, response):
+        entry = self.pending.pop(request_id, None)
+        request = self.executor.pop(request_id)
+        if entry is None:
+            return
+        page = self.pages.get(entry["session"])
+        if page is None and not os.path.exists(entry["session"]):
+            # The session was deleted while the reply was in flight.
+            return
+        extra = {"cached": True} if request is not None and request.cached else {}
+        record = self.save_message("Gemini", response, entry["session"], **extra)
+        formatted_msg = self.format_record(record)
+        if page is not None:
+            if entry["row"] is not None:
+                page.model.set_text(entry["row"], formatted_msg)
+            else:
+                page.model.append("Gemini", formatted_msg)
+            page.view.scrollToBottom()
+        self.request_finished(request_id, entry)
+        if self.settings_page.built:
+            self.update_cache_stats()
+        if request is not None and request.cached:
+            self.statusBar().showMessage("Answered from the response cache")
+        elif request is not None and request.ttft is not None:
+            self.statusBar().showMessage(
+                f"First token after {request.ttft * 1000:.0f} ms, "
+                f"response complete after {request.elapsed:.1f} s"
+            )
+
+    def closeEvent(self, event):
+        if self.metrics_export != "off":
+            self.export_metrics()
+        self.executor.cancel_all()
+        self.executor.shutdown()
+        self.attach_pool.shutdown(wait=False, cancel_futures=True)
+        self.warm_pool.shutdown(wait=False, cancel_futures=True)
+        self.search.shutdown()
+        # A session being archived is finished first; the catalog only changes after its copy is synced.
+        self.archive_pool.shutdown(wait=True, cancel_futures=True)
+        self.archive.close()
+        # Sessions being exported or imported are finished, so no half-written files are left.
+        if self.transfer_token is not None:
+            self.transfer_token.cancel()
+        self.transfer_pool.shutdown(wait=True)
+        if self.response_cache:
+            self.response_cache.close()
+        self.config.close()
+        for page in self.pages.values():
+            page.session.close()
+        super().closeEvent(event)
+
+    # Event filter to capture Ctrl+Enter (send), Esc (stop) and dropped files on input_field.
     def eventFilter(self, source, event):
+        if not self.started and event.type() == QEvent.Paint and source is self.transcript.viewport():
+            self.started = True
+            source.removeEventFilter(self)
+            QTimer.singleShot(0, self.startup_finished)
         if source == self.input_field and event.type() == QEvent.KeyPress:
             if event.key() == Qt.Key_Return and event.modifiers() == Qt.ControlModifier:
                 self.send_message()
                 return True
+            if event.key() == Qt.Key_Escape and self.stop_button.isEnabled():
+                self.stop_requests()
+                return True
+        # Files dropped on the input box are attached rather than pasted as their paths.
+        if source is self.input_field.viewport() and event.type() in (QEvent.DragEnter, QEvent.Drop):
+            urls = event.mimeData().urls() if event.mimeData().hasUrls() else []
+            paths = [url.toLocalFile() for url in urls if url.isLocalFile()]
+            if paths:
+                event.acceptProposedAction()
+                if event.type() == QEvent.Drop:
+                    self.attach_files(paths)
+                return True
         return super().eventFilter(source, event)
 
+    # startup_finished runs once the Chat tab has been painted: report the profile, then import
+    # the Gemini SDK in the background so the first send does not pay for it.
+    def startup_finished(self):
+        self.profile.mark("first paint")
+        self.profile.report()
+        self.metrics.set_gauge("startup_seconds", self.profile.last - self.profile.began)
+        self.stall_monitor.start()
+        self.schedule_export()
+        QTimer.singleShot(ARCHIVE_FIRST_RUN_MS, self.run_archive_job)
+        self.archive_timer.start()
+        warm_up()
+
     # Button feedback: changes style briefly when clicked.
     def button_feedback(self, button, func):
-        original_style = button.styleSheet()
-        button.setStyleSheet(original_style + "background-color: #a9d18e;")
-        QTimer.singleShot(200, lambda: button.setStyleSheet(original_style))
+        self.set_flash(button, True)
+        QTimer.singleShot(200, lambda: self.set_flash(button, False))
         func()
 
+    # set_flash toggles the [flash="true"] rule of the compiled stylesheet on one button.
+    def set_flash(self, button, on):
+        button.setProperty("flash", on)
+        button.style().unpolish(button)
+        button.style().polish(button)
+
 if __name__ == "__main__":
+    # In the frozen build, export and import workers start this executable again; this makes
+    # them run their job instead of opening another window.
+    multiprocessing.freeze_support()
+    # Exports and imports also run without a window: python aui.py export -f html -o exports
+    if len(sys.argv) > 1 and sys.argv[1] in ("export", "import"):
+        sys.exit(run_command(sys.argv[1:], prog="aui.py"))
+    profile = StartupProfile("--profile-startup" in sys.argv)
+    profile.mark("imports")
     app = QApplication(sys.argv)
-    win = ChatClient()
+    profile.mark("QApplication")
+    win = ChatClient(profile)
     win.show()
     sys.exit(app.exec())
@@ -0,0 +1,2233 @@
+# aui_core: Everything AUI does that does not need a window: session storage, context building,
+# the request executor, the response cache, attachments, the archive, export/import and
+# config/key loading. aui.py is the PyQt5 front end over this module; the same pipeline also
+# runs headless:
+#
+#   python aui_core.py run prompts.jsonl --sessions -j 4 --rpm 30
+#   python aui_core.py archive --days 30
+#   python aui_core.py export -f markdown -o exports
+import argparse
+import hashlib
+import html
+import itertools
+import json
+import mimetypes
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+try:
+    import keyring
+except ImportError:
+    keyring = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CONFIG_FILE = "config.json"
+# Holds the API key when no system keyring is available; readable by the owner only.
+KEY_FILE = ".aui_api_key"
+CHAT_DIR = "chat_sessions"
+MODEL_NAME = "gemini-2.5-pro-exp-03-25"
+# Retries back off from RETRY_BASE_DELAY, doubling per attempt up to RETRY_MAX_DELAY (with jitter).
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# A server asking for a longer wait than this is treated as a hard failure.
+RETRY_MAX_WAIT = 300.0
+DEFAULT_RETRIES = 4
+# Most requests that may be in flight at once (the Settings spin box's maximum).
+MAX_IN_FLIGHT = 8
+# Seconds a request may take from submission to its last chunk; 0 means no deadline.
+REQUEST_TIMEOUT = 120
+# A connection opened ahead of a send (ModelCache.warm) is closed after this long without use.
+WARM_IDLE_SECONDS = 90
+WARM_PING_TIMEOUT = 10
+
+# Session files are append-only JSONL; the sidecar index holds one 8-byte offset per record.
+SESSION_EXT = ".jsonl"
+INDEX_EXT = ".idx"
+META_EXT = ".meta"
+SUMMARY_EXT = ".summary"
+# Default number of tokens of earlier conversation sent along with each prompt.
+CONTEXT_TOKEN_BUDGET = 8000
+SUMMARY_FALLBACK_CHARS = 4000
+# Longest a summary call may block, also when the request itself has no timeout.
+SUMMARY_TIMEOUT = 60
+RESPONSE_CACHE_FILE = "response_cache.sqlite3"
+RESPONSE_CACHE_MB = 50
+RESPONSE_CACHE_TTL_HOURS = 24 * 7
+# Attachments live once under CHAT_DIR/BLOB_DIR, named by the SHA-256 of their content.
+BLOB_DIR = "blobs"
+BLOB_CHUNK = 1024 * 1024
+UPLOADS_FILE = "uploads.json"
+# The Files API deletes uploads after 48 hours; upload again a little before that.
+UPLOAD_TTL_HOURS = 47
+UPLOAD_POLL_SECONDS = 2
+# Longest to wait for Gemini to finish processing an upload before giving up on the attempt.
+UPLOAD_PROCESSING_TIMEOUT = 300
+# Sessions untouched for ARCHIVE_AFTER_DAYS move into compressed bundles under CHAT_DIR/ARCHIVE_DIR.
+ARCHIVE_DIR = "archive"
+ARCHIVE_CATALOG = "catalog.sqlite3"
+ARCHIVE_AFTER_DAYS = 30
+BUNDLE_EXT = ".pack"
+# Sessions are archived ARCHIVE_BATCH at a time, with one fsync and one commit per batch; a
+# batch starts a new bundle once the current one is ARCHIVE_BUNDLE_MB.
+ARCHIVE_BATCH = 200
+ARCHIVE_BUNDLE_MB = 64
+# compact() rewrites bundles whose live sessions fill less than this share of the file.
+ARCHIVE_COMPACT_RATIO = 0.5
+ARCHIVE_CHUNK = 256 * 1024
+ZSTD_LEVEL = 10
+# Export writes one file per session in one of these formats; import reads JSONL or legacy .txt.
+EXPORT_FORMATS = {"jsonl": ".jsonl", "markdown": ".md", "html": ".html"}
+# Sessions queued per worker process during an export or import, so a transfer of the whole
+# history never holds every job (or every result) at once.
+TRANSFER_QUEUE = 4
+# Length of the last-message snippet kept in a session's metadata sidecar.
+PREVIEW_CHARS = 120
+LEGACY_EXT = ".txt"
+ROLES = {"You": "user", "Gemini": "model"}
+LEGACY_HEADER = re.compile(r"^\[(You|Gemini)(?: at (\d{1,2}:\d{2}))?\]$")
+
+def session_files(chat_dir):
+    return [name for name in os.listdir(chat_dir) if name.endswith(SESSION_EXT)]
+
+def delete_session_files(path):
+    base = os.path.splitext(path)[0]
+    for candidate in (path, base + INDEX_EXT, base + META_EXT, base + SUMMARY_EXT):
+        if os.path.exists(candidate):
+            os.remove(candidate)
+
+# SessionStore: One session transcript with buffered appends and O(1) access to any record.
+class SessionStore:
+    OFFSET = struct.Struct("<Q")
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + INDEX_EXT
+        self.handle = None
+        self.index_handle = None
+        self.size = 0
+        self.count = 0
+        # offsets holds the record offsets in memory while the sidecar on disk is stale.
+        self.offsets = None
+        self.dirty = False
+        self.checked = False
+        self.meta = None
+
+    def __len__(self):
+        self.check_index()
+        return self.count
+
+    # check_index trusts the sidecar if it ends where the data file ends; otherwise (missing,
+    # torn by a crash, or mid-append in the writer) the offsets are derived in memory. Readers
+    # run on other threads and processes, so only open_for_append ever rewrites either file.
+    def check_index(self):
+        if self.checked:
+            return
+        self.checked = True
+        self.offsets = None
+        if not os.path.exists(self.path):
+            self.size = self.count = 0
+            self.offsets = array("Q")
+            return
+        self.size = os.path.getsize(self.path)
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else -1
+        if index_size >= 0 and index_size % self.OFFSET.size == 0:
+            self.count = index_size // self.OFFSET.size
+            if self.count == 0 and self.size == 0:
+                return
+            if self.count:
+                with open(self.path, "rb") as f:
+                    f.seek(self.offset_at(self.count - 1))
+                    line = f.readline()
+                    if line.endswith(b"\n") and f.tell() == self.size:
+                        return
+        self.scan()
+
+    # scan reads the offsets of the complete records, stopping at a torn trailing line.
+    def scan(self):
+        offsets = array("Q")
+        end = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n") or end + len(line) > self.size:
+                    break
+                offsets.append(end)
+                end += len(line)
+        self.offsets = offsets
+        self.size = end
+        self.count = len(offsets)
+
+    # repair_index writes the in-memory offsets out and drops a torn tail; called by the writer.
+    def repair_index(self):
+        self.check_index()
+        if self.offsets is None:
+            return
+        offsets = self.offsets
+        if sys.byteorder != "little":
+            offsets = array("Q", offsets)
+            offsets.byteswap()
+        with open(self.index_path, "wb", buffering=self.BUFFER_SIZE) as index:
+            offsets.tofile(index)
+        if os.path.exists(self.path) and os.path.getsize(self.path) != self.size:
+            with open(self.path, "r+b") as f:
+                f.truncate(self.size)
+        self.offsets = None
+
+    def offset_at(self, position):
+        if self.offsets is not None:
+            return self.offsets[position]
+        if self.index_handle:
+            self.index_handle.flush()
+        with open(self.index_path, "rb") as f:
+            f.seek(position * self.OFFSET.size)
+            return self.OFFSET.unpack(f.read(self.OFFSET.size))[0]
+
+    def open_for_append(self):
+        if self.handle is None:
+            self.repair_index()
+            self.handle = open(self.path, "ab", buffering=self.BUFFER_SIZE)
+            self.index_handle = open(self.index_path, "ab", buffering=self.BUFFER_SIZE)
+
+    def append(self, sender, text, **extra):
+        self.open_for_append()
+        record = {
+            "id": uuid.uuid4().hex,
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "sender": sender,
+            "role": ROLES.get(sender, "user"),
+            "text": text,
+            "tokens": len(text) // 4 + 1,
+        }
+        record.update(extra)
+        meta = self.stats()
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.handle.write(line)
+        self.index_handle.write(self.OFFSET.pack(self.size))
+        self.size += len(line)
+        self.count += 1
+        self.dirty = True
+        update_meta(meta, record)
+        meta["count"] = self.count
+        meta["size"] = self.size
+        return record
+
+    # stats returns the session's metadata, kept current in memory by append.
+    def stats(self):
+        if self.meta is None:
+            self.flush()
+            self.meta = read_session_meta(self.path) or empty_meta()
+        return self.meta
+
+    def compute_meta(self):
+        meta = empty_meta()
+        total = len(self)
+        if total:
+            update_meta(meta, self.read(0))
+            meta["last_ts"] = None
+            update_meta(meta, self.read(total - 1))
+        meta["count"] = total
+        return meta
+
+    def flush(self):
+        if self.handle:
+            self.handle.flush()
+            self.index_handle.flush()
+
+    # sync is called when the app goes idle so a burst of appends costs one fsync.
+    def sync(self):
+        if self.handle and self.dirty:
+            self.flush()
+            os.fsync(self.handle.fileno())
+            os.fsync(self.index_handle.fileno())
+            self.dirty = False
+            write_session_meta(self.path, self.stats())
+
+    def close(self):
+        if self.handle:
+            self.sync()
+            self.handle.close()
+            self.index_handle.close()
+            self.handle = self.index_handle = None
+
+    def read(self, position):
+        records = self.read_range(position, position + 1)
+        if not records:
+            raise IndexError(position)
+        return records[0]
+
+    # read_range seeks straight to the first wanted record and parses only [start, stop).
+    def read_range(self, start, stop):
+        self.check_index()
+        start = max(0, start)
+        stop = min(stop, self.count)
+        if start >= stop:
+            return []
+        self.flush()
+        begin = self.offset_at(start)
+        end = self.offset_at(stop) if stop < self.count else self.size
+        with open(self.path, "rb") as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return [json.loads(line) for line in data.splitlines()]
+
+    def tail(self, count):
+        total = len(self)
+        return self.read_range(total - count, total)
+
+    def __iter__(self):
+        self.check_index()
+        self.flush()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield json.loads(line)
+
+def empty_meta():
+    return {"count": 0, "size": 0, "mtime": 0, "first_ts": None, "last_ts": None,
+            "last_sender": None, "last_text": ""}
+
+def update_meta(meta, record):
+    if meta["first_ts"] is None:
+        meta["first_ts"] = record.get("ts")
+    meta["last_ts"] = record.get("ts")
+    meta["last_sender"] = record.get("sender")
+    meta["last_text"] = " ".join(record.get("text", "")[:PREVIEW_CHARS * 2].split())[:PREVIEW_CHARS]
+
+# read_session_meta: Returns the sidecar metadata, recomputing it through the index when the
+# session file's mtime or size no longer matches; never reads the whole transcript.
+def read_session_meta(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    try:
+        with open(os.path.splitext(path)[0] + META_EXT, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("mtime") == stat.st_mtime_ns and meta.get("size") == stat.st_size:
+            return meta
+    except (OSError, ValueError):
+        pass
+    meta = SessionStore(path).compute_meta()
+    write_session_meta(path, meta)
+    return meta
+
+def write_session_meta(path, meta):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    meta["mtime"] = stat.st_mtime_ns
+    meta["size"] = stat.st_size
+    meta_path = os.path.splitext(path)[0] + META_EXT
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(meta_path + ".tmp", meta_path)
+
+# parse_legacy_session: Yields (sender, time, text) from the old "[sender]\nmessage" .txt format.
+def parse_legacy_session(path):
+    sender = clock = None
+    lines = []
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.rstrip("\n")
+            match = LEGACY_HEADER.match(line)
+            if match:
+                if sender is not None:
+                    yield sender, clock, "\n".join(lines)
+                sender, clock = match.group(1), match.group(2)
+                lines = []
+            elif sender is not None:
+                lines.append(line)
+    if sender is not None:
+        yield sender, clock, "\n".join(lines)
+
+# legacy_records: Yields (sender, text, ts) from an old .txt session. The file only has clock
+# times, so the day comes from its chat_%Y%m%d_%H%M%S name, or else from its mtime.
+def legacy_records(path):
+    try:
+        day = datetime.strptime(os.path.basename(path), "chat_%Y%m%d_%H%M%S.txt")
+    except ValueError:
+        day = datetime.fromtimestamp(os.path.getmtime(path))
+    for sender, clock, text in parse_legacy_session(path):
+        stamp = day
+        if clock:
+            hour, minute = map(int, clock.split(":"))
+            stamp = day.replace(hour=hour, minute=minute, second=0)
+        yield sender, text, stamp.isoformat(timespec="seconds")
+
+# migrate_legacy_sessions: One-time conversion of chat_*.txt files; originals are kept as *.txt.migrated.
+def migrate_legacy_sessions(chat_dir):
+    migrated = []
+    for name in sorted(os.listdir(chat_dir)):
+        if not name.endswith(LEGACY_EXT):
+            continue
+        path = os.path.join(chat_dir, name)
+        target = os.path.splitext(path)[0] + SESSION_EXT
+        if os.path.exists(target):
+            continue
+        store = SessionStore(target)
+        for sender, text, ts in legacy_records(path):
+            store.append(sender, text, ts=ts)
+        store.close()
+        os.replace(path, path + ".migrated")
+        migrated.append(target)
+    return migrated
+
+# make_model: Builds a configured Gemini model; ModelCache takes any factory with this signature.
+def make_model(api_key, model_name):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+# warm_up: Imports the Gemini SDK on a background thread, so the first send finds it loaded.
+def warm_up():
+    thread = threading.Thread(target=import_sdk, name="aui-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def import_sdk():
+    try:
+        import google.generativeai  # noqa: F401
+    except ImportError:
+        # make_model reports the missing package when a request is actually sent.
+        pass
+
+# ping_model: The cheapest call that goes through a model's client: counting the tokens of one
+# word opens the client's channel (DNS, TCP and TLS, then HTTP/2) and leaves it open for the
+# next request. Models without count_tokens have nothing to open.
+def ping_model(model, timeout=WARM_PING_TIMEOUT):
+    count_tokens = getattr(model, "count_tokens", None)
+    if count_tokens is not None:
+        count_tokens("ping", request_options={"timeout": timeout})
+
+# close_model: Closes the channel a model's client holds. GenerativeModel builds its client on
+# first use; the client itself stays cached inside the SDK, which is why make_model calls
+# genai.configure again, and so starts from fresh clients, for every model built afterwards.
+def close_model(model):
+    transport = getattr(getattr(model, "_client", None), "transport", None)
+    if transport is not None:
+        transport.close()
+
+# ModelCache: Keeps configured models per (api_key, model_name) so a send skips client setup.
+# genai.configure is process-wide, so switching keys drops the models built for the old key.
+# warm() builds a model and opens its connection ahead of a send; close() closes them again.
+class ModelCache:
+    def __init__(self, factory=make_model, ping=ping_model, closer=close_model):
+        self.factory = factory
+        self.ping = ping
+        self.closer = closer
+        self.lock = threading.Lock()
+        self.models = {}
+        # Keys whose model has made at least one call, so its connection is open.
+        self.connected = set()
+
+    def get(self, api_key, model_name):
+        key = (api_key, model_name)
+        with self.lock:
+            model = self.models.get(key)
+            if model is None:
+                if any(cached_key != api_key for cached_key, _ in self.models):
+                    self.models.clear()
+                    self.connected.clear()
+                model = self.factory(api_key, model_name)
+                self.models[key] = model
+            return model
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+            self.connected.clear()
+
+    def is_warm(self, api_key, model_name):
+        with self.lock:
+            return (api_key, model_name) in self.connected
+
+    def mark_connected(self, api_key, model_name):
+        with self.lock:
+            if (api_key, model_name) in self.models:
+                self.connected.add((api_key, model_name))
+
+    # warm returns the seconds spent building the model and opening its connection, or None if
+    # it was already open. It is speculative, so a failure is left for the real send to report.
+    def warm(self, api_key, model_name):
+        if self.is_warm(api_key, model_name):
+            return None
+        start = time.perf_counter()
+        try:
+            model = self.get(api_key, model_name)
+            self.ping(model)
+        except Exception:
+            return None
+        self.mark_connected(api_key, model_name)
+        return time.perf_counter() - start
+
+    # close drops every model and closes its connection; the next get() builds a new one.
+    def close(self):
+        with self.lock:
+            models = list(self.models.values())
+            self.models.clear()
+            self.connected.clear()
+        for model in models:
+            try:
+                self.closer(model)
+            except Exception:
+                pass
+
+# estimate_tokens: Cheap local token estimate (about four characters per token), cached on the record.
+def estimate_tokens(record):
+    tokens = record.get("tokens")
+    if tokens is None:
+        tokens = record["tokens"] = len(record.get("text", "")) // 4 + 1
+    return tokens
+
+def read_summary(path):
+    try:
+        with open(os.path.splitext(path)[0] + SUMMARY_EXT, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"upto": 0, "text": ""}
+
+def write_summary(path, summary):
+    summary_path = os.path.splitext(path)[0] + SUMMARY_EXT
+    with open(summary_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False)
+    os.replace(summary_path + ".tmp", summary_path)
+
+# summarize_turns: Folds turns into the previous summary with one call to generate(prompt),
+# which the executor runs through its rate limits, deadline and retries. Falls back to a clipped
+# local digest if the call fails so context building never blocks a request; a stopped or timed
+# out request still stops.
+def summarize_turns(generate, previous, records):
+    transcript = "\n".join(f"{record['sender']}: {record['text']}" for record in records)
+    prompt = (
+        "Update the running summary of a conversation. Keep names, facts, decisions and open "
+        "questions; stay under 200 words.\n\n"
+        f"Current summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}\n\nUpdated summary:"
+    )
+    try:
+        return generate(prompt)
+    except RequestCancelled:
+        raise
+    except Exception:
+        digest = [previous] if previous else []
+        digest += [f"{record['sender']}: {' '.join(record['text'].split())[:200]}" for record in records]
+        return "\n".join(digest)[-SUMMARY_FALLBACK_CHARS:]
+
+# KeyedLocks: One lock per key (a session file, an upload), kept only while a thread holds or is
+# waiting for it, so the map does not grow with every key ever used.
+class KeyedLocks:
+    def __init__(self):
+        self.guard = threading.Lock()
+        # key -> [lock, threads holding or waiting for it]
+        self.entries = {}
+
+    @contextmanager
+    def hold(self, key):
+        with self.guard:
+            entry = self.entries.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.entries[key]
+
+# ContextBuilder: Fits a session's earlier turns into a token budget for a multi-turn request.
+# Turns that no longer fit are folded into a rolling summary stored next to the session; the
+# summary only ever absorbs newly evicted turns, and evicting down to 3/4 of the budget leaves
+# room for several more turns before the next fold.
+class ContextBuilder:
+    PAGE = 64
+    locks = KeyedLocks()
+
+    def __init__(self, session_file, budget, summarizer=summarize_turns):
+        self.session_file = session_file
+        self.budget = budget
+        self.summarizer = summarizer
+
+    def enabled(self, history_end):
+        return self.budget > 0 and history_end > 0 and bool(self.session_file)
+
+    # plan reads what the context is made of without calling the model: the stored summary, the
+    # turns that fit, and the turns that must be folded into the summary first. The executor
+    # keys its response cache on this, so a cache hit never pays for a summary.
+    def plan(self, prompt, history_end):
+        if not self.enabled(history_end):
+            return {"upto": 0, "text": ""}, [], []
+        with self.locks.hold(self.session_file):
+            return self.read_plan(prompt, history_end)
+
+    def read_plan(self, prompt, history_end):
+        store = SessionStore(self.session_file)
+        summary = read_summary(self.session_file)
+        available = self.budget - len(prompt) // 4 - len(summary["text"]) // 4
+        kept, keep_from = self.recent(store, summary["upto"], history_end, available)
+        if keep_from <= summary["upto"]:
+            return summary, kept, []
+        target = int(self.budget * 0.75) - len(prompt) // 4
+        kept, keep_from = self.recent(store, summary["upto"], history_end, target)
+        return summary, kept, store.read_range(summary["upto"], keep_from)
+
+    # build returns Gemini chat history for the records before history_end, folding evicted
+    # turns into the summary with generate(prompt) first.
+    def build(self, generate, prompt, history_end):
+        if not self.enabled(history_end):
+            return []
+        with self.locks.hold(self.session_file):
+            summary, kept, folded = self.read_plan(prompt, history_end)
+            if folded:
+                summary = {"upto": summary["upto"] + len(folded),
+                           "text": self.summarizer(generate, summary["text"], folded)}
+                write_summary(self.session_file, summary)
+        return self.to_history(summary["text"], kept)
+
+    # recent walks back from history_end a page at a time until the budget is spent.
+    def recent(self, store, floor, history_end, budget):
+        kept = []
+        used = 0
+        stop = history_end
+        while stop > floor:
+            start = max(floor, stop - self.PAGE)
+            for record in reversed(store.read_range(start, stop)):
+                used += estimate_tokens(record)
+                if used > budget:
+                    kept.reverse()
+                    return kept, history_end - len(kept)
+                kept.append(record)
+            stop = start
+        kept.reverse()
+        return kept, history_end - len(kept)
+
+    # to_history turns records into alternating Gemini turns that open with a user turn (where
+    # the summary goes) and end with a model turn, since the new prompt is sent after them.
+    # A prompt that never got its reply (it failed or was stopped) is left out: it would be a
+    # second user turn next to the following prompt, and Ask Again would send it twice.
+    def to_history(self, summary, records):
+        roles = [record.get("role") or ROLES.get(record["sender"], "user") for record in records]
+        history = []
+        for position, (record, role) in enumerate(zip(records, roles)):
+            if role == "user" and (position + 1 == len(roles) or roles[position + 1] != "model"):
+                continue
+            if history and history[-1]["role"] == role:
+                history[-1]["parts"][0] += "\n\n" + record["text"]
+            else:
+                history.append({"role": role, "parts": [record["text"]]})
+            # Attachment records stay as they are; the executor swaps in their uploads on send.
+            history[-1]["parts"].extend(record.get("attachments", ()))
+        if summary:
+            note = f"(Summary of our earlier conversation: {summary})"
+            if history and history[0]["role"] == "user":
+                history[0]["parts"][0] = note + "\n\n" + history[0]["parts"][0]
+            else:
+                history.insert(0, {"role": "user", "parts": [note]})
+            if len(history) == 1:
+                history.append({"role": "model", "parts": ["Understood."]})
+        elif history and history[0]["role"] == "model":
+            history.insert(0, {"role": "user", "parts": ["(continuing our conversation)"]})
+        return history
+
+# cache_key: Hashes everything that determines a reply: model, generation parameters, the
+# whitespace-normalised prompt and the context sent with it.
+def cache_key(model_name, history, prompt, params=None):
+    payload = json.dumps(
+        [model_name, params or {}, history, " ".join(prompt.split())],
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# ResponseCache: On-disk reply cache with per-entry TTL and LRU eviction by total size.
+# Shared by the executor's worker threads, so every call holds the lock.
+class ResponseCache:
+    def __init__(self, path, max_bytes=RESPONSE_CACHE_MB * 1024 * 1024, ttl=RESPONSE_CACHE_TTL_HOURS * 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.commit()
+
+    def count(self, name):
+        self.conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,)
+        )
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row:
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.count("hits" if row else "misses")
+            self.conn.commit()
+            return row[0] if row else None
+
+    def put(self, key, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self.evict(now)
+            self.conn.commit()
+
+    def evict(self, now):
+        self.conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            doomed.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.conn.execute("SELECT name, value FROM counters"))
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": counters.get("hits", 0), "misses": counters.get("misses", 0),
+                "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.execute("DELETE FROM counters")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# hash_file: SHA-256 of a file read through one fixed-size buffer, so memory use does not depend
+# on the file's size. Every chunk is also written to out when given. Returns the hex digest and
+# the first chunk, which is enough to tell text from binary.
+def hash_file(path, out=None, chunk_size=BLOB_CHUNK):
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    head = None
+    with open(path, "rb") as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            if head is None:
+                head = bytes(view[:read])
+            digest.update(view[:read])
+            if out is not None:
+                out.write(view[:read])
+    return digest.hexdigest(), head or b""
+
+# guess_mime: By extension; files it does not know (logs, dumps) count as text unless they hold NULs.
+def guess_mime(name, head):
+    mime = mimetypes.guess_type(name)[0]
+    if mime:
+        return mime
+    return "application/octet-stream" if b"\0" in head else "text/plain"
+
+# upload_file: Sends one file through the SDK's Files API and waits until Gemini has processed it.
+# The SDK uploads resumably, reading the file from disk a chunk at a time. The wait polls through
+# the request's token, so stopping or timing out the request ends it, and gives up with a
+# (retried) TimeoutError after UPLOAD_PROCESSING_TIMEOUT. BlobStore takes any uploader with this
+# signature.
+def upload_file(api_key, path, mime_type, display_name, token=None):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    remote = genai.upload_file(path, mime_type=mime_type, display_name=display_name)
+    deadline = time.monotonic() + UPLOAD_PROCESSING_TIMEOUT
+    while remote.state.name == "PROCESSING":
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Gemini was still processing {display_name} after {UPLOAD_PROCESSING_TIMEOUT} s")
+        if token is None:
+            time.sleep(UPLOAD_POLL_SECONDS)
+        else:
+            token.wait(UPLOAD_POLL_SECONDS)
+        remote = genai.get_file(remote.name)
+    if remote.state.name == "FAILED":
+        raise RuntimeError(f"Gemini could not process {display_name}")
+    return {"name": remote.name, "uri": remote.uri, "mime": remote.mime_type or mime_type,
+            "expires": time.time() + UPLOAD_TTL_HOURS * 3600}
+
+# BlobStore: Content-addressed attachment store. add() keeps one copy per distinct content, and
+# session records reference it by hash. remote() remembers each upload per API key and hash
+# until it expires, so a file attached in many sessions is uploaded and stored once.
+class BlobStore:
+    locks = KeyedLocks()
+
+    def __init__(self, root, uploader=upload_file):
+        self.root = root
+        self.uploader = uploader
+        self.uploads_path = os.path.join(root, UPLOADS_FILE)
+        self.uploads = None
+        self.lock = threading.Lock()
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    # add returns the attachment record for a file. A file already in the store costs one
+    # read to hash it; a new one is copied in and named by the hash of what was copied.
+    def add(self, path):
+        digest, head = hash_file(path)
+        if not os.path.exists(self.path(digest)):
+            os.makedirs(self.root, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=self.root, prefix=".blob-")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    digest, head = hash_file(path, out)
+                os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+                os.replace(temp, self.path(digest))
+            except BaseException:
+                os.remove(temp)
+                raise
+        return {"sha256": digest, "name": os.path.basename(path),
+                "size": os.path.getsize(self.path(digest)), "mime": guess_mime(path, head)}
+
+    def load(self):
+        with self.lock:
+            if self.uploads is None:
+                try:
+                    with open(self.uploads_path, "r", encoding="utf-8") as f:
+                        self.uploads = json.load(f)
+                except (OSError, ValueError):
+                    self.uploads = {}
+            return self.uploads
+
+    # remote returns the part that refers to an attachment's upload. Requests attaching the same
+    # file at the same time wait for one upload instead of starting their own. token is the
+    # request's CancelToken, handed to the uploader.
+    def remote(self, api_key, attachment, token=None):
+        digest = attachment["sha256"]
+        key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] + ":" + digest
+        with self.locks.hold(key):
+            uploaded = self.load().get(key)
+            if uploaded is None or uploaded["expires"] <= time.time():
+                if not os.path.exists(self.path(digest)):
+                    raise FileNotFoundError(f"Attachment {attachment['name']} is no longer in {self.root}")
+                uploaded = self.uploader(api_key, self.path(digest), attachment["mime"], attachment["name"], token)
+                with self.lock:
+                    self.uploads[key] = uploaded
+                    write_atomic(self.uploads_path, json.dumps(self.uploads))
+        return {"file_data": {"mime_type": uploaded["mime"], "file_uri": uploaded["uri"]}}
+
+    def stats(self):
+        count = size = 0
+        if os.path.isdir(self.root):
+            for folder in os.scandir(self.root):
+                if folder.is_dir():
+                    for entry in os.scandir(folder.path):
+                        count += 1
+                        size += entry.stat().st_size
+        return {"blobs": count, "bytes": size}
+
+# pick_codec: "auto" means zstd when the optional zstandard package is installed, else gzip.
+def pick_codec(preferred="auto"):
+    if preferred in ("auto", "zstd") and zstandard is not None:
+        return "zstd"
+    return "gzip"
+
+def compressor(codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(9, zlib.DEFLATED, 31)
+
+def decompressor(codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This session was archived with zstd; install the zstandard package to open it")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+# SessionArchive: Bundles of compressed sessions plus a SQLite catalog. Each session is one
+# member (a gzip member or a zstd frame) appended to the current bundle, and the catalog keeps
+# its bundle, offset, length, metadata and summary, so one session is read back without
+# touching the rest of its bundle and History can list archived sessions without opening any.
+# Names the GUI has open are pinned and never archived. Shared by the GUI, the search thread
+# and the maintenance thread, so every catalog access holds the lock.
+class SessionArchive:
+    def __init__(self, chat_dir, codec="auto"):
+        self.chat_dir = chat_dir
+        self.root = os.path.join(chat_dir, ARCHIVE_DIR)
+        self.codec = pick_codec(codec)
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pinned = set()
+        self.names_cache = None
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            self.conn = sqlite3.connect(os.path.join(self.root, ARCHIVE_CATALOG), check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (name TEXT PRIMARY KEY, bundle TEXT NOT NULL, "
+                "offset INTEGER NOT NULL, length INTEGER NOT NULL, codec TEXT NOT NULL, "
+                "records INTEGER NOT NULL, mtime INTEGER NOT NULL, meta TEXT NOT NULL, summary TEXT)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_bundle ON sessions (bundle)")
+            self.conn.commit()
+        return self.conn
+
+    # exists is False until the first session is archived; nothing is created before that.
+    def exists(self):
+        return self.conn is not None or os.path.exists(os.path.join(self.root, ARCHIVE_CATALOG))
+
+    def names(self):
+        if not self.exists():
+            return []
+        with self.lock:
+            if self.names_cache is None:
+                self.names_cache = [name for (name,) in self.connect().execute("SELECT name FROM sessions")]
+            return self.names_cache
+
+    def contains(self, name):
+        return name in self.names()
+
+    def entry(self, name):
+        with self.lock:
+            return self.connect().execute(
+                "SELECT bundle, offset, length, codec, records, mtime, meta, summary FROM sessions WHERE name = ?",
+                (name,),
+            ).fetchone()
+
+    def meta(self, name):
+        entry = self.entry(name) if self.contains(name) else None
+        return json.loads(entry[6]) if entry else None
+
+    def records_count(self, name):
+        entry = self.entry(name) if self.contains(name) else None
+        return entry[4] if entry else 0
+
+    def pin(self, name):
+        with self.lock:
+            self.pinned.add(name)
+
+    def unpin(self, name):
+        with self.lock:
+            self.pinned.discard(name)
+
+    def current_bundle(self):
+        bundles = sorted(name for name in os.listdir(self.root) if name.endswith(BUNDLE_EXT))
+        if bundles and os.path.getsize(os.path.join(self.root, bundles[-1])) < ARCHIVE_BUNDLE_MB * 1024 * 1024:
+            return bundles[-1]
+        return self.new_bundle(bundles)
+
+    def new_bundle(self, bundles=None):
+        if bundles is None:
+            bundles = sorted(name for name in os.listdir(self.root) if name.endswith(BUNDLE_EXT))
+        number = int(bundles[-1][len("bundle-"):-len(BUNDLE_EXT)]) + 1 if bundles else 1
+        return f"bundle-{number:06d}{BUNDLE_EXT}"
+
+    # archive moves session files into the current bundle and returns how many it moved. Each
+    # member is compressed a chunk at a time, the bundle is synced once per call before the
+    # catalog points at the new members, and a session is only deleted if nobody opened or
+    # wrote to it meanwhile; otherwise its member is dead space for compact().
+    def archive(self, paths):
+        self.connect()
+        bundle = self.current_bundle()
+        members = []
+        with open(os.path.join(self.root, bundle), "ab") as out:
+            for path in paths:
+                name = os.path.basename(path)
+                if name in self.pinned:
+                    continue
+                stat = os.stat(path)
+                meta = read_session_meta(path) or empty_meta()
+                summary = read_summary(path)
+                compress = compressor(self.codec)
+                offset = out.tell()
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(ARCHIVE_CHUNK), b""):
+                        out.write(compress.compress(chunk))
+                out.write(compress.flush())
+                members.append((path, stat, (
+                    name, bundle, offset, out.tell() - offset, self.codec, meta["count"], stat.st_mtime_ns,
+                    json.dumps(meta, ensure_ascii=False), json.dumps(summary) if summary["text"] else None,
+                )))
+            out.flush()
+            os.fsync(out.fileno())
+        with self.lock:
+            rows = []
+            for path, stat, row in members:
+                after = os.stat(path)
+                if row[0] not in self.pinned and (after.st_mtime_ns, after.st_size) == (stat.st_mtime_ns, stat.st_size):
+                    rows.append((path, row))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sessions (name, bundle, offset, length, codec, records, mtime, meta, summary) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [row for _, row in rows],
+            )
+            self.conn.commit()
+            for path, _ in rows:
+                delete_session_files(path)
+            self.names_cache = None
+        return len(rows)
+
+    # lines streams an archived session's JSONL lines, decompressing its member a chunk at a time.
+    # The bundle is opened under the lock, so compact() cannot move the member away first.
+    def lines(self, name):
+        with self.lock:
+            entry = self.entry(name)
+            if entry is None:
+                raise KeyError(name)
+            f = open(os.path.join(self.root, entry[0]), "rb")
+        bundle, offset, length = entry[:3]
+        decompress = decompressor(entry[3])
+        pending = b""
+        with f:
+            f.seek(offset)
+            while length:
+                chunk = f.read(min(ARCHIVE_CHUNK, length))
+                if not chunk:
+                    raise ValueError(f"{bundle} ends inside {name}")
+                length -= len(chunk)
+                pending += decompress.decompress(chunk)
+                end = pending.rfind(b"\n") + 1
+                if end:
+                    yield from pending[:end].splitlines(keepends=True)
+                    pending = pending[end:]
+
+    def records(self, name):
+        for line in self.lines(name):
+            yield json.loads(line)
+
+    # restore writes an archived session back as a normal session file with its old mtime, so it
+    # is archived again once the GUI stops pinning it, and drops it from the catalog.
+    # restore copies the member out without holding the lock, so names() and contains() stay
+    # quick while a large session decompresses; run it on the same thread as maintain(), whose
+    # compaction is what rewrites bundles.
+    def restore(self, name):
+        path = os.path.join(self.chat_dir, name)
+        entry = self.entry(name)
+        if entry is None:
+            raise KeyError(name)
+        with open(path + ".restoring", "wb") as out:
+            for line in self.lines(name):
+                out.write(line)
+        with self.lock:
+            os.replace(path + ".restoring", path)
+            os.utime(path, ns=(entry[5], entry[5]))
+            write_session_meta(path, json.loads(entry[6]))
+            if entry[7]:
+                write_summary(path, json.loads(entry[7]))
+            self.remove(name)
+        return path
+
+    def remove(self, name):
+        with self.lock:
+            self.connect().execute("DELETE FROM sessions WHERE name = ?", (name,))
+            self.conn.commit()
+            self.names_cache = None
+
+    # compact rewrites bundles that are mostly dead space (restored, deleted or abandoned
+    # members), copying the live members byte for byte into a new bundle.
+    def compact(self):
+        rewritten = 0
+        with self.lock:
+            if not self.exists():
+                return 0
+            conn = self.connect()
+            live = dict(conn.execute("SELECT bundle, SUM(length) FROM sessions GROUP BY bundle"))
+            for bundle in sorted(name for name in os.listdir(self.root) if name.endswith(BUNDLE_EXT)):
+                path = os.path.join(self.root, bundle)
+                if live.get(bundle, 0) >= os.path.getsize(path) * ARCHIVE_COMPACT_RATIO:
+                    continue
+                rows = conn.execute(
+                    "SELECT name, offset, length FROM sessions WHERE bundle = ? ORDER BY offset", (bundle,)
+                ).fetchall()
+                if rows:
+                    target = self.new_bundle()
+                    moved = []
+                    with open(path, "rb") as f, open(os.path.join(self.root, target), "wb") as out:
+                        for name, offset, length in rows:
+                            moved.append((target, out.tell(), name))
+                            f.seek(offset)
+                            while length:
+                                chunk = f.read(min(ARCHIVE_CHUNK, length))
+                                out.write(chunk)
+                                length -= len(chunk)
+                        out.flush()
+                        os.fsync(out.fileno())
+                    conn.executemany("UPDATE sessions SET bundle = ?, offset = ? WHERE name = ?", moved)
+                    conn.commit()
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still open for reading (Windows); it has no live members now, so the
+                    # next run removes it.
+                    continue
+                rewritten += 1
+        return rewritten
+
+    # maintain is the background job: archive every unpinned session whose file has not changed
+    # for days, then compact. The live directory only keeps recent sessions, so listing it and
+    # catching up the search index stay cheap however old the history gets.
+    def maintain(self, days=ARCHIVE_AFTER_DAYS):
+        cutoff = time.time() - days * 86400
+        idle = []
+        for name in session_files(self.chat_dir):
+            path = os.path.join(self.chat_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_mtime < cutoff and name not in self.pinned:
+                idle.append((path, stat.st_size))
+        archived = size = 0
+        for start in range(0, len(idle), ARCHIVE_BATCH):
+            batch = idle[start:start + ARCHIVE_BATCH]
+            archived += self.archive([path for path, _ in batch])
+            size += sum(length for path, length in batch if not os.path.exists(path))
+        compacted = self.compact()
+        if archived or compacted:
+            with self.lock:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"archived": archived, "archived_bytes": size, "compacted": compacted}
+
+    def stats(self):
+        if not self.exists():
+            return {"sessions": 0, "bundles": 0, "bytes": 0, "original_bytes": 0}
+        with self.lock:
+            sessions, original = self.connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(json_extract(meta, '$.size')), 0) FROM sessions"
+            ).fetchone()
+        bundles = [entry for entry in os.scandir(self.root) if entry.name.endswith(BUNDLE_EXT)]
+        return {"sessions": sessions, "bundles": len(bundles),
+                "bytes": sum(entry.stat().st_size for entry in bundles), "original_bytes": original}
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+# session_records: Streams a session's records from its file, or out of its archive bundle once
+# it has been archived.
+def session_records(chat_dir, name):
+    path = os.path.join(chat_dir, name)
+    if os.path.exists(path):
+        yield from SessionStore(path)
+        return
+    archive = SessionArchive(chat_dir)
+    try:
+        if not archive.contains(name):
+            raise FileNotFoundError(f"No session named {name} in {chat_dir}")
+        yield from archive.records(name)
+    finally:
+        archive.close()
+
+def all_sessions(chat_dir):
+    archive = SessionArchive(chat_dir)
+    names = session_files(chat_dir) + archive.names()
+    archive.close()
+    return names
+
+def message_heading(record):
+    ts = record.get("ts")
+    return f"{record.get('sender', '')} · {ts.replace('T', ' ')}" if ts else record.get("sender", "")
+
+def attachment_names(record):
+    return ", ".join(attachment.get("name", "?") for attachment in record.get("attachments", ()))
+
+# Exporters take a title and an iterable of records and yield the file piece by piece.
+def export_jsonl(title, records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+def export_markdown(title, records):
+    yield f"# {title}\n"
+    for record in records:
+        yield f"\n## {message_heading(record)}\n\n{record.get('text', '')}\n"
+        names = attachment_names(record)
+        if names:
+            yield f"\n*Attached: {names}*\n"
+
+HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ background: #282828; color: #ebdbb2; font-family: sans-serif; max-width: 50em; margin: 2em auto; }}
+.message {{ border-radius: 12px; padding: 0.6em 1em; margin: 0.8em 0; white-space: pre-wrap; }}
+.you {{ background: #458588; margin-left: 15%; }}
+.gemini {{ background: #3c3836; margin-right: 15%; }}
+.heading {{ font-size: 0.8em; opacity: 0.7; margin-bottom: 0.3em; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+
+def export_html(title, records):
+    yield HTML_HEAD.format(title=html.escape(title))
+    for record in records:
+        names = attachment_names(record)
+        attached = f"\n<em>Attached: {html.escape(names)}</em>" if names else ""
+        yield (
+            f'<div class="message {html.escape(record.get("sender", "").lower())}">'
+            f'<div class="heading">{html.escape(message_heading(record))}</div>'
+            f'{html.escape(record.get("text", ""))}{attached}</div>\n'
+        )
+    yield "</body>\n</html>\n"
+
+EXPORTERS = {"jsonl": export_jsonl, "markdown": export_markdown, "html": export_html}
+
+# export_session: Writes one session to out_dir through a temp file, a record at a time, so
+# memory stays flat however long the session is. Runs in a worker process.
+def export_session(chat_dir, name, out_dir, fmt):
+    title = os.path.splitext(name)[0]
+    target = os.path.join(out_dir, title + EXPORT_FORMATS[fmt])
+    fd, temp = tempfile.mkstemp(dir=out_dir, prefix=f".{title}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as out:
+            out.writelines(EXPORTERS[fmt](title, session_records(chat_dir, name)))
+        os.replace(temp, target)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return {"session": name, "path": target, "bytes": os.path.getsize(target)}
+
+# import_records: Yields (sender, text, extra) from a JSONL export or an old .txt session;
+# extra holds the record's other fields (ts, id, cached, attachments ...).
+def import_records(path):
+    if path.lower().endswith(LEGACY_EXT):
+        for sender, text, ts in legacy_records(path):
+            yield sender, text, {"ts": ts}
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"line {number}: not a JSON line ({e})") from None
+            if not isinstance(record, dict) or not isinstance(record.get("sender"), str) \
+                    or not isinstance(record.get("text"), str):
+                raise ValueError(f'line {number}: a record needs a "sender" and a "text"')
+            yield record.pop("sender"), record.pop("text"), record
+
+# claim_session_name: Creates an empty session file named after stem, adding -2, -3 ... while
+# the name is taken by a live or archived session. O_EXCL makes the claim safe across workers.
+def claim_session_name(chat_dir, stem):
+    archive = SessionArchive(chat_dir)
+    try:
+        for n in itertools.count(1):
+            name = f"{stem}{SESSION_EXT}" if n == 1 else f"{stem}-{n}{SESSION_EXT}"
+            if archive.exists() and archive.entry(name) is not None:
+                continue
+            path = os.path.join(chat_dir, name)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                continue
+            return path
+    finally:
+        archive.close()
+
+# import_session: Adds one file to chat_dir as a new session and returns a summary. Attachments
+# whose content is not in this chat_dir's blob store are dropped, since they could never be sent.
+# A file that fails half-way leaves nothing behind. Runs in a worker process.
+def import_session(path, chat_dir):
+    blobs = BlobStore(os.path.join(chat_dir, BLOB_DIR))
+    target = claim_session_name(chat_dir, os.path.splitext(os.path.basename(path))[0])
+    store = SessionStore(target)
+    try:
+        for sender, text, extra in import_records(path):
+            # Like any appended record, role follows sender and tokens are estimated locally.
+            extra.pop("role", None)
+            extra.pop("tokens", None)
+            if "attachments" in extra:
+                attachments = extra["attachments"] if isinstance(extra["attachments"], list) else []
+                extra["attachments"] = [
+                    attachment for attachment in attachments
+                    if isinstance(attachment, dict) and os.path.exists(blobs.path(str(attachment.get("sha256"))))
+                ]
+                if not extra["attachments"]:
+                    del extra["attachments"]
+            store.append(sender, text, **extra)
+        store.close()
+    except BaseException:
+        store.close()
+        delete_session_files(target)
+        raise
+    return {"source": path, "session": os.path.basename(target), "records": len(store)}
+
+# run_transfers: Runs fn(*job) for each job on a process pool and yields (job, result, error)
+# as they finish. Jobs are taken from the iterable lazily, TRANSFER_QUEUE per worker ahead, and
+# once token is cancelled no new ones start. Workers are spawned rather than forked, so they do
+# not inherit the GUI's threads mid-flight.
+def run_transfers(fn, jobs, workers=0, token=None):
+    workers = workers or os.cpu_count() or 1
+    jobs = iter(jobs)
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    running = {}
+    try:
+        while True:
+            while len(running) < workers * TRANSFER_QUEUE and (token is None or not token.cancelled()):
+                job = next(jobs, None)
+                if job is None:
+                    break
+                running[pool.submit(fn, *job)] = job
+            if not running:
+                return
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                error = future.exception()
+                yield job, None if error else future.result(), error
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def export_sessions(chat_dir, names, out_dir, fmt, workers=0, token=None):
+    os.makedirs(out_dir, exist_ok=True)
+    return run_transfers(export_session, ((chat_dir, name, out_dir, fmt) for name in names), workers, token)
+
+def import_sessions(paths, chat_dir, workers=0, token=None):
+    os.makedirs(chat_dir, exist_ok=True)
+    return run_transfers(import_session, ((path, chat_dir) for path in paths), workers, token)
+
+# Metrics: Thread-safe registry of timings (count, sum, min, max and percentiles over the most
+# recent WINDOW samples), counters and gauges. Workers observe, the GUI or batch runner reads
+# snapshot() and export() writes it as a JSON line or in the Prometheus text format.
+class Metrics:
+    WINDOW = 512
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.started = time.time()
+
+    def observe(self, name, value):
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = {
+                    "count": 0, "sum": 0.0, "min": value, "max": value, "recent": deque(maxlen=self.WINDOW)
+                }
+            series["count"] += 1
+            series["sum"] += value
+            series["min"] = min(series["min"], value)
+            series["max"] = max(series["max"], value)
+            series["last"] = value
+            series["recent"].append(value)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            series = {}
+            for name, values in self.series.items():
+                recent = sorted(values["recent"])
+                series[name] = {
+                    "count": values["count"], "sum": values["sum"], "mean": values["sum"] / values["count"],
+                    "min": values["min"], "max": values["max"], "last": values["last"],
+                    "p50": recent[len(recent) // 2], "p95": recent[min(len(recent) - 1, len(recent) * 95 // 100)],
+                }
+            return {
+                "ts": datetime.now().isoformat(timespec="seconds"),
+                "uptime": time.time() - self.started,
+                "series": series,
+                "counters": dict(self.counters),
+                "gauges": {name: value for name, value in self.gauges.items() if value is not None},
+            }
+
+    def export(self, path, fmt="jsonl"):
+        snapshot = self.snapshot()
+        if fmt == "prometheus":
+            # Rewritten whole each time, like a node_exporter textfile collector expects.
+            write_atomic(path, prometheus_text(snapshot))
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(snapshot) + "\n")
+
+# prometheus_text: Timings become summaries (p50/p95 over the recent window), the rest counters and gauges.
+def prometheus_text(snapshot, prefix="aui_"):
+    lines = []
+    for name, values in sorted(snapshot["series"].items()):
+        metric = prefix + name
+        lines.append(f"# TYPE {metric} summary")
+        lines.append(f'{metric}{{quantile="0.5"}} {values["p50"]:g}')
+        lines.append(f'{metric}{{quantile="0.95"}} {values["p95"]:g}')
+        lines.append(f"{metric}_sum {values['sum']:g}")
+        lines.append(f"{metric}_count {values['count']}")
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {prefix}{name}_total counter")
+        lines.append(f"{prefix}{name}_total {value}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"# TYPE {prefix}{name} gauge")
+        lines.append(f"{prefix}{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# process_rss: Resident set size in bytes. /proc gives the current value on Linux; elsewhere the
+# peak from getrusage is the best available, and Windows reports nothing.
+def process_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class RequestCancelled(Exception):
+    pass
+
+class RequestTimedOut(RequestCancelled):
+    pass
+
+# CancelToken: Shared between the GUI (or batch runner) and the worker running a request.
+# The worker checks it between chunks and waits on it instead of sleeping, so cancel() or the
+# deadline passing stops a request at the next chunk or as soon as a backoff wait is cut short.
+class CancelToken:
+    def __init__(self, timeout=0):
+        self.event = threading.Event()
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+
+    def cancel(self, reason="Stopped"):
+        if self.reason is None:
+            self.reason = reason
+        self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    def remaining(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def check(self):
+        if self.event.is_set():
+            raise RequestCancelled(self.reason)
+        if self.expired():
+            raise RequestTimedOut(f"No complete reply within {self.timeout:g} s")
+
+    # wait sleeps for seconds unless cancelled first, then raises if the request should stop.
+    def wait(self, seconds):
+        remaining = self.remaining()
+        self.event.wait(seconds if remaining is None else min(seconds, remaining))
+        self.check()
+
+# AIRequest: One queued prompt together with the session its reply belongs to.
+class AIRequest:
+    ids = itertools.count(1)
+
+    def __init__(self, prompt, api_key, session_file, stream=True, model_name=MODEL_NAME,
+                 history_end=0, context_budget=0, use_cache=True, timeout=0, attachments=()):
+        self.id = next(AIRequest.ids)
+        self.token = CancelToken(timeout)
+        self.submitted = time.perf_counter()
+        self.prompt = prompt
+        # BlobStore attachment records sent with the prompt.
+        self.attachments = list(attachments)
+        self.api_key = api_key
+        self.session_file = session_file
+        self.stream = stream
+        self.model_name = model_name
+        # Records before history_end are earlier turns that may go into the context.
+        self.history_end = history_end
+        self.context_budget = context_budget
+        # use_cache=False skips the lookup but still refreshes the cached reply.
+        self.use_cache = use_cache
+        self.cached = False
+        self.attempts = 0
+        # Estimated prompt tokens including context; what the tokens-per-minute budget charges.
+        self.tokens = len(prompt) // 4 + 1
+        # Seconds spent waiting for a free worker and for the client-side rate limits.
+        self.queue_wait = 0.0
+        self.error = None
+        self.error_kind = None
+        # Text streamed before a failure; shown with the error, never saved as a reply.
+        self.partial = ""
+        self.ttft = None
+        self.elapsed = None
+
+# Error classification: "rate_limit" and "transient" failures are retried, "fatal" ones
+# (bad key, bad request, blocked prompt, ...) are reported straight away.
+TRANSIENT_STATUS = {408, 500, 502, 503, 504}
+RETRY_HINT = re.compile(r"retry(?:[ _-]?after|[ _-]?delay| in)\D{0,20}?(\d+(?:\.\d+)?)\s*(ms|s)?", re.I)
+
+# error_status: The HTTP-style status of an SDK or transport error, if it has one.
+def error_status(error):
+    for name in ("code", "status_code", "status"):
+        value = getattr(error, name, None)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status
+    match = re.match(r"\s*(\d{3})\b", str(error))
+    return int(match.group(1)) if match else None
+
+# retry_after_hint: Seconds the server asked us to wait, from an attribute, a Retry-After header
+# or the "retry in 12s" / "retry_delay { seconds: 12 }" text the Gemini API puts in its errors.
+def retry_after_hint(error):
+    value = getattr(error, "retry_after", None)
+    if isinstance(value, (int, float)):
+        return float(value)
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    header = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    match = RETRY_HINT.search(str(error))
+    if match:
+        seconds = float(match.group(1))
+        return seconds / 1000 if match.group(2) == "ms" else seconds
+    return None
+
+def classify_error(error):
+    if isinstance(error, RequestCancelled):
+        return ("timeout" if isinstance(error, RequestTimedOut) else "cancelled"), None
+    status = error_status(error)
+    message = str(error).lower()
+    if status == 429 or "resource exhausted" in message or "rate limit" in message:
+        kind = "rate_limit"
+    elif status in TRANSIENT_STATUS or isinstance(error, (ConnectionError, TimeoutError)):
+        kind = "transient"
+    else:
+        kind = "fatal"
+    return kind, retry_after_hint(error)
+
+# backoff_delay: Full-jitter exponential backoff; a server hint is a floor, not a replacement.
+def backoff_delay(attempt, retry_after=None):
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after) if retry_after is not None else delay
+
+# TokenBucket: Refills at per_minute tokens a minute. Bursts are capped at BURST_SECONDS worth
+# so a full bucket plus a minute of refill stays close to the server's per-minute window.
+# reserve() always succeeds and returns how long the caller must wait before using the tokens,
+# so concurrent callers queue up in order instead of polling.
+class TokenBucket:
+    BURST_SECONDS = 10
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * self.BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+# RateLimiter: Client-side requests-per-minute and tokens-per-minute budgets shared by all
+# worker threads (0 disables a budget). pause() holds every request back after a 429, so the
+# other workers do not walk into the same limit while one of them is backing off.
+class RateLimiter:
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.set_limits(requests_per_minute, tokens_per_minute)
+
+    def set_limits(self, requests_per_minute, tokens_per_minute):
+        with self.lock:
+            self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+            self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+    # acquire reserves a slot and waits for it; sleep can be a CancelToken's wait.
+    def acquire(self, tokens=1, sleep=time.sleep):
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# RequestExecutor: Long-lived pool that runs AIRequests with a concurrency limit.
+# Chunks are reported as they arrive through the on_chunk/on_first_token callbacks; every request
+# then ends in exactly one on_done(id, reply) or on_error(id, message), and waits before a retry
+# are announced through on_retry(id, attempt, delay, message). Callbacks run on the worker
+# threads and carry the request id so replies reach the right place.
+# A ModelCache with a fake factory can stand in for the API: its models need start_chat(history)
+# returning an object whose send_message() yields strings (or objects with a .text attribute),
+# or just generate_content() for single-turn use.
+class RequestExecutor:
+    def __init__(self, max_in_flight=2, model_cache=None, on_chunk=None, on_done=None,
+                 on_first_token=None, on_error=None, on_retry=None, retries=DEFAULT_RETRIES,
+                 rate_limiter=None, metrics=None):
+        self.model_cache = model_cache or ModelCache()
+        self.max_in_flight = max_in_flight
+        self.pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="aui-request")
+        self.requests = {}
+        self.response_cache = None
+        self.blob_store = None
+        self.on_chunk = on_chunk or (lambda request_id, text: None)
+        self.on_done = on_done or (lambda request_id, text: None)
+        self.on_first_token = on_first_token or (lambda request_id, ttft: None)
+        self.on_error = on_error or (lambda request_id, message: None)
+        self.on_retry = on_retry or (lambda request_id, attempt, delay, message: None)
+        self.retries = retries
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics
+
+    def set_max_in_flight(self, count):
+        if count == self.max_in_flight:
+            return
+        # Requests already queued on the old pool still finish there.
+        old_pool = self.pool
+        self.max_in_flight = count
+        self.pool = ThreadPoolExecutor(max_workers=count, thread_name_prefix="aui-request")
+        old_pool.shutdown(wait=False)
+
+    def submit(self, request):
+        self.requests[request.id] = request
+        request.submitted = time.perf_counter()
+        self.pool.submit(self.run, request)
+        return request.id
+
+    # cancel stops a queued or running request; it still ends with on_error(id, reason).
+    def cancel(self, request_id, reason="Stopped"):
+        request = self.requests.get(request_id)
+        if request is not None:
+            request.token.cancel(reason)
+        return request is not None
+
+    def cancel_all(self, reason="Stopped"):
+        for request in list(self.requests.values()):
+            request.token.cancel(reason)
+
+    def run(self, request):
+        start = time.perf_counter()
+        request.queue_wait = start - request.submitted
+        parts = []
+        key = None
+        cache = self.response_cache
+        try:
+            request.token.check()
+            model = self.model_cache.get(request.api_key, request.model_name)
+            builder = ContextBuilder(request.session_file, request.context_budget)
+            if cache is not None:
+                # Keyed on the turns the summary will be made from, not on the summary itself.
+                summary, kept, folded = builder.plan(request.prompt, request.history_end)
+                params = {}
+                if request.attachments:
+                    params["files"] = [attachment["sha256"] for attachment in request.attachments]
+                if folded:
+                    params["folded"] = [record.get("id") for record in folded]
+                key = cache_key(request.model_name, builder.to_history(summary["text"], kept), request.prompt,
+                                params or None)
+                cached = cache.get(key) if request.use_cache else None
+                request.cached = cached is not None
+            if request.cached:
+                self.deliver(request, [cached], start, parts)
+            else:
+                history = builder.build(
+                    lambda prompt: self.summarize(model, request, prompt), request.prompt, request.history_end
+                )
+                request.tokens = len(request.prompt) // 4 + 1 + sum(
+                    len(turn["parts"][0]) // 4 + 1 for turn in history
+                )
+                self.send_with_retries(model, request, history, start, parts)
+                self.model_cache.mark_connected(request.api_key, request.model_name)
+        except Exception as e:
+            request.error = str(e) or type(e).__name__
+            request.error_kind = classify_error(e)[0]
+            if request.error_kind != "cancelled" and request.token.expired():
+                # The SDK's own deadline error for the timeout we passed it.
+                request.error_kind = "timeout"
+            request.partial = "".join(parts)
+        request.elapsed = time.perf_counter() - start
+        if self.metrics is not None:
+            self.record(request, parts)
+        if request.error is not None:
+            self.on_error(request.id, request.error)
+            return
+        if key and parts and not request.cached:
+            cache.put(key, "".join(parts))
+        self.on_done(request.id, "".join(parts))
+
+    # record: Latency breakdown of one finished request. Tokens per second covers generation only
+    # (first token to last) and uses the same 4-characters-per-token estimate as the context budget.
+    def record(self, request, parts):
+        metrics = self.metrics
+        outcome = "cached" if request.cached else request.error_kind or "ok"
+        metrics.count(f"requests_{outcome}")
+        metrics.count("request_retries", max(0, request.attempts - 1))
+        metrics.observe("request_queue_seconds", request.queue_wait)
+        metrics.observe("request_total_seconds", time.perf_counter() - request.submitted)
+        if request.ttft is not None and not request.cached:
+            metrics.observe("request_ttft_seconds", request.ttft)
+            generating = request.elapsed - request.ttft
+            if request.error is None and generating > 0:
+                tokens = sum(len(part) for part in parts) // 4 + 1
+                metrics.observe("request_tokens_per_second", tokens / generating)
+
+    # send_with_retries re-sends rate-limited and transient failures with jittered exponential
+    # backoff, but only while nothing has been streamed yet; a reply that failed half-way is
+    # reported rather than duplicated.
+    def send_with_retries(self, model, request, history, start, parts):
+        def attempt():
+            request.attempts += 1
+            response = self.send(model, request, history)
+            self.deliver(request, response if request.stream else [response], start, parts)
+        self.with_retries(request, attempt, request.tokens, parts)
+
+    # summarize is the context summary's model call. It counts against the same rate limits and
+    # deadline as the request it is built for, and is retried the same way.
+    def summarize(self, model, request, prompt):
+        def attempt():
+            request.token.check()
+            remaining = request.token.remaining()
+            timeout = SUMMARY_TIMEOUT if remaining is None else max(1.0, min(remaining, SUMMARY_TIMEOUT))
+            return model.generate_content(prompt, request_options={"timeout": timeout}).text.strip()
+        return self.with_retries(request, attempt, len(prompt) // 4 + 1)
+
+    # with_retries runs attempt() once the rate limiter lets it through and retries it after
+    # rate-limited and transient failures, as long as parts (what it has streamed) is empty.
+    def with_retries(self, request, attempt, tokens, parts=()):
+        attempts = 0
+        while True:
+            attempts += 1
+            request.queue_wait += self.rate_limiter.acquire(tokens, request.token.wait)
+            try:
+                return attempt()
+            except Exception as e:
+                kind, retry_after = classify_error(e)
+                if parts or kind not in ("rate_limit", "transient") or attempts > self.retries:
+                    raise
+                if retry_after is not None and retry_after > RETRY_MAX_WAIT:
+                    raise
+                delay = backoff_delay(attempts - 1, retry_after)
+                remaining = request.token.remaining()
+                if remaining is not None and delay >= remaining:
+                    # The retry could not finish before the deadline anyway.
+                    raise
+                if kind == "rate_limit":
+                    self.rate_limiter.pause(delay)
+                self.on_retry(request.id, attempts, delay, str(e))
+                request.token.wait(delay)
+
+    # deliver stops between chunks once the request is cancelled and closes the stream, so the
+    # worker thread and its connection are released instead of reading the reply to the end.
+    def deliver(self, request, chunks, start, parts):
+        try:
+            for chunk in chunks:
+                request.token.check()
+                try:
+                    text = getattr(chunk, "text", chunk)
+                except ValueError:
+                    # Chunks without text parts (e.g. a bare finish reason) raise on .text
+                    continue
+                if not text:
+                    continue
+                if request.ttft is None:
+                    request.ttft = time.perf_counter() - start
+                    self.on_first_token(request.id, request.ttft)
+                parts.append(text)
+                self.on_chunk(request.id, text)
+        except Exception:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            raise
+
+    # send passes what is left of the deadline to the SDK, which bounds the blocking network call
+    # that the token itself cannot interrupt.
+    def send(self, model, request, history):
+        if request.attachments or any(isinstance(part, dict) for turn in history for part in turn["parts"]):
+            # Newest first, so a file attached more than once is sent with its latest mention.
+            seen = set()
+            prompt = self.resolve(request, request.attachments + [request.prompt], seen)
+            history = [dict(turn, parts=self.resolve(request, turn["parts"], seen)) for turn in reversed(history)]
+            history.reverse()
+        else:
+            prompt = request.prompt
+        remaining = request.token.remaining()
+        options = {"request_options": {"timeout": max(1.0, remaining)}} if remaining is not None else {}
+        if not hasattr(model, "start_chat"):
+            contents = history + [{"role": "user", "parts": prompt if isinstance(prompt, list) else [prompt]}] \
+                if history else prompt
+            return model.generate_content(contents, stream=request.stream, **options)
+        chat = model.start_chat(history=history)
+        return chat.send_message(prompt, stream=request.stream, **options)
+
+    # resolve replaces attachment records with references to their uploads, uploading each
+    # blob the first time it is needed. Files already in seen become a short note, and empty
+    # text parts are dropped, since the API rejects them. Runs inside the retry loop, so a
+    # failed upload is retried.
+    def resolve(self, request, parts, seen):
+        if self.blob_store is None:
+            raise RuntimeError("This request has attachments but no attachment store is set up")
+        resolved = []
+        for part in parts:
+            if part == "":
+                continue
+            if isinstance(part, dict):
+                if part["sha256"] in seen:
+                    part = f"(attached {part['name']} again)"
+                else:
+                    seen.add(part["sha256"])
+                    request.token.check()
+                    part = self.blob_store.remote(request.api_key, part, request.token)
+            resolved.append(part)
+        return resolved
+
+    def pop(self, request_id):
+        return self.requests.pop(request_id, None)
+
+    def shutdown(self, wait=False):
+        self.pool.shutdown(wait=wait, cancel_futures=not wait)
+
+# write_atomic: Writes through a temp file in the same directory and renames it over the target,
+# so readers never see a half-written file.
+def write_atomic(path, text, mode=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# KeyStore: Keeps the API key out of config.json; uses the system keyring when the optional
+# keyring package is installed, otherwise a user-only (0600) file next to the config.
+class KeyStore:
+    SERVICE = "aui"
+    USER = "gemini_api_key"
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self):
+        if keyring is not None:
+            try:
+                return keyring.get_password(self.SERVICE, self.USER) or ""
+            except Exception:
+                pass
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    def set(self, key):
+        if keyring is not None:
+            try:
+                keyring.set_password(self.SERVICE, self.USER, key)
+                return
+            except Exception:
+                pass
+        write_atomic(self.path, key, mode=0o600)
+
+
+def read_config(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# load_api_key: The key the GUI would use: config.json when it still holds one, else the key store.
+def load_api_key(config_path=CONFIG_FILE, key_path=KEY_FILE):
+    return read_config(config_path).get("api_key") or KeyStore(key_path).get()
+
+# read_prompts: Yields prompt dicts from a JSONL file ("-" for stdin). A line may be a bare JSON
+# string; otherwise "prompt" is required and "id", "session" and "model" are optional.
+def read_prompts(path):
+    handle = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: not valid JSON ({e})") from None
+            if isinstance(item, str):
+                item = {"prompt": item}
+            if not isinstance(item, dict) or not isinstance(item.get("prompt"), str):
+                raise ValueError(f"{path}:{number}: expected a string or an object with a \"prompt\"")
+            attachments = item.get("attachments", [])
+            if not isinstance(attachments, list) or not all(isinstance(name, str) for name in attachments):
+                raise ValueError(f"{path}:{number}: \"attachments\" must be a list of file paths")
+            item.setdefault("id", str(number))
+            yield item
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+# BatchRunner: Feeds prompts through a RequestExecutor and writes one JSON line per event to
+# output. Prompts that share a "session" run in order so each one sees the earlier replies as
+# context; different sessions run in parallel up to the executor's limit. With chat_dir set,
+# every session is also recorded as a normal session file that the GUI's History can open.
+class BatchRunner:
+    # Prompts read ahead of the ones being answered, per worker thread.
+    READ_AHEAD = 2
+
+    def __init__(self, executor, api_key, output, chat_dir=None, model_name=MODEL_NAME,
+                 stream=True, context_budget=CONTEXT_TOKEN_BUDGET, timeout=0):
+        self.executor = executor
+        self.api_key = api_key
+        self.output = output
+        self.chat_dir = chat_dir
+        self.model_name = model_name
+        self.stream = stream
+        self.context_budget = context_budget
+        self.timeout = timeout
+        self.prefix = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.queues = {}
+        self.busy = set()
+        self.stores = {}
+        self.active = {}
+        self.pending = 0
+        self.failures = 0
+        self.reading = True
+        self.window = threading.Semaphore(executor.max_in_flight * self.READ_AHEAD)
+        executor.on_chunk = self.handle_chunk
+        executor.on_done = self.handle_done
+        executor.on_error = self.handle_error
+        executor.on_retry = self.handle_retry
+
+    # run reads prompts as it sends them, so only a window of them is held in memory at a time.
+    # A prompt's attachments are copied into the executor's BlobStore when it is read. If reading
+    # fails, the prompts already read are still answered before the error is raised.
+    def run(self, prompts):
+        try:
+            for item in prompts:
+                self.add(item)
+        except Exception:
+            self.end_input()
+            self.wait()
+            raise
+        self.end_input()
+        self.wait()
+        return self.failures
+
+    def end_input(self):
+        with self.lock:
+            self.reading = False
+            if not self.pending:
+                self.finished.set()
+
+    def add(self, item):
+        while not self.window.acquire(timeout=0.5):
+            pass
+        try:
+            if item.get("attachments"):
+                item["attachments"] = [self.executor.blob_store.add(path) for path in item["attachments"]]
+        except BaseException:
+            self.window.release()
+            raise
+        session = re.sub(r"[^\w.-]", "_", str(item.get("session") or f"{self.prefix}_{item['id']}"))
+        with self.lock:
+            self.pending += 1
+            self.queues.setdefault(session, deque()).append(item)
+            idle = session not in self.busy
+            self.busy.add(session)
+        if idle:
+            self.submit_next(session)
+
+    def wait(self):
+        while not self.finished.wait(0.5):
+            pass
+
+    # submit_next sends the session's next prompt; once its queue is empty, the session file is
+    # closed before the session counts as idle, so a later prompt for it opens the file afresh.
+    def submit_next(self, session):
+        with self.lock:
+            queue = self.queues[session]
+            item = queue.popleft() if queue else None
+        if item is None:
+            store = self.stores.pop(session, None)
+            if store is not None:
+                store.close()
+            with self.lock:
+                idle = not self.queues[session]
+                if idle:
+                    del self.queues[session]
+                    self.busy.discard(session)
+            if not idle:
+                self.submit_next(session)
+            return
+        store = self.session_store(session)
+        history_end = 0
+        if store is not None:
+            history_end = len(store)
+            extra = {"attachments": item["attachments"]} if item.get("attachments") else {}
+            store.append("You", item["prompt"], **extra)
+            store.flush()
+        request = AIRequest(
+            item["prompt"], self.api_key, store.path if store is not None else None, stream=self.stream,
+            model_name=item.get("model") or self.model_name, history_end=history_end,
+            context_budget=self.context_budget if store is not None else 0, timeout=self.timeout,
+            attachments=item.get("attachments", ()),
+        )
+        with self.lock:
+            self.active[request.id] = (item, session)
+        self.executor.submit(request)
+
+    def session_store(self, session):
+        if not self.chat_dir:
+            return None
+        store = self.stores.get(session)
+        if store is None:
+            os.makedirs(self.chat_dir, exist_ok=True)
+            store = self.stores[session] = SessionStore(os.path.join(self.chat_dir, session + SESSION_EXT))
+        return store
+
+    def write(self, event):
+        with self.lock:
+            self.output.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self.output.flush()
+
+    def handle_chunk(self, request_id, text):
+        if self.stream:
+            item, _ = self.active[request_id]
+            self.write({"id": item["id"], "chunk": text})
+
+    def handle_retry(self, request_id, attempt, delay, message):
+        item, _ = self.active[request_id]
+        self.write({"id": item["id"], "retry": attempt, "delay": round(delay, 3), "reason": message})
+
+    def handle_done(self, request_id, text):
+        self.finish(request_id, text)
+
+    # Failed prompts are reported in the output only; the session keeps just the prompt.
+    def handle_error(self, request_id, message):
+        self.finish(request_id, None)
+
+    def finish(self, request_id, text):
+        request = self.executor.pop(request_id)
+        with self.lock:
+            item, session = self.active.pop(request_id)
+        store = self.stores.get(session)
+        event = {"id": item["id"], "session": session}
+        if request.error is None:
+            event["text"] = text
+            if store is not None:
+                store.append("Gemini", text, **({"cached": True} if request.cached else {}))
+                store.flush()
+        else:
+            event.update(error=request.error, error_kind=request.error_kind)
+            with self.lock:
+                self.failures += 1
+        event.update(attempts=request.attempts, cached=request.cached,
+                     ttft=request.ttft and round(request.ttft, 3), elapsed=round(request.elapsed, 3))
+        self.write(event)
+        self.submit_next(session)
+        self.window.release()
+        with self.lock:
+            self.pending -= 1
+            if not self.pending and not self.reading:
+                self.finished.set()
+
+def run_batch(args):
+    api_key = args.api_key or os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY") \
+        or load_api_key(args.config, args.key_file)
+    if not api_key:
+        print("aui: no API key (use --api-key, GEMINI_API_KEY or the GUI settings)", file=sys.stderr)
+        return 2
+    config = read_config(args.config)
+    in_flight = config.get("max_in_flight")
+    if type(in_flight) is not int or not 1 <= in_flight <= MAX_IN_FLIGHT:
+        # Same check as the GUI's settings: a bad value in config.json means the default.
+        in_flight = 2
+    executor = RequestExecutor(
+        args.concurrency or in_flight,
+        retries=args.retries, rate_limiter=RateLimiter(args.rpm, args.tpm),
+        metrics=Metrics() if args.metrics else None,
+    )
+    if args.cache:
+        os.makedirs(args.chat_dir, exist_ok=True)
+        executor.response_cache = ResponseCache(os.path.join(args.chat_dir, RESPONSE_CACHE_FILE))
+    executor.blob_store = BlobStore(os.path.join(args.chat_dir, BLOB_DIR))
+    output = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+    runner = BatchRunner(
+        executor, api_key, output, chat_dir=args.chat_dir if args.sessions else None,
+        model_name=args.model, stream=not args.no_stream,
+        context_budget=config.get("context_tokens", CONTEXT_TOKEN_BUDGET), timeout=args.timeout,
+    )
+    try:
+        failures = runner.run(read_prompts(args.prompts))
+    except (OSError, ValueError) as e:
+        print(f"aui: {e}", file=sys.stderr)
+        executor.shutdown()
+        return 2
+    except KeyboardInterrupt:
+        executor.cancel_all("Interrupted")
+        executor.shutdown()
+        return 130
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    executor.shutdown(wait=True)
+    if executor.response_cache is not None:
+        executor.response_cache.close()
+    if executor.metrics is not None:
+        executor.metrics.set_gauge("process_rss_bytes", process_rss())
+        executor.metrics.export(args.metrics, "prometheus" if args.metrics.endswith(".prom") else "jsonl")
+    return 1 if failures else 0
+
+def run_archive(args):
+    archive = SessionArchive(args.chat_dir, args.compression)
+    result = archive.maintain(args.days)
+    result.update(archive.stats())
+    archive.close()
+    print(json.dumps(result))
+    return 0
+
+# run_transfer: export or import from the command line; prints one JSON line per session.
+def run_transfer(args):
+    if args.command == "export":
+        if not os.path.isdir(args.chat_dir):
+            print(f"aui: no sessions in {args.chat_dir}", file=sys.stderr)
+            return 2
+        names = [os.path.basename(name) for name in args.sessions] or all_sessions(args.chat_dir)
+        results = export_sessions(args.chat_dir, names, args.output, args.format, args.jobs)
+        label = 1
+    else:
+        results = import_sessions(args.files, args.chat_dir, args.jobs)
+        label = 0
+    failures = 0
+    try:
+        for job, result, error in results:
+            if error is not None:
+                failures += 1
+                result = {"session" if label else "source": job[label], "error": str(error) or type(error).__name__}
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+    except KeyboardInterrupt:
+        return 130
+    return 1 if failures else 0
+
+# int_at_least: An argparse type for whole numbers no smaller than minimum.
+def int_at_least(minimum):
+    def parse(text):
+        try:
+            value = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid int value: {text!r}") from None
+        if value < minimum:
+            raise argparse.ArgumentTypeError(f"must be at least {minimum}")
+        return value
+    return parse
+
+def main(argv=None, prog="aui_core.py"):
+    parser = argparse.ArgumentParser(prog=prog, description="Run AUI prompts without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="send every prompt of a JSONL file to Gemini")
+    run.add_argument("prompts", help='JSONL file, one {"prompt": ..., "session": ..., "attachments": [...]} '
+                                      'per line ("-" for stdin)')
+    run.add_argument("-o", "--output", default="-", help="where result lines go (default: stdout)")
+    run.add_argument("--sessions", action="store_true", help="also record each session in --chat-dir")
+    run.add_argument("--chat-dir", default=CHAT_DIR)
+    run.add_argument("-j", "--concurrency", type=int_at_least(1), default=None,
+                     help="requests in flight (default: GUI setting)")
+    run.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="re-sends of rate-limited or failed requests")
+    run.add_argument("--rpm", type=float, default=0, help="at most this many requests per minute")
+    run.add_argument("--tpm", type=float, default=0, help="at most this many prompt tokens per minute")
+    run.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="seconds per prompt, 0 for none")
+    run.add_argument("--metrics", metavar="FILE",
+                     help="write request timings to FILE when done (Prometheus text for .prom, else a JSON line)")
+    run.add_argument("--model", default=MODEL_NAME)
+    run.add_argument("--no-stream", action="store_true", help="only print finished replies")
+    run.add_argument("--cache", action="store_true", help="use the GUI's response cache")
+    run.add_argument("--api-key", default="")
+    run.add_argument("--config", default=CONFIG_FILE)
+    run.add_argument("--key-file", default=KEY_FILE)
+    archive = commands.add_parser("archive", help="compress sessions nobody has touched for a while")
+    archive.add_argument("--chat-dir", default=CHAT_DIR)
+    archive.add_argument("--days", type=float, default=ARCHIVE_AFTER_DAYS, help="archive sessions idle this long")
+    archive.add_argument("--compression", choices=["auto", "zstd", "gzip"], default="auto",
+                         help="auto uses zstd when the zstandard package is installed")
+    export = commands.add_parser("export", help="write sessions out as JSONL, Markdown or HTML, one file each")
+    export.add_argument("sessions", nargs="*", help="session names (default: every session, archived ones too)")
+    export.add_argument("-o", "--output", default="exports", help="directory for the exported files")
+    export.add_argument("-f", "--format", choices=list(EXPORT_FORMATS), default="jsonl")
+    export.add_argument("--chat-dir", default=CHAT_DIR)
+    export.add_argument("-j", "--jobs", type=int_at_least(1), default=0, help="worker processes (default: one per CPU)")
+    imports = commands.add_parser("import", help="add JSONL exports or old chat_*.txt files as new sessions")
+    imports.add_argument("files", nargs="+")
+    imports.add_argument("--chat-dir", default=CHAT_DIR)
+    imports.add_argument("-j", "--jobs", type=int_at_least(1), default=0, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+    if args.command == "archive":
+        return run_archive(args)
+    if args.command in ("export", "import"):
+        return run_transfer(args)
+    return run_batch(args)
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# Years of chat history before and after the archive job: disk used by chat_sessions/, the time
+# to list every session the way History does (directory listing plus archive catalog) and the
+# time to open one session, live or streamed back out of a bundle.
+#
+#   python benchmarks/bench_archive.py --sessions 20000
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aui_core as core  # noqa: E402
+
+WORDS = "gemini python qt layout stream cache search index bubble theme session reply error log".split()
+
+# disk_usage: Bytes in every file under root.
+def disk_usage(root):
+    total = 0
+    for folder, _, names in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(folder, name)) for name in names)
+    return total
+
+# list_sessions: What History lists: live session files plus the archive catalog.
+def list_sessions(archive):
+    return core.session_files(archive.chat_dir) + archive.names()
+
+# median_ms: Median wall time of action over repeat runs, in milliseconds.
+def median_ms(action, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+# main: Builds the history, measures it, runs the archive job and measures it again.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=12, help="messages per session")
+    parser.add_argument("--recent", type=float, default=0.05, help="share of sessions touched lately")
+    parser.add_argument("--compression", choices=["auto", "zstd", "gzip"], default="auto")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix="aui-bench-archive-")
+    try:
+        chat_dir = os.path.join(work, "chat_sessions")
+        os.makedirs(chat_dir)
+        now = time.time()
+        for n in range(args.sessions):
+            path = os.path.join(chat_dir, f"chat_{n:06d}{core.SESSION_EXT}")
+            store = core.SessionStore(path)
+            for i in range(args.messages):
+                words = " ".join(rng.choice(WORDS) for _ in range(10 + rng.randrange(60)))
+                store.append("You" if i % 2 == 0 else "Gemini", words)
+            store.close()
+            if rng.random() >= args.recent:
+                age = now - rng.uniform(core.ARCHIVE_AFTER_DAYS + 1, 3 * 365) * 86400
+                os.utime(path, (age, age))
+            core.read_session_meta(path)
+        archive = core.SessionArchive(chat_dir, args.compression)
+        names = core.session_files(chat_dir)
+        sample = rng.sample(names, min(50, len(names)))
+        before = {
+            "disk": disk_usage(chat_dir),
+            "files": len(os.listdir(chat_dir)),
+            "list": median_ms(lambda: list_sessions(archive), args.repeat),
+            "open": median_ms(lambda: core.SessionStore(os.path.join(chat_dir, rng.choice(sample))).tail(200),
+                              args.repeat),
+        }
+        start = time.perf_counter()
+        result = archive.maintain(core.ARCHIVE_AFTER_DAYS)
+        job = time.perf_counter() - start
+        archived = [name for name in sample if archive.contains(name)]
+
+        after = {
+            "disk": disk_usage(chat_dir),
+            "files": len(os.listdir(chat_dir)),
+            "list": median_ms(lambda: list_sessions(archive), args.repeat),
+        }
+        # What load_session does for an archived session: restore it, then read the last page.
+        opens = []
+        for name in archived[:args.repeat]:
+            start = time.perf_counter()
+            path = archive.restore(name)
+            core.SessionStore(path).tail(200)
+            opens.append((time.perf_counter() - start) * 1000)
+            archive.archive([path])
+        after["open"] = statistics.median(opens) if opens else 0.0
+        stats = archive.stats()
+        archive.close()
+        print(f"{args.sessions} sessions, {result['archived']} archived with {archive.codec} "
+              f"into {stats['bundles']} bundle(s) in {job:.1f} s")
+        print(f"{'':<28}{'before':>12}{'after':>12}")
+        print(f"{'disk used (MB)':<28}{before['disk'] / 2 ** 20:>12.1f}{after['disk'] / 2 ** 20:>12.1f}")
+        print(f"{'entries in chat_sessions/':<28}{before['files']:>12}{after['files']:>12}")
+        print(f"{'list sessions (ms)':<28}{before['list']:>12.2f}{after['list']:>12.2f}")
+        print(f"{'open a session (ms)':<28}{before['open']:>12.2f}{after['open']:>12.2f}  (after: archived one)")
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Attaching one large log to several sessions through the blob store: time and peak Python memory
+# of the first attach and of re-attaching, disk used by the store, and how many uploads a stub
+# Files API sees when every session sends a prompt with the file.
+#
+#   python benchmarks/bench_attach.py --mb 200 --sessions 5
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aui_core as core  # noqa: E402
+
+# write_log: A plain-text server log of roughly the given size.
+def write_log(path, megabytes):
+    line = b"2024-05-01T12:00:00 worker-3 INFO request handled in 12 ms status=200 path=/api/v1/items\n"
+    with open(path, "wb") as f:
+        for _ in range(megabytes * 1024 * 1024 // len(line)):
+            f.write(line)
+
+# measure: Runs action once; returns its result, the seconds it took and the peak traced memory.
+def measure(action):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = action()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+# StubChat, StubModel: Answer every prompt at once, so only the attachment path is measured.
+class StubChat:
+    def send_message(self, prompt, stream=True, **options):
+        return iter(["ok"])
+
+class StubModel:
+    def start_chat(self, history=None):
+        return StubChat()
+
+# main: Attaches the log to every session, then sends one prompt per session through the executor.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=200, help="size of the log file")
+    parser.add_argument("--sessions", type=int, default=5, help="sessions the log is attached to")
+    args = parser.parse_args()
+    work = tempfile.mkdtemp(prefix="aui-bench-attach-")
+    try:
+        log = os.path.join(work, "server.log")
+        write_log(log, args.mb)
+        uploads = []
+
+        def uploader(api_key, path, mime_type, display_name, token=None):
+            uploads.append(path)
+            return {"name": "files/stub", "uri": f"stub://{os.path.basename(path)}", "mime": mime_type,
+                    "expires": time.time() + 3600}
+
+        store = core.BlobStore(os.path.join(work, core.BLOB_DIR), uploader)
+        print(f"{args.mb} MB log attached to {args.sessions} sessions")
+        print(f"{'step':<22}{'seconds':>9}{'peak MB':>9}")
+        attachment, elapsed, peak = measure(lambda: store.add(log))
+        print(f"{'first attach':<22}{elapsed:>9.2f}{peak / 2 ** 20:>9.2f}")
+        for _ in range(args.sessions - 1):
+            _, elapsed, peak = measure(lambda: store.add(log))
+        print(f"{'re-attach':<22}{elapsed:>9.2f}{peak / 2 ** 20:>9.2f}")
+
+        done = threading.Event()
+        finished = []
+
+        def finish(request_id, _):
+            finished.append(request_id)
+            if len(finished) == args.sessions:
+                done.set()
+
+        executor = core.RequestExecutor(
+            4, model_cache=core.ModelCache(lambda key, name: StubModel()), on_done=finish, on_error=finish,
+        )
+        executor.blob_store = store
+        for n in range(args.sessions):
+            executor.submit(core.AIRequest(f"what failed in session {n}?", "key", None, attachments=[attachment]))
+        done.wait()
+        executor.shutdown()
+        stats = store.stats()
+        print(f"blob store: {stats['blobs']} file(s), {stats['bytes'] / 2 ** 20:.1f} MB on disk")
+        print(f"uploads: {len(uploads)} for {args.sessions} prompts")
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Per-chunk cost of rendering a streamed Markdown reply: MarkdownRenderer keeps finished
+# blocks and re-parses only the tail, against re-parsing the whole reply on every chunk.
+#
+#   python benchmarks/bench_markdown.py --chars 20000 --chunk 80
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_transcript import import_aui  # noqa: E402
+
+SECTION = """## Step {n}
+Some **bold** text, a `call()` and a [link](https://example.com/{n}).
+
+- first point
+- second point with *emphasis*
+
+```python
+def step_{n}(items):
+    # keep the even ones
+    return [item * 2 for item in items if item % 2 == 0]
+```
+
+"""
+
+# reply: A Gemini reply of about chars characters made of repeated Markdown sections.
+def reply(chars):
+    text = "[Gemini]\n"
+    n = 0
+    while len(text) < chars:
+        text += SECTION.format(n=n)
+        n += 1
+    return text[:chars]
+
+# stream: Renders text as it grows by chunk characters; returns ms per chunk and the chunk count.
+def stream(aui, text, chunk, incremental):
+    colors = aui.GruvboxTheme.DARK_SOFT
+    renderer = aui.MarkdownRenderer()
+    start = time.perf_counter()
+    chunks = 0
+    for end in range(chunk, len(text) + chunk, chunk):
+        if not incremental:
+            renderer = aui.MarkdownRenderer()
+            aui.highlight_code.cache_clear()
+        renderer.render("reply", text[:end], colors)
+        chunks += 1
+    return (time.perf_counter() - start) * 1000 / chunks, chunks
+
+# main: Streams the same reply with and without the renderer's block cache.
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chars", type=int, default=20000)
+    parser.add_argument("--chunk", type=int, default=80)
+    args = parser.parse_args()
+    aui = import_aui()
+    text = reply(args.chars)
+    for name, incremental in (("full re-parse", False), ("incremental", True)):
+        aui.highlight_code.cache_clear()
+        per_chunk, chunks = stream(aui, text, args.chunk, incremental)
+        print(f"{name:>14}: {per_chunk:>7.3f} ms per chunk   ({chunks} chunks, {args.chars} chars)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Request scheduling against a stub Gemini server that enforces its own rate limit and fails
+# some requests with 503s: how many prompts get answered, how many attempts that takes and how
+# many requests the server has to reject, with and without retries and client-side limits.
+# Time is scaled down so a "minute" lasts --minute seconds.
+#
+#   python benchmarks/bench_retry.py --prompts 60 --server-rpm 30 --fail 0.1
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aui_core as core  # noqa: E402
+
+# StubError: An API error carrying its status code and, for 429s, the server's retry hint.
+class StubError(Exception):
+    def __init__(self, code, message, retry_after=None):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.retry_after = retry_after
+
+# StubServer: Sliding-window request limit plus random transient failures, like the real API.
+class StubServer:
+    def __init__(self, rpm, minute, fail_rate, latency):
+        self.rpm = rpm
+        self.minute = minute
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.calls = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def handle(self, prompt):
+        with self.lock:
+            now = time.monotonic()
+            self.calls += 1
+            while self.window and now - self.window[0] >= self.minute:
+                self.window.popleft()
+            if len(self.window) >= self.rpm:
+                self.rejected += 1
+                wait = self.minute - (now - self.window[0])
+                raise StubError(429, "Resource has been exhausted", retry_after=round(wait, 3))
+            self.window.append(now)
+            if random.random() < self.fail_rate:
+                self.failed += 1
+                raise StubError(503, "The model is overloaded. Please try again later.")
+        time.sleep(self.latency)
+        return f"answer to {prompt}"
+
+    def model(self):
+        server = self
+
+        class Model:
+            def generate_content(self, contents, stream=False):
+                return server.handle(contents)
+
+        return Model()
+
+# run: Sends every prompt through a fresh executor and server; returns what the server and client saw.
+def run(args, retries, client_rpm):
+    random.seed(args.seed)
+    server = StubServer(args.server_rpm, args.minute, args.fail, args.latency)
+    limiter = core.RateLimiter(client_rpm * 60 / args.minute if client_rpm else 0)
+    done = threading.Event()
+    results = {}
+    executor = core.RequestExecutor(
+        args.in_flight, model_cache=core.ModelCache(lambda key, name: server.model()),
+        retries=retries, rate_limiter=limiter,
+    )
+
+    def finish(request_id, _):
+        results[request_id] = executor.requests[request_id]
+        if len(results) == args.prompts:
+            done.set()
+
+    executor.on_done = finish
+    executor.on_error = finish
+    start = time.perf_counter()
+    for n in range(args.prompts):
+        executor.submit(core.AIRequest(f"prompt {n}", "key", None, stream=False, context_budget=0))
+    done.wait()
+    wall = time.perf_counter() - start
+    executor.shutdown()
+    requests = list(results.values())
+    answered = [request for request in requests if request.error is None]
+    latencies = sorted(request.elapsed for request in answered) or [0.0]
+    return {
+        "answered": len(answered),
+        "attempts": sum(request.attempts for request in requests),
+        "rejected": server.rejected,
+        "failed": server.failed,
+        "p50": statistics.median(latencies),
+        "max": latencies[-1],
+        "wall": wall,
+    }
+
+# main: Runs the same load with no retries, with backoff only and with a client-side RPM limit.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=60)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--server-rpm", type=int, default=30)
+    parser.add_argument("--minute", type=float, default=2.0, help="seconds that stand in for a minute")
+    parser.add_argument("--fail", type=float, default=0.1, help="share of accepted requests failing with 503")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    # Backoff and bursts are scaled with the minute as well.
+    core.RETRY_BASE_DELAY = args.minute / 60
+    core.RETRY_MAX_DELAY = args.minute
+    core.TokenBucket.BURST_SECONDS *= args.minute / 60
+    print(f"{args.prompts} prompts, server allows {args.server_rpm}/min, {args.fail:.0%} transient failures")
+    print(f"{'scheduling':<28}{'answered':>9}{'attempts':>9}{'429s':>6}{'503s':>6}{'p50 s':>8}{'max s':>8}{'wall s':>8}")
+    cases = [
+        ("no retries", 0, 0),
+        ("retries, backoff only", core.DEFAULT_RETRIES + 4, 0),
+        ("retries + client RPM limit", core.DEFAULT_RETRIES + 4, args.server_rpm * 0.8),
+    ]
+    for name, retries, client_rpm in cases:
+        r = run(args, retries, client_rpm)
+        print(f"{name:<28}{r['answered']:>9}{r['attempts']:>9}{r['rejected']:>6}{r['failed']:>6}"
+              f"{r['p50']:>8.2f}{r['max']:>8.2f}{r['wall']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Scroll frame time with per-bubble QGraphicsDropShadowEffect (the old widget transcript)
+# against BubbleDelegate painting the cached nine-patch shadow, and with shadows off.
+#
+#   python benchmarks/bench_shadows.py --messages 2000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_transcript import build_legacy, build_model, fake_messages, import_aui  # noqa: E402
+
+# scroll_frames: Scrolls up a third of a page per frame; returns the median and p95 frame time in ms.
+def scroll_frames(app, window, bar, frames):
+    app.processEvents()
+    step = max(1, bar.pageStep() // 3)
+    samples = []
+    value = bar.maximum()
+    for _ in range(frames):
+        value = value - step if value - step > 0 else bar.maximum()
+        start = time.perf_counter()
+        bar.setValue(value)
+        window.repaint()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95)]
+
+# main: Builds the transcript each way in its own window and scrolls it.
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+    aui = import_aui()
+    from PyQt5.QtWidgets import QApplication, QMainWindow
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    messages = list(fake_messages(args.messages))
+    cases = [
+        ("drop shadow effect", lambda window: build_legacy(aui, window, messages, "Gruvbox Dark Soft")),
+        ("nine-patch", lambda window: build_model(aui, window, messages, "Gruvbox Dark Soft")),
+        ("shadows off", lambda window: build_model(aui, window, messages, "Gruvbox Dark Soft", shadows=False)),
+    ]
+    for name, build in cases:
+        window = QMainWindow()
+        window.resize(1200, 800)
+        window.show()
+        bar = build(window)
+        median, p95 = scroll_frames(app, window, bar, args.frames)
+        print(f"{name:>18}: median {median:>7.2f} ms   p95 {p95:>7.2f} ms   ({args.messages} messages)")
+        window.close()
+        window.deleteLater()
+        app.processEvents()
+
+if __name__ == "__main__":
+    main()
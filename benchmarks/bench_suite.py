@@ -0,0 +1,249 @@
+# Headless benchmark suite for AUI's hot paths. Runs under the Qt offscreen platform with a
+# placeholder Gemini SDK and a stub model, writes the results to a JSON file and, given the
+# results of an earlier run, flags every timing that got slower by more than --threshold.
+#
+#   python benchmarks/bench_suite.py -o before.json
+#   python benchmarks/bench_suite.py -o after.json --compare before.json
+#
+# Every result is a median time in milliseconds, so lower is always better. --quick skips the
+# 100k-message session and uses fewer files so a run fits in a CI step.
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_transcript import ROOT, fake_messages, import_aui  # noqa: E402
+
+WORDS = "gemini python qt layout stream cache search index bubble theme session reply".split()
+
+# median_ms: Median time of action(i) over repeat runs, including the events it posts and settle().
+def median_ms(app, action, repeat, settle=None):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        action(i)
+        app.processEvents()
+        if settle is not None:
+            settle()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+# wait_for: Processes events until done() is true, or raises after timeout seconds.
+def wait_for(app, done, timeout=120):
+    deadline = time.perf_counter() + timeout
+    while not done():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("benchmark step did not finish")
+        app.processEvents()
+        time.sleep(0.001)
+
+# write_session: A session of count alternating messages.
+def write_session(aui, path, count, rng):
+    store = aui.SessionStore(path)
+    for i in range(count):
+        words = " ".join(rng.choice(WORDS) for _ in range(5 + i % 30))
+        store.append("You" if i % 2 == 0 else "Gemini", f"message {i}: {words}")
+    store.close()
+
+# StubChat: Streams a fixed reply in many small chunks with no network delay, so the numbers
+# measure what the GUI does with a stream rather than how fast a server produces one.
+class StubChat:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def send_message(self, prompt, stream=True, **options):
+        pieces = (f"chunk {i} of the streamed reply, " for i in range(self.chunks))
+        return pieces if stream else "".join(pieces)
+
+# StubModel: Hands out a StubChat streaming chunks pieces.
+class StubModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def start_chat(self, history=None):
+        return StubChat(self.chunks)
+
+# run: Fills a scratch CHAT_DIR, drives a ChatClient through each hot path and returns the report.
+def run(args):
+    aui = import_aui()
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    rng = random.Random(args.seed)
+    sizes = [1000, 10000] if args.quick else [1000, 10000, 100000]
+    files = args.files // 4 if args.quick else args.files
+    os.makedirs(aui.CHAT_DIR, exist_ok=True)
+    for size in sizes:
+        write_session(aui, os.path.join(aui.CHAT_DIR, f"bench_{size}{aui.SESSION_EXT}"), size, rng)
+    for n in range(files):
+        write_session(aui, os.path.join(aui.CHAT_DIR, f"small_{n:05d}{aui.SESSION_EXT}"), 4, rng)
+
+    window = aui.ChatClient()
+    window.resize(1200, 800)
+    window.show()
+    window.executor.model_cache.factory = lambda key, name: StubModel(args.chunks)
+    window.config.api_key = "benchmark"
+    window.history_page.ensure()
+    window.settings_page.ensure()
+    app.processEvents()
+    results = {}
+
+    # The search thread indexes every session on start; the first query waits for that.
+    answered = []
+    window.search.results_ready.connect(lambda token, hits: answered.append(token))
+    start = time.perf_counter()
+    token = window.search.search("lorem")
+    wait_for(app, lambda: token in answered)
+    results["search_first_query_ms"] = (time.perf_counter() - start) * 1000
+
+    def search(i):
+        window.search_bar.setText(rng.choice(WORDS))
+        window.filter_sessions()
+
+    results["filter_sessions_ms"] = median_ms(
+        app, search, args.repeat, settle=lambda: wait_for(app, lambda: window.search_token in answered)
+    )
+    window.search_bar.clear()
+    window.filter_sessions()
+
+    window.session_model.set_files([])
+    results["refresh_sessions_cold_ms"] = median_ms(
+        app, lambda i: (window.session_model.set_files([]), window.refresh_sessions()), args.repeat
+    )
+    results["refresh_sessions_warm_ms"] = median_ms(app, lambda i: window.refresh_sessions(), args.repeat)
+
+    def reload(name):
+        # An open session is only switched to, so close its tab to time a real load.
+        page = window.pages.get(os.path.join(aui.CHAT_DIR, name))
+        if page is not None:
+            window.close_page(page)
+        window.load_session(name)
+        window.repaint()
+
+    for size in sizes:
+        name = f"bench_{size}{aui.SESSION_EXT}"
+        results[f"load_session_{size // 1000}k_ms"] = median_ms(app, lambda i: reload(name), args.repeat)
+
+    window.new_chat()
+    app.processEvents()
+    messages = [text.split("\n", 1)[1] for _, text in fake_messages(args.appends)]
+    start = time.perf_counter()
+    for n, text in enumerate(messages):
+        window.append_message("You" if n % 2 == 0 else "Gemini", text)
+        if n % 50 == 0:
+            app.processEvents()
+    app.processEvents()
+    results["append_message_ms"] = (time.perf_counter() - start) * 1000 / args.appends
+
+    window.load_session(f"bench_{sizes[-1]}{aui.SESSION_EXT}")
+    window.transcript_model.extend(fake_messages(args.transcript))
+    window.transcript.scrollToBottom()
+    app.processEvents()
+    themes = ["Gruvbox Light Soft", "Gruvbox Dark Soft"]
+    for name, action in [
+        ("theme", lambda i: window.theme_combo.setCurrentText(themes[i % 2])),
+        ("font", lambda i: window.font_size_input.setValue(13 + i % 2)),
+        ("radius", lambda i: window.radius_slider.setValue(8 + i % 2 * 8)),
+    ]:
+        results[f"{name}_change_ms"] = median_ms(app, lambda i: (action(i), window.repaint()), args.repeat)
+
+    # Streamed replies into the same long transcript: time from send to the saved reply, and the
+    # longest event-loop stall meanwhile.
+    window.stall_monitor.start()
+    samples = []
+    stalls = []
+    for i in range(args.repeat):
+        window.metrics.series.pop("ui_stall_seconds", None)
+        start = time.perf_counter()
+        window.send_text(f"stream {i}")
+        wait_for(app, lambda: not window.pending)
+        samples.append((time.perf_counter() - start) * 1000)
+        stall = window.metrics.snapshot()["series"].get("ui_stall_seconds")
+        stalls.append(stall["max"] * 1000 if stall else 0.0)
+    samples.sort()
+    stalls.sort()
+    results["stream_reply_ms"] = samples[len(samples) // 2]
+    results["stream_max_stall_ms"] = stalls[len(stalls) // 2]
+
+    window.close()
+    meta = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+    return {"meta": meta, "results": {name: round(value, 3) for name, value in results.items()}}
+
+# git_commit: Short hash of the checked-out commit, or None outside a git checkout.
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+# compare: A result regresses when it is both threshold-relative and min_delta_ms slower, so
+# sub-millisecond noise on the fast paths does not trip it.
+def compare(before, after, threshold, min_delta_ms):
+    regressions = []
+    print(f"{'benchmark':<28}{'before':>11}{'after':>11}{'change':>9}")
+    for name, value in after["results"].items():
+        old = before["results"].get(name)
+        if old is None:
+            print(f"{name:<28}{'-':>11}{value:>11.2f}")
+            continue
+        change = (value - old) / old if old else 0.0
+        flag = ""
+        if change > threshold and value - old > min_delta_ms:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold and old - value > min_delta_ms:
+            flag = "  faster"
+        print(f"{name:<28}{old:>11.2f}{value:>11.2f}{change:>+9.0%}{flag}")
+    return regressions
+
+# main: Writes the report; with --compare, exits 1 if any result regressed.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore slowdowns smaller than this")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--files", type=int, default=2000, help="small sessions for the History list")
+    parser.add_argument("--appends", type=int, default=1000)
+    parser.add_argument("--transcript", type=int, default=5000, help="rows shown during theme/font changes")
+    parser.add_argument("--chunks", type=int, default=400, help="chunks per streamed reply")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--quick", action="store_true")
+    args = parser.parse_args()
+    # import_aui moves into a scratch directory, so resolve paths first.
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    report = run(args)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if baseline is None:
+        for name, value in report["results"].items():
+            print(f"{name:<28}{value:>11.2f} ms")
+        print(f"results written to {output}")
+        return 0
+    with open(baseline, encoding="utf-8") as f:
+        regressions = compare(json.load(f), report, args.threshold, args.min_delta_ms)
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# Times theme, font and bubble-radius changes on a ChatClient holding a long transcript.
+# Every change goes through the same slots the Settings tab uses, and the window is
+# repainted afterwards so restyling and relayout costs are included.
+#
+#   python benchmarks/bench_theme.py --messages 5000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_transcript import fake_messages, import_aui  # noqa: E402
+
+# timed: Median and worst time of action(i) plus the repaint it causes, in milliseconds.
+def timed(app, window, action, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        action(i)
+        app.processEvents()
+        window.repaint()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+# main: Loads the transcript into a ChatClient and flips each setting back and forth.
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    aui = import_aui()
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    window = aui.ChatClient()
+    window.resize(1200, 800)
+    window.show()
+    # The Settings tab is built on first open; the benchmark drives its widgets directly.
+    window.settings_page.ensure()
+    window.transcript_model.extend(fake_messages(args.messages))
+    window.transcript.scrollToBottom()
+    app.processEvents()
+    themes = ["Gruvbox Light Soft", "Gruvbox Dark Soft"]
+    cases = [
+        ("theme", lambda i: window.theme_combo.setCurrentText(themes[i % 2])),
+        ("font size", lambda i: window.font_size_input.setValue(13 + i % 2)),
+        ("bubble radius", lambda i: window.radius_slider.setValue(8 + i % 2 * 8)),
+    ]
+    for name, action in cases:
+        median, worst = timed(app, window, action, args.repeat)
+        print(f"{name:>13}: median {median:>7.2f} ms   max {worst:>7.2f} ms   ({args.messages} messages)")
+    window.close()
+
+if __name__ == "__main__":
+    main()
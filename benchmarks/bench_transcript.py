@@ -0,0 +1,177 @@
+# Compares loading a long session into the legacy widget-per-message transcript
+# (QFrame + QGraphicsDropShadowEffect per bubble) against the TranscriptModel/TranscriptView.
+# Each view runs in its own process so RSS numbers are not polluted by the other one.
+#
+#   python benchmarks/bench_transcript.py --messages 10000
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# rss_kb: Current RSS from /proc, or the peak RSS where /proc is not available.
+def rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# import_aui: Imports aui under the offscreen platform from a scratch directory, with a placeholder
+# SDK if the real one is missing.
+def import_aui():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        import google.generativeai  # noqa: F401
+    except ImportError:
+        # The benchmark never talks to the API; a placeholder module is enough to import aui.
+        google = types.ModuleType("google")
+        google.generativeai = types.ModuleType("google.generativeai")
+        sys.modules["google"] = google
+        sys.modules["google.generativeai"] = google.generativeai
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="aui-bench-"))
+    import aui
+    return aui
+
+# fake_messages: Alternating (sender, text) pairs with replies of varying length.
+def fake_messages(count):
+    for i in range(count):
+        if i % 2:
+            yield "Gemini", f"[Gemini]\nReply {i}: " + "lorem ipsum dolor sit amet " * (1 + i % 12)
+        else:
+            yield "You", f"[You]\nQuestion {i}?"
+
+# build_legacy: The old transcript, one shadowed QFrame bubble per message in a QScrollArea.
+def build_legacy(aui, window, messages, theme):
+    from PyQt5.QtWidgets import (
+        QScrollArea, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QFrame, QSizePolicy,
+        QGraphicsDropShadowEffect
+    )
+    from PyQt5.QtGui import QColor
+    from PyQt5.QtCore import Qt
+    colors = aui.GruvboxTheme.DARK_SOFT
+    scroll = QScrollArea()
+    scroll.setWidgetResizable(True)
+    area = QWidget()
+    area_layout = QVBoxLayout(area)
+    area_layout.setSpacing(12)
+    area_layout.addStretch(1)
+    scroll.setWidget(area)
+    window.setCentralWidget(scroll)
+    for sender, text in messages:
+        is_user = sender == "You"
+        bubble = QFrame()
+        bubble_layout = QVBoxLayout(bubble)
+        bubble_layout.setContentsMargins(12, 8, 12, 8)
+        label = QLabel(text)
+        label.setWordWrap(True)
+        label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        bubble_layout.addWidget(label)
+        bubble.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Preferred)
+        shadow = QGraphicsDropShadowEffect(bubble)
+        shadow.setBlurRadius(15)
+        shadow.setOffset(2, 2)
+        shadow.setColor(QColor(0, 0, 0, 120))
+        bubble.setGraphicsEffect(shadow)
+        bg = colors["user_bubble"] if is_user else colors["ai_bubble"]
+        bubble.setStyleSheet(
+            f"QFrame {{ background-color: {bg}; border-radius: 12px; }}"
+            f"QLabel {{ color: {colors['text']}; font-size: 14px; }}"
+        )
+        container = QWidget()
+        h_layout = QHBoxLayout(container)
+        h_layout.setContentsMargins(0, 0, 0, 0)
+        if is_user:
+            h_layout.addStretch(1)
+            h_layout.addWidget(bubble)
+        else:
+            h_layout.addWidget(bubble)
+            h_layout.addStretch(1)
+        area_layout.insertWidget(area_layout.count() - 1, container)
+    return scroll.verticalScrollBar()
+
+# build_model: The current transcript, TranscriptModel painted by BubbleDelegate.
+def build_model(aui, window, messages, theme, shadows=True):
+    from PyQt5.QtGui import QFont
+    model = aui.TranscriptModel(window)
+    view = aui.TranscriptView()
+    delegate = aui.BubbleDelegate(view)
+    delegate.set_theme(theme)
+    delegate.set_shadows(shadows, 0)
+    delegate.set_font(QFont("Noto Sans", 14))
+    view.setItemDelegate(delegate)
+    view.setModel(model)
+    window.setCentralWidget(view)
+    model.extend(messages)
+    view.scrollToBottom()
+    return view.verticalScrollBar()
+
+# run_one: Loads and scrolls one view in this process and returns its numbers.
+def run_one(view_kind, count):
+    aui = import_aui()
+    from PyQt5.QtWidgets import QApplication, QMainWindow
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    window = QMainWindow()
+    window.resize(1200, 800)
+    window.show()
+    app.processEvents()
+    messages = list(fake_messages(count))
+    base_rss = rss_kb()
+    start = time.perf_counter()
+    build = build_legacy if view_kind == "legacy" else build_model
+    bar = build(aui, window, messages, "Gruvbox Dark Soft")
+    app.processEvents()
+    bar.setValue(bar.maximum())
+    app.processEvents()
+    load_s = time.perf_counter() - start
+    # Scroll through the transcript a page at a time to exercise painting.
+    start = time.perf_counter()
+    steps = 0
+    for value in range(bar.maximum(), 0, -max(1, bar.pageStep()) * 10):
+        bar.setValue(value)
+        window.repaint()
+        steps += 1
+        if steps >= 50:
+            break
+    scroll_ms = (time.perf_counter() - start) * 1000 / max(1, steps)
+    return {
+        "view": view_kind,
+        "messages": count,
+        "load_s": round(load_s, 3),
+        "rss_delta_mb": round((rss_kb() - base_rss) / 1024, 1),
+        "scroll_frame_ms": round(scroll_ms, 2),
+    }
+
+# main: Runs each view in a child process and prints the results side by side.
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--view", choices=["legacy", "model"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.view:
+        print(json.dumps(run_one(args.view, args.messages)))
+        return
+    for kind in ("legacy", "model"):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--view", kind, "--messages", str(args.messages)],
+            capture_output=True, text=True,
+        )
+        if out.returncode != 0:
+            print(f"{kind}: failed\n{out.stderr}", file=sys.stderr)
+            continue
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{kind:>7}: load {result['load_s']:>7.3f} s   rss +{result['rss_delta_mb']:>7.1f} MB   "
+              f"scroll frame {result['scroll_frame_ms']:>7.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Exporting a large history through the process pool: wall time and throughput per format, and
+# the peak memory of the worker processes, which should not grow with the size of a session.
+# Ends with a re-import of the JSONL export.
+#
+#   python benchmarks/bench_transfer.py --mb 1024 --big-mb 512 -j 4
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aui_core as core  # noqa: E402
+
+WORDS = "gemini python qt layout stream cache search index bubble theme session reply error log".split()
+
+# write_session: Writes records straight to the JSONL file; the index is written by repair_index.
+def write_session(path, megabytes, rng):
+    limit = megabytes * 2 ** 20
+    size = 0
+    with open(path, "w", encoding="utf-8") as f:
+        n = 0
+        while size < limit:
+            text = " ".join(rng.choice(WORDS) for _ in range(20 + rng.randrange(400)))
+            line = json.dumps({"id": f"{n:08x}", "ts": "2024-05-01T12:00:00", "sender": "You" if n % 2 == 0 else "Gemini",
+                               "role": "user" if n % 2 == 0 else "model", "text": text}) + "\n"
+            f.write(line)
+            size += len(line)
+            n += 1
+    return size
+
+# children_peak_mb: Peak RSS of the largest finished worker process.
+def children_peak_mb():
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+# transfer: Drains an export or import generator; returns how many jobs ran and how many failed.
+def transfer(results):
+    count = failures = 0
+    for job, result, error in results:
+        count += 1
+        failures += error is not None
+    return count, failures
+
+# main: Writes the history, exports it in every format and imports the JSONL export.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=512, help="size of the whole history")
+    parser.add_argument("--big-mb", type=int, default=256, help="size of its largest session")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="worker processes (default: one per CPU)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix="aui-bench-transfer-")
+    try:
+        chat_dir = os.path.join(work, "chat_sessions")
+        os.makedirs(chat_dir)
+        total = write_session(os.path.join(chat_dir, f"chat_big{core.SESSION_EXT}"), args.big_mb, rng)
+        rest = max(1, (args.mb - args.big_mb) // max(1, args.sessions - 1))
+        for n in range(args.sessions - 1):
+            total += write_session(os.path.join(chat_dir, f"chat_{n:05d}{core.SESSION_EXT}"), rest, rng)
+        names = core.session_files(chat_dir)
+        # Build the indexes up front so the timings below only cover the export itself.
+        for name in names:
+            core.SessionStore(os.path.join(chat_dir, name)).repair_index()
+        jobs = args.jobs or os.cpu_count()
+        print(f"{len(names)} sessions, {total / 2 ** 20:.0f} MB (largest {args.big_mb} MB), {jobs} worker(s)")
+        print(f"{'step':<18}{'seconds':>9}{'MB/s':>9}{'failed':>8}")
+        for fmt in core.EXPORT_FORMATS:
+            out = os.path.join(work, fmt)
+            start = time.perf_counter()
+            count, failures = transfer(core.export_sessions(chat_dir, names, out, fmt, args.jobs))
+            elapsed = time.perf_counter() - start
+            print(f"{'export ' + fmt:<18}{elapsed:>9.2f}{total / 2 ** 20 / elapsed:>9.1f}{failures:>8}")
+        exported = [os.path.join(work, "jsonl", name) for name in names]
+        target = os.path.join(work, "imported")
+        start = time.perf_counter()
+        count, failures = transfer(core.import_sessions(exported, target, args.jobs))
+        elapsed = time.perf_counter() - start
+        print(f"{'import jsonl':<18}{elapsed:>9.2f}{total / 2 ** 20 / elapsed:>9.1f}{failures:>8}")
+        print(f"peak worker RSS: {children_peak_mb():.1f} MB; peak RSS of this process: "
+              f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# Time to first token of a send on a closed connection versus one opened while the prompt was
+# being typed (ModelCache.warm), against a local TLS stub of the API. --rtt adds a simulated
+# round trip: the stub holds each new connection for two (TCP and TLS) and each reply for one.
+#
+#   python benchmarks/bench_warm.py --rtt 0 40
+import argparse
+import http.client
+import http.server
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aui_core as core  # noqa: E402
+
+# make_certificate: A throwaway self-signed certificate for localhost.
+def make_certificate(work):
+    cert = os.path.join(work, "cert.pem")
+    key = os.path.join(work, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+# StubHandler: Answers generateContent and countTokens after one simulated round trip.
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add 40 ms to each.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.rtt)
+        body = b'{"totalTokens": 1}' if self.path.endswith("countTokens") else b"chunk one\nchunk two\nchunk three\n"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# StubServer: TLS server that delays each new connection by two simulated round trips.
+class StubServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cert, key, rtt):
+        super().__init__(("localhost", 0), StubHandler)
+        self.rtt = rtt
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert, key)
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        # TCP handshake plus a TLS 1.3 handshake.
+        time.sleep(2 * self.rtt)
+        return self.context.wrap_socket(sock, server_side=True), address
+
+# StubTransport, StubModel: Shaped like the SDK's: the model builds its client on first use and
+# the client's transport holds one keep-alive connection, which is what close_model closes.
+class StubTransport:
+    def __init__(self, address, cafile):
+        self.connection = http.client.HTTPSConnection(
+            "localhost", address[1], context=ssl.create_default_context(cafile=cafile)
+        )
+        self.lock = threading.Lock()
+
+    def post(self, path, body):
+        with self.lock:
+            self.connection.request("POST", path, body=body.encode())
+            return self.connection.getresponse().read().decode()
+
+    def close(self):
+        self.connection.close()
+
+# StubClient: Owns the transport, as the SDK client does.
+class StubClient:
+    def __init__(self, address, cafile):
+        self.transport = StubTransport(address, cafile)
+
+# StubChat: Posts the prompt over the model's connection and streams the reply by line.
+class StubChat:
+    def __init__(self, model):
+        self.model = model
+
+    def send_message(self, prompt, stream=True, **options):
+        return iter(self.model.client().transport.post("/generateContent", prompt).splitlines(keepends=True))
+
+class StubModel:
+    def __init__(self, address, cafile):
+        self.address = address
+        self.cafile = cafile
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            self._client = StubClient(self.address, self.cafile)
+        return self._client
+
+    def count_tokens(self, text, request_options=None):
+        return self.client().transport.post("/countTokens", text)
+
+    def start_chat(self, history=None):
+        return StubChat(self)
+
+# first_token_ms: Sends one prompt and records its time to first token.
+def first_token_ms(executor, ttfts):
+    done = threading.Event()
+    executor.on_done = executor.on_error = lambda request_id, text: done.set()
+    request = core.AIRequest("why is the build red?", "key", None)
+    executor.submit(request)
+    done.wait()
+    if request.error is not None:
+        raise RuntimeError(request.error)
+    ttfts.append(request.ttft * 1000)
+
+# main: Compares cold and warmed sends at each simulated round trip.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtt", type=float, nargs="+", default=[0, 40], help="simulated round trips in ms")
+    parser.add_argument("--repeat", type=int, default=15)
+    args = parser.parse_args()
+    work = tempfile.mkdtemp(prefix="aui-bench-warm-")
+    try:
+        cert, key = make_certificate(work)
+        print(f"{'rtt (ms)':<10}{'cold send':>12}{'warmed send':>13}{'saved':>10}{'warm-up':>10}   (median ms)")
+        for rtt in args.rtt:
+            server = StubServer(cert, key, rtt / 1000)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            cache = core.ModelCache(lambda api_key, model_name: StubModel(server.server_address, cert))
+            executor = core.RequestExecutor(1, model_cache=cache)
+            cold, warm, warm_ups = [], [], []
+            for _ in range(args.repeat):
+                # Idle timeout passed: the next send builds the client and connects.
+                cache.close()
+                first_token_ms(executor, cold)
+                cache.close()
+                # Typing started: the warm-up runs before Ctrl+Enter.
+                warm_ups.append(cache.warm("key", core.MODEL_NAME) * 1000)
+                first_token_ms(executor, warm)
+            executor.shutdown(wait=True)
+            cache.close()
+            server.shutdown()
+            server.server_close()
+            cold_ms, warm_ms = statistics.median(cold), statistics.median(warm)
+            print(f"{rtt:<10g}{cold_ms:>12.2f}{warm_ms:>13.2f}{cold_ms - warm_ms:>10.2f}"
+                  f"{statistics.median(warm_ups):>10.2f}")
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# ContextBuilder history: what a multi-turn request sends before the new prompt.
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aui_core as core  # noqa: E402
+
+# no_summary: Stands in for the model; these histories all fit the budget.
+def no_summary(prompt):
+    raise AssertionError("the budget fits every turn; nothing should be summarized")
+
+# HistoryTest: Builds history from a real session file in a temporary directory.
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="aui-test-")
+        self.path = os.path.join(self.work, f"chat_test{core.SESSION_EXT}")
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def history(self, turns, prompt="next question"):
+        store = core.SessionStore(self.path)
+        for sender, text in turns:
+            store.append(sender, text)
+        store.close()
+        return core.ContextBuilder(self.path, 8000).build(no_summary, prompt, len(turns))
+
+    def roles(self, history):
+        return [turn["role"] for turn in history]
+
+    # A prompt whose request failed is saved without a reply; the next send must not follow it
+    # with a second user turn.
+    def test_unanswered_prompt_at_the_end_is_dropped(self):
+        history = self.history([("You", "hello"), ("Gemini", "hi"), ("You", "this one failed")])
+        self.assertEqual(self.roles(history), ["user", "model"])
+        self.assertEqual(history[0]["parts"], ["hello"])
+
+    def test_ask_again_after_a_failure_sends_the_prompt_once(self):
+        history = self.history([("You", "hello"), ("Gemini", "hi"), ("You", "why?")], prompt="why?")
+        self.assertNotIn("why?", [part for turn in history for part in turn["parts"]])
+
+    def test_unanswered_prompt_in_the_middle_is_dropped(self):
+        history = self.history([("You", "stopped"), ("You", "asked again"), ("Gemini", "answer")])
+        self.assertEqual(history, [{"role": "user", "parts": ["asked again"]},
+                                   {"role": "model", "parts": ["answer"]}])
+
+    def test_history_alternates_and_ends_with_the_model(self):
+        history = self.history([("Gemini", "welcome"), ("You", "a"), ("Gemini", "b"), ("You", "c")])
+        roles = self.roles(history)
+        self.assertEqual(roles[0], "user")
+        self.assertEqual(roles[-1], "model")
+        self.assertTrue(all(first != second for first, second in zip(roles, roles[1:])))
+
+    def test_summary_alone_is_followed_by_a_model_turn(self):
+        history = core.ContextBuilder(self.path, 8000).to_history("we talked about Qt", [])
+        self.assertEqual(self.roles(history), ["user", "model"])
+
+if __name__ == "__main__":
+    unittest.main()